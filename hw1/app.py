@@ -1,28 +1,328 @@
-from flask import Flask, request, jsonify
+import argparse
+import json
+import os
+import signal
+import socket
 
+import torch
+from flask import Flask, Response, request, jsonify, stream_with_context
+from werkzeug.serving import make_server
+
+from stud import protocol
 from stud.implementation import build_model
+from stud.router import ModelRouter, UnknownModelError
 
 app = Flask(__name__)
+BAD_REQUEST = {'error': 'Bad request',
+               'message': 'There was an error processing the request. Please check logs/server.stderr'}
+# requests pick a model with this header, otherwise the traffic split (or the default model) decides
+MODEL_HEADER = 'X-Model'
 model = build_model('cpu')
+router = ModelRouter('cpu')
+router.add(model.name, model, default=True)
+# more registered models served alongside the default one, comma separated manifest paths
+for manifest_path_ in filter(None, os.environ.get('EXTRA_MODELS', '').split(',')):
+    router.load(manifest_path_)
+
+
+def _model_header():
+    return request.headers.get(MODEL_HEADER) or None
+
+
+def _unknown_model(error):
+    # router.route raises an UnknownModelError naming the model when X-Model is not registered
+    return {'error': 'Not found', 'message': error.args[0]}, 404
 
 
 @app.route("/", defaults={"path": ""}, methods=["POST", "GET"])
 @app.route("/<path:path>", methods=["POST", "GET"])
 def annotate(path):
 
+    if request.mimetype == protocol.CONTENT_TYPE:
+        return annotate_binary()
+
     try:
 
         json_body = request.json
         tokens_s = json_body['tokens_s']
-        predictions_s = model.predict(tokens_s)
+        if json_body.get('output', 'tags') == 'spans':
+            # entity spans, [start, end (excluded), type, score], instead of one tag per token
+            model_name, spans_s = router.predict(tokens_s, _model_header(), spans=True)
+            return jsonify(spans_s=spans_s), {MODEL_HEADER: model_name}
+        model_name, predictions_s = router.predict(tokens_s, _model_header())
+        if not json_body.get('echo', True):
+            return jsonify(predictions_s=predictions_s), {MODEL_HEADER: model_name}
+
+    except UnknownModelError as e:
+
+        return _unknown_model(e)
+
+    except Exception as e:
+
+        app.logger.error(e, exc_info=True)
+        return BAD_REQUEST, 400
+
+    return jsonify(tokens_s=tokens_s, predictions_s=predictions_s), {MODEL_HEADER: model_name}
+
+
+def annotate_binary():
+    """
+    Binary protocol (see stud.protocol): tokens or token ids in, tag ids (or spans if requested) out.
+    Token ids are only meaningful to the vocabulary they were encoded with, such requests are never split by
+    percentage nor shadowed: they go to the X-Model model, or to the default one.
+    """
+    try:
+        body = request.get_data()
+        spans = protocol.wants_spans(body)
+        is_encoded, sentences = protocol.decode_request(body)
+        if is_encoded:
+            model_name, student_model = router.route(_model_header() or router.table.default)
+            predictions_s = student_model.predict_encoded([ids.astype('int64') for ids in sentences], spans=spans)
+        else:
+            model_name, predictions_s = router.predict(sentences, _model_header(), spans=spans)
+            label2idx = router.table.models[model_name].label2idx
+            if spans:
+                predictions_s = [[(start, end, label2idx[label], score) for start, end, label, score in spans_]
+                                 for spans_ in predictions_s]
+            else:
+                predictions_s = [[label2idx[label] for label in labels] for labels in predictions_s]
+        payload = protocol.encode_spans(predictions_s) if spans else protocol.encode_tags(predictions_s)
+    except UnknownModelError as e:
+        return _unknown_model(e)
+    except Exception as e:
+        app.logger.error(e, exc_info=True)
+        return BAD_REQUEST, 400
+    return Response(payload, mimetype=protocol.CONTENT_TYPE, headers={MODEL_HEADER: model_name})
+
+
+@app.route("/labels", methods=["GET"])
+def labels():
+    try:
+        model_name, student_model = router.route(_model_header() or router.table.default)
+    except UnknownModelError as e:
+        return _unknown_model(e)
+    return jsonify(model=model_name, idx2label={str(idx): label for idx, label in student_model.idx2label.items()})
+
+
+def _iter_ndjson_sentences(stream):
+    """
+    Reads one sentence per line, either a json list of tokens or {"tokens": [...]}, as the body arrives
+    """
+    for line in iter(stream.readline, b''):
+        line = line.strip()
+        if line:
+            item = json.loads(line)
+            yield item['tokens'] if isinstance(item, dict) else item
+
+
+def _iter_batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@app.route("/stream", methods=["POST"])
+def annotate_stream():
+    """
+    NDJSON in, NDJSON out: sentences are read incrementally, tagged by batches of "batch_size" and streamed back
+    as soon as their batch is done, one {"index", "predictions"[, "tokens"]} per line, so neither side buffers
+    the whole document. "echo=0" omits the tokens from the response lines, "output=spans" streams
+    {"index", "spans"[, "tokens"]} lines instead, spans being [start, end (excluded), type, score]
+    """
+    echo = request.args.get('echo', '1') != '0'
+    spans = request.args.get('output', 'tags') == 'spans'
+    batch_size = max(int(request.args.get('batch_size', 32)), 1)
+    # the whole stream is tagged by one model
+    try:
+        model_name, _ = router.route(_model_header())
+    except UnknownModelError as e:
+        return _unknown_model(e)
+
+    def generate():
+        index = 0
+        try:
+            for batch in _iter_batches(_iter_ndjson_sentences(request.stream), batch_size):
+                for tokens, predictions in zip(batch, router.predict(batch, model_name, spans=spans)[1]):
+                    item = {'index': index, 'spans' if spans else 'predictions': predictions}
+                    if echo:
+                        item['tokens'] = tokens
+                    yield json.dumps(item) + '\n'
+                    index += 1
+        except Exception as e:
+            app.logger.error(e, exc_info=True)
+            yield json.dumps({**BAD_REQUEST, 'index': index}) + '\n'
 
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={MODEL_HEADER: model_name})
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    return jsonify(status='ok')
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    # the model is loaded at import time, before the server accepts any connection
+    return jsonify(ready=True)
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify(pid=os.getpid(), router=router.stats)
+
+
+def _check_admin():
+    """
+    Admin routes require the ADMIN_TOKEN (X-Admin-Token header) when it is set.
+    They change the process that serves them only: run a single worker to manage models at runtime.
+    """
+    token = os.environ.get('ADMIN_TOKEN')
+    if token and request.headers.get('X-Admin-Token') != token:
+        return {'error': 'Forbidden'}, 403
+    return None
+
+
+@app.route("/admin/models", methods=["GET"])
+def admin_models():
+    return _check_admin() or jsonify(router.stats)
+
+
+@app.route("/admin/models/<name>", methods=["PUT", "DELETE"])
+def admin_model(name):
+    """
+    PUT {"manifest": path[, "inference": {...}, "default": bool, "cascade": {"gate": path, "threshold": 0.9}]}
+    loads (or hot swaps) the model "name", DELETE unregisters it
+    """
+    forbidden = _check_admin()
+    if forbidden:
+        return forbidden
+    try:
+        if request.method == 'DELETE':
+            router.remove(name)
+        else:
+            json_body = request.json
+            router.load(json_body['manifest'], name=name, default=json_body.get('default', False),
+                        cascade=json_body.get('cascade'), **json_body.get('inference', {}))
+            if router.table.models[name].idx2label != router.table.models[router.table.default].idx2label:
+                app.logger.warning(f'{name} does not share the label map of the default model')
     except Exception as e:
+        app.logger.error(e, exc_info=True)
+        return {'error': 'Bad request', 'message': str(e)}, 400
+    return jsonify(router.stats)
+
 
+@app.route("/admin/routing", methods=["POST"])
+def admin_routing():
+    """
+    {"default": name, "weights": {name: percentage, ...}, "shadow": name or null, "shadow_rate": 0.1},
+    every key is optional
+    """
+    forbidden = _check_admin()
+    if forbidden:
+        return forbidden
+    try:
+        json_body = request.json
+        if 'default' in json_body:
+            router.set_default(json_body['default'])
+        if 'weights' in json_body:
+            router.set_weights(json_body['weights'])
+        if 'shadow' in json_body:
+            router.set_shadow(json_body['shadow'], json_body.get('shadow_rate', 0.1))
+    except Exception as e:
         app.logger.error(e, exc_info=True)
-        return {'error': 'Bad request', 'message': 'There was an error processing the request. Please check logs/server.stderr'}, 400
+        return {'error': 'Bad request', 'message': str(e)}, 400
+    return jsonify(router.stats)
+
+
+def share_weights(student_models):
+    """
+    Moves the weights to shared memory before forking, so that every worker maps the very same pages
+    instead of holding its own copy. Weights are frozen, workers only read them.
+    Weights bound to a memory mapped checkpoint are already shared by the page cache and stay where they are.
+    """
+    # a cascade holds two models
+    stages = [stage for student_model in student_models for stage in getattr(student_model, 'stages', [student_model])]
+    for stage in stages:
+        if not getattr(stage.model, 'memory_mapped', False):
+            stage.model.share_memory()
+        for param in stage.model.parameters():
+            param.requires_grad_(False)
+
+
+def _run_worker(listener, host, port, threads):
+    # One intra-op thread pool per worker, sized so that workers together do not oversubscribe the cores
+    torch.set_num_threads(threads)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    server = make_server(host, port, app, fd=listener.fileno())
+    server.serve_forever()
 
-    return jsonify(tokens_s=tokens_s, predictions_s=predictions_s)
+
+def serve_prefork(host, port, workers, threads):
+    """
+    Pre-fork server: the parent loads the model once and binds the socket, forked workers inherit both and
+    accept connections on the shared socket. Workers that die are replaced, SIGTERM / SIGINT stop them all.
+    """
+    share_weights(router.table.models.values())
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+    listener.set_inheritable(True)
+
+    pids = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(listener, host, port, threads)
+            finally:
+                os._exit(0)
+        pids.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    app.logger.warning(f'Serving on {host}:{port} with {workers} workers, {threads} threads each')
+
+    while pids:
+        pid, _ = os.wait()
+        pids.discard(pid)
+        if not stopping:
+            app.logger.warning(f'Worker {pid} exited, starting a new one')
+            spawn()
+    listener.close()
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=12345)
+    parser = argparse.ArgumentParser(description='NER tagging server')
+    parser.add_argument('--host', type=str, default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=12345)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WORKERS', 1)),
+                        help='number of forked worker processes sharing the model weights')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='intra-op threads per worker, defaults to cores / workers')
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        threads_ = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+        serve_prefork(args.host, args.port, args.workers, threads_)
+    else:
+        if args.threads is not None:
+            torch.set_num_threads(args.threads)
+        app.run(host=args.host, port=args.port)
@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from stud import protocol
+from stud.implementation import build_model
+
+"""
+ASGI entry point of the tagging service, same request/response contract as app.py (JSON, binary protocol and
+NDJSON streaming on POST /stream), serving the single model of build_model (no multi model routing nor admin routes).
+Inference runs on a bounded executor: when more than MAX_QUEUE requests are waiting, new ones are rejected at once
+with a 503 instead of piling up. GET /health answers as soon as the process is up, GET /ready once the model is
+loaded and until shutdown starts. On shutdown, requests in flight are drained before the executor is stopped.
+
+    PYTHONPATH=hw1 uvicorn asgi:app --host 0.0.0.0 --port 12345
+"""
+
+MAX_QUEUE = int(os.environ.get('MAX_QUEUE', 64))
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 1))
+DRAIN_TIMEOUT = float(os.environ.get('DRAIN_TIMEOUT', 30))
+
+BAD_REQUEST = {'error': 'Bad request',
+               'message': 'There was an error processing the request. Please check logs/server.stderr'}
+
+logger = logging.getLogger('asgi')
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+class InferenceService:
+    """
+    Owns the model and the executor inference runs on, counts the requests waiting or running on it
+    """
+
+    def __init__(self, max_queue=MAX_QUEUE, workers=INFERENCE_WORKERS):
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+        self.pending = set()
+        self.model = None
+        self.draining = False
+
+    @property
+    def ready(self):
+        return self.model is not None and not self.draining
+
+    def start(self):
+        """
+        Loads the model on the executor, the event loop keeps answering /health meanwhile
+        """
+        future = asyncio.get_event_loop().run_in_executor(self.executor, build_model, 'cpu')
+        future.add_done_callback(self._on_loaded)
+
+    def _on_loaded(self, future):
+        if future.exception() is not None:
+            logger.error('Model could not be loaded', exc_info=future.exception())
+            return
+        self.model = future.result()
+        logger.info('Model loaded, ready to serve')
+
+    async def run(self, fn, *args):
+        if not self.ready:
+            raise ServiceUnavailable('Service is not ready')
+        if len(self.pending) >= self.max_queue:
+            raise ServiceUnavailable('Too many pending requests')
+        future = asyncio.get_event_loop().run_in_executor(self.executor, fn, *args)
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+        return await future
+
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        self.draining = True
+        if self.pending:
+            logger.info(f'Draining {len(self.pending)} pending requests')
+            await asyncio.wait(set(self.pending), timeout=timeout)
+        self.executor.shutdown(wait=True)
+
+
+service = InferenceService()
+
+
+async def read_body(receive):
+    body, more_body = b'', True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+async def send_response(send, status, body, content_type='application/json', headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type.encode('latin-1')),
+                            (b'content-length', str(len(body)).encode('latin-1')), *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, status, obj, headers=()):
+    await send_response(send, status, json.dumps(obj).encode('utf-8'), headers=headers)
+
+
+def annotate_json(body):
+    json_body = json.loads(body)
+    tokens_s = json_body['tokens_s']
+    if json_body.get('output', 'tags') == 'spans':
+        # entity spans, [start, end (excluded), type, score], instead of one tag per token
+        return {'spans_s': service.model.predict_spans(tokens_s)}
+    predictions_s = service.model.predict(tokens_s)
+    if not json_body.get('echo', True):
+        return {'predictions_s': predictions_s}
+    return {'tokens_s': tokens_s, 'predictions_s': predictions_s}
+
+
+def annotate_binary(body):
+    spans = protocol.wants_spans(body)
+    is_encoded, sentences = protocol.decode_request(body)
+    label2idx = service.model.label2idx
+    if is_encoded:
+        predictions_s = service.model.predict_encoded([ids.astype('int64') for ids in sentences], spans=spans)
+    elif spans:
+        predictions_s = [[(start, end, label2idx[label], score) for start, end, label, score in spans_]
+                         for spans_ in service.model.predict_spans(sentences)]
+    else:
+        predictions_s = [[label2idx[label] for label in labels] for labels in service.model.predict(sentences)]
+    return protocol.encode_spans(predictions_s) if spans else protocol.encode_tags(predictions_s)
+
+
+async def iter_ndjson_sentences(receive):
+    """
+    Yields the sentences of an NDJSON body (see app._iter_ndjson_sentences) as its chunks arrive
+    """
+    buffer, more_body = b'', True
+    while more_body:
+        message = await receive()
+        buffer += message.get('body', b'')
+        more_body = message.get('more_body', False)
+        *lines, buffer = buffer.split(b'\n')
+        if not more_body:
+            lines.append(buffer)
+        for line in lines:
+            line = line.strip()
+            if line:
+                item = json.loads(line)
+                yield item['tokens'] if isinstance(item, dict) else item
+
+
+def annotate_lines(batch, start_index, echo, spans=False):
+    lines = []
+    predictions_s = service.model.predict_spans(batch) if spans else service.model.predict(batch)
+    for index, (tokens, predictions) in enumerate(zip(batch, predictions_s), start=start_index):
+        item = {'index': index, 'spans' if spans else 'predictions': predictions}
+        if echo:
+            item['tokens'] = tokens
+        lines.append(json.dumps(item) + '\n')
+    return ''.join(lines).encode('utf-8')
+
+
+async def annotate_stream(scope, receive, send):
+    """
+    NDJSON in, NDJSON out, as POST /stream of app.py: every batch of "batch_size" sentences is tagged on the
+    executor and sent back as soon as it is done. Errors after the response started are reported in-band.
+    """
+    if not service.ready:
+        await send_json(send, 503, {'error': 'Service unavailable', 'message': 'Service is not ready'},
+                        headers=[(b'retry-after', b'1')])
+        return
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    echo = query.get('echo', ['1'])[0] != '0'
+    spans = query.get('output', ['tags'])[0] == 'spans'
+    batch_size = max(int(query.get('batch_size', ['32'])[0]), 1)
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'application/x-ndjson')]})
+
+    index, batch = 0, []
+    try:
+        async for tokens in iter_ndjson_sentences(receive):
+            batch.append(tokens)
+            if len(batch) == batch_size:
+                body = await service.run(annotate_lines, batch, index, echo, spans)
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+                index, batch = index + len(batch), []
+        if batch:
+            body = await service.run(annotate_lines, batch, index, echo, spans)
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        error = {**BAD_REQUEST, 'index': index}
+        if isinstance(e, ServiceUnavailable):
+            error = {'error': 'Service unavailable', 'message': str(e), 'index': index}
+        await send({'type': 'http.response.body', 'body': (json.dumps(error) + '\n').encode('utf-8'),
+                    'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            service.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await service.drain()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    path, method = scope['path'], scope['method']
+    if method == 'GET' and path == '/health':
+        await send_json(send, 200, {'status': 'ok'})
+        return
+    if method == 'GET' and path == '/ready':
+        await send_json(send, 200 if service.ready else 503, {'ready': service.ready, 'pending': len(service.pending)})
+        return
+    if method == 'GET' and path in ('/stats', '/labels') and service.model is not None:
+        if path == '/stats':
+            await send_json(send, 200, {'pid': os.getpid(), 'pending': len(service.pending),
+                                        'cache': service.model.cache_stats})
+        else:
+            await send_json(send, 200, {'idx2label': {str(idx): label
+                                                      for idx, label in service.model.idx2label.items()}})
+        return
+    if method not in ('GET', 'POST'):
+        await send_json(send, 405, {'error': 'Method not allowed'})
+        return
+    if method == 'POST' and path == '/stream':
+        await annotate_stream(scope, receive, send)
+        return
+
+    content_type = dict(scope['headers']).get(b'content-type', b'').split(b';')[0].strip().decode('latin-1')
+    body = await read_body(receive)
+    try:
+        if content_type == protocol.CONTENT_TYPE:
+            await send_response(send, 200, await service.run(annotate_binary, body), protocol.CONTENT_TYPE)
+        else:
+            await send_json(send, 200, await service.run(annotate_json, body))
+    except ServiceUnavailable as e:
+        await send_json(send, 503, {'error': 'Service unavailable', 'message': str(e)},
+                        headers=[(b'retry-after', b'1')])
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        await send_json(send, 400, BAD_REQUEST)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='NER tagging server, ASGI flavour')
+    parser.add_argument('--host', type=str, default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=12345)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s - %(asctime)s: %(message)s', datefmt='%H:%M:%S', level=logging.INFO)
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -3,14 +3,17 @@ import logging
 logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
 
 import argparse
+import json
 import requests
 import time
 
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, Timeout
 from sklearn.metrics import precision_score, recall_score, f1_score
 from tqdm import tqdm
 from typing import Tuple, List, Any, Dict
 
+from stud import protocol
+
 
 def flat_list(l: List[List[Any]]) -> List[Any]:
     return [_e for e in l for _e in e]
@@ -53,7 +56,52 @@ def read_dataset(path: str) -> Tuple[List[List[str]], List[List[str]]]:
     return tokens_s, labels_s
 
 
-def main(test_path: str, endpoint: str, batch_size=32):
+def stream_predictions(endpoint: str, tokens_s: List[List[str]], progress_bar, batch_size=32) -> List[List[str]]:
+    """
+    Posts sentences as NDJSON to the /stream endpoint and collects the predictions as they are streamed back
+    """
+    body = (f'{json.dumps(tokens)}\n'.encode('utf-8') for tokens in tokens_s)
+    response = requests.post(f'{endpoint}/stream', params={'echo': 0, 'batch_size': batch_size}, data=body,
+                             headers={'Content-Type': 'application/x-ndjson'}, stream=True)
+    predictions_s = [None] * len(tokens_s)
+    for line in response.iter_lines():
+        if not line:
+            continue
+        item = json.loads(line)
+        if 'error' in item:
+            logging.error(f'Server failed while streaming, response was: {item}')
+            exit(1)
+        predictions_s[item['index']] = item['predictions']
+        progress_bar.update(1)
+    return predictions_s
+
+
+def wait_until_ready(endpoint: str, timeout=100.0, interval=0.5) -> bool:
+    """
+    Polls the server readiness route until it answers 200, instead of sleeping blindly
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f'{endpoint}/ready', timeout=5).status_code == 200:
+                return True
+        except (ConnectionError, Timeout):
+            pass
+        time.sleep(interval)
+    return False
+
+
+def binary_predictions(endpoint: str, tokens_s: List[List[str]], idx2label: Dict[int, str]) -> List[List[str]]:
+    """
+    Posts sentences with the compact binary protocol, tag ids are mapped back to labels locally
+    """
+    response = requests.post(endpoint, data=protocol.encode_tokens(tokens_s),
+                             headers={'Content-Type': protocol.CONTENT_TYPE})
+    response.raise_for_status()
+    return [[idx2label[tag] for tag in tags.tolist()] for tags in protocol.decode_tags(response.content)]
+
+
+def main(test_path: str, endpoint: str, batch_size=32, stream=False, document_size=1024, binary=False):
 
     try:
         tokens_s, labels_s = read_dataset(test_path)
@@ -66,43 +114,43 @@ def main(test_path: str, endpoint: str, batch_size=32):
         logging.error(e, exc_info=True)
         exit(1)
 
-    max_try = 10
-    iterator = iter(range(max_try))
-
-    while True:
-
-        try:
-            i = next(iterator)
-        except StopIteration:
-            logging.error(f'Impossible to establish a connection to the server even after 10 tries')
-            logging.error('The server is not booting and, most likely, you have some error in build_model or StudentClass')
-            logging.error('You can find more information inside logs/. Checkout both server.stdout and, most importantly, server.stderr')
-            exit(1)
-
-        logging.info(f'Waiting 10 second for server to go up: trial {i}/{max_try}')
-        time.sleep(10)
+    max_wait = 100
+    logging.info(f'Waiting up to {max_wait} seconds for the server to be ready')
+    if not wait_until_ready(endpoint, timeout=max_wait):
+        logging.error(f'The server was not ready even after {max_wait} seconds')
+        logging.error('The server is not booting and, most likely, you have some error in build_model or StudentClass')
+        logging.error('You can find more information inside logs/. Checkout both server.stdout and, most importantly, server.stderr')
+        exit(1)
 
-        try:
-            response = requests.post(endpoint, json={'tokens_s': [['My', 'name', 'is', 'Robin', 'Hood']]}).json()
-            response['predictions_s']
-            logging.info('Connection succeded')
-            break
-        except ConnectionError as e:
-            continue
-        except KeyError as e:
-            logging.error(f'Server response in wrong format')
-            logging.error(f'Response was: {response}')
-            logging.error(e, exc_info=True)
-            exit(1)
+    try:
+        response = requests.post(endpoint, json={'tokens_s': [['My', 'name', 'is', 'Robin', 'Hood']]}).json()
+        response['predictions_s']
+        logging.info('Connection succeded')
+    except KeyError as e:
+        logging.error(f'Server response in wrong format')
+        logging.error(f'Response was: {response}')
+        logging.error(e, exc_info=True)
+        exit(1)
 
     predictions_s = []
+    if binary:
+        idx2label = {int(idx): label for idx, label in requests.get(f'{endpoint}/labels').json()['idx2label'].items()}
 
     progress_bar = tqdm(total=len(tokens_s), desc='Evaluating')
 
-    for i in range(0, len(tokens_s), batch_size):
-        batch = tokens_s[i: i + batch_size]
+    # in streaming mode the test set is sent as documents of document_size sentences
+    step = document_size if stream else batch_size
+    for i in range(0, len(tokens_s), step):
+        batch = tokens_s[i: i + step]
         try:
-            response = requests.post(endpoint, json={'tokens_s': batch}).json()
+            if stream:
+                predictions_s += stream_predictions(endpoint, batch, progress_bar, batch_size)
+                continue
+            if binary:
+                predictions_s += binary_predictions(endpoint, batch, idx2label)
+                progress_bar.update(len(batch))
+                continue
+            response = requests.post(endpoint, json={'tokens_s': batch, 'echo': False}).json()
             predictions_s += response['predictions_s']
         except KeyError as e:
             logging.error(f'Server response in wrong format')
@@ -137,9 +185,13 @@ def main(test_path: str, endpoint: str, batch_size=32):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("file", type=str, help='File containing data you want to evaluate upon')
+    parser.add_argument("--stream", action='store_true', help='Use the streaming NDJSON endpoint')
+    parser.add_argument("--binary", action='store_true', help='Use the compact binary protocol')
     args = parser.parse_args()
 
     main(
         test_path=args.file,
-        endpoint='http://127.0.0.1:12345'
+        endpoint='http://127.0.0.1:12345',
+        stream=args.stream,
+        binary=args.binary
     )
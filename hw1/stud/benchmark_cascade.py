@@ -0,0 +1,56 @@
+import argparse
+import json
+import os
+
+import torch
+
+from stud.data_loader.corpus_stats import iter_tsv_sentences
+from stud.evaluator.benchmark import benchmark_tagger, print_benchmark
+from stud.implementation import StudentModel, CascadeModel, DEFAULT_MANIFEST
+from stud.utilities import configure_workspace
+
+"""
+Accuracy impact & throughput of the cascade (see CascadeModel) for several gate thresholds, against the full
+model alone and the gate alone, on the test set. Caches are disabled so that every sentence is actually tagged.
+
+    PYTHONPATH=hw1 python -m stud.benchmark_cascade --gate model/Distilled_BiLSTM_1x128.manifest.json
+"""
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the gate -> CRF cascade')
+    parser.add_argument('--full', type=str, default=os.path.join(os.getcwd(), DEFAULT_MANIFEST),
+                        help='manifest of the full model')
+    parser.add_argument('--gate', type=str, required=True, help='manifest of the gate model')
+    parser.add_argument('--test', type=str, default=os.path.join(os.getcwd(), 'data', 'test.tsv'))
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.5, 0.8, 0.9, 0.95, 0.99])
+    parser.add_argument('--batch-size', type=int, default=32, help='sentences per request')
+    parser.add_argument('--threads', type=int, default=1, help='intra-op threads while benchmarking')
+    parser.add_argument('--out', type=str, default=None, help='optional json report path')
+    args = parser.parse_args()
+
+    configure_workspace(seed=1873337)
+    torch.set_num_threads(args.threads)
+    full = StudentModel('cpu', manifest_path=args.full, cache_size=0)
+    gate = StudentModel('cpu', manifest_path=args.gate, cache_size=0)
+    test_tokens, test_labels = zip(*iter_tsv_sentences(args.test))
+    test_tokens, test_labels = list(test_tokens), list(test_labels)
+    entity_free = sum(all(label == 'O' for label in labels) for labels in test_labels) / max(len(test_labels), 1)
+
+    results = [benchmark_tagger(full.name, full.predict, test_tokens, test_labels, args.batch_size, model=full.model),
+               benchmark_tagger(gate.name, gate.predict, test_tokens, test_labels, args.batch_size, model=gate.model)]
+    for threshold in args.thresholds:
+        cascade = CascadeModel(gate, full, threshold)
+        # the counters are reset after the warmup, so that the forwarded rate covers the test set exactly once
+        result = benchmark_tagger(f'{cascade.name} @ {threshold}', cascade.predict, test_tokens, test_labels,
+                                  args.batch_size, after_warmup=cascade.reset_stats)
+        result['forwarded_rate'] = cascade.cascade_stats['forwarded_rate']
+        results.append(result)
+
+    print(f'{100 * entity_free:.1f}% of the test sentences have no entity')
+    print_benchmark(results)
+    for result in results[2:]:
+        print(f"{result['name']}: {100 * result['forwarded_rate']:.1f}% of the sentences reach {full.name}")
+    if args.out is not None:
+        with open(args.out, encoding='utf-8', mode='w+') as f:
+            json.dump({'entity_free_sentences': entity_free, 'results': results}, f, indent=2)
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+from os import getcwd
+from os.path import join
+
+import torch
+from torch.optim import Adam
+from torch.utils.data import DataLoader
+
+from data_loader import TSVDatasetParser, BucketBatchSampler, iter_tsv_sentences
+from evaluator import benchmark_tagger, print_benchmark, crf_tagger
+from models import HyperParameters, CRF_Model, build_from_manifest, manifest_path, write_manifest
+from training import CRF_Trainer
+from utilities import configure_workspace
+
+"""
+Compares the iterated dilated CNN encoder with the stacked BiLSTM one, both under the CRF head: F1 and throughput
+on the test set, and throughput on long sentences (consecutive test sentences joined together), where the LSTM
+sequential dependency costs the most.
+"""
+
+
+def join_sentences(tokens_s, labels_s, factor):
+    """
+    Concatenates every `factor` consecutive sentences into one, to measure how taggers scale with length
+    """
+    joined_tokens, joined_labels = [], []
+    for start in range(0, len(tokens_s), factor):
+        joined_tokens.append([token for tokens in tokens_s[start: start + factor] for token in tokens])
+        joined_labels.append([label for labels in labels_s[start: start + factor] for label in labels])
+    return joined_tokens, joined_labels
+
+
+if __name__ == '__main__':
+    MODEL_PATH = join(getcwd(), 'model')
+    DATA_PATH = join(getcwd(), 'data')
+    lstm_name = 'Stacked_BiLSTM_CRF_Fasttext_2315'
+
+    parser = argparse.ArgumentParser(description='Benchmarks the IDCNN CRF against the BiLSTM CRF')
+    parser.add_argument('--lstm', type=str, default=manifest_path(MODEL_PATH, lstm_name),
+                        help='manifest of the BiLSTM CRF')
+    parser.add_argument('--idcnn', type=str, default=None,
+                        help='manifest of a trained IDCNN CRF, trained from scratch if missing')
+    parser.add_argument('--epochs', type=int, default=20, help='IDCNN CRF training epochs')
+    parser.add_argument('--max-tokens', type=int, default=4096, help='padded tokens per training batch')
+    parser.add_argument('--long-factor', type=int, default=8, help='test sentences joined per long sentence')
+    parser.add_argument('--threads', type=int, default=1, help='intra-op threads while benchmarking')
+    parser.add_argument('--out-dir', type=str, default=MODEL_PATH)
+    args = parser.parse_args()
+
+    configure_workspace(seed=1873337)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    lstm_model, word2idx, idx2label, lstm_manifest = build_from_manifest(args.lstm, device)
+    lstm_name = lstm_manifest['name']
+    labels2idx = {label: idx for idx, label in idx2label.items()}
+
+    if args.idcnn is not None:
+        idcnn_model, _, _, idcnn_manifest = build_from_manifest(args.idcnn, device)
+        idcnn_name = idcnn_manifest['name']
+    else:
+        idcnn_name = 'IDCNN_CRF'
+        hp = HyperParameters(idcnn_name, word2idx, labels2idx, lstm_model.word_embedding.weight.detach().cpu(), 128)
+        hp.encoder = 'idcnn'
+        idcnn_model = CRF_Model(hp).to(device)
+        train_dataset = TSVDatasetParser(join(DATA_PATH, 'train.tsv'), max_len=80, is_crf=True)
+        dev_dataset = TSVDatasetParser(join(DATA_PATH, 'dev.tsv'), max_len=80, is_crf=True)
+        train_dataset.encode_dataset(word2idx, labels2idx)
+        dev_dataset.encode_dataset(word2idx, labels2idx)
+        train_dataset_ = DataLoader(dataset=train_dataset, collate_fn=TSVDatasetParser.pad_batch,
+                                    batch_sampler=BucketBatchSampler(train_dataset.lengths, args.max_tokens))
+        dev_dataset_ = DataLoader(dataset=dev_dataset, collate_fn=TSVDatasetParser.pad_batch,
+                                  batch_sampler=BucketBatchSampler(dev_dataset.lengths, args.max_tokens,
+                                                                   shuffle=False))
+        trainer = CRF_Trainer(model=idcnn_model, loss_function=None, optimizer=Adam(idcnn_model.parameters()),
+                              label_vocab=labels2idx, writer=None)
+        trainer.train(train_dataset_, dev_dataset_, epochs=args.epochs)
+        os.makedirs(args.out_dir, exist_ok=True)
+        idcnn_model.save_checkpoint(join(args.out_dir, f'{idcnn_name}.pt'))
+        write_manifest(manifest_path(args.out_dir, idcnn_name), idcnn_name, 'CRF_Model', hp,
+                       join(args.out_dir, f'{idcnn_name}.pth'), lstm_manifest['vocab']['path'],
+                       lstm_manifest['labels']['path'], lstm_manifest['inference'])
+    lstm_model.eval()
+    idcnn_model.eval()
+
+    torch.set_num_threads(args.threads)
+    test_tokens, test_labels = zip(*iter_tsv_sentences(join(DATA_PATH, 'test.tsv')))
+    test_tokens, test_labels = list(test_tokens), list(test_labels)
+    long_tokens, long_labels = join_sentences(test_tokens, test_labels, args.long_factor)
+
+    report = {}
+    for split, (tokens_s, labels_s) in [('test', (test_tokens, test_labels)),
+                                        (f'test_x{args.long_factor}', (long_tokens, long_labels))]:
+        results = [benchmark_tagger(f'{name} ({split})', crf_tagger(model, word2idx, idx2label), tokens_s, labels_s,
+                                    model=model)
+                   for name, model in [(lstm_name, lstm_model), (idcnn_name, idcnn_model)]]
+        print_benchmark(results)
+        report[split] = results
+    with open(join(args.out_dir, f'{idcnn_name}_benchmark.json'), encoding='utf-8', mode='w+') as f:
+        json.dump(report, f, indent=2)
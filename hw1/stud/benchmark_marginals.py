@@ -0,0 +1,107 @@
+import argparse
+import json
+import time
+from os import getcwd
+from os.path import join
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from data_loader import iter_tsv_sentences
+from models import build_from_manifest, manifest_path, crf_marginals
+from utilities import configure_workspace
+
+"""
+Measures the cost of the CRF marginals (forward-backward) against plain Viterbi decoding on the test set, and how
+well they are calibrated: token accuracy per confidence bucket, and the share of sentences (and of their errors)
+whose least confident token falls below a threshold, i.e. what a "send low confidence sentences to a stronger
+model" policy would forward.
+"""
+
+
+def encode_batches(tokens_s, word2idx, batch_size, device):
+    for start in range(0, len(tokens_s), batch_size):
+        inputs = pad_sequence([torch.LongTensor([word2idx.get(word.lower(), 1) for word in tokens])
+                               for tokens in tokens_s[start: start + batch_size]], batch_first=True).to(device)
+        yield inputs, (inputs != 0).to(dtype=torch.uint8)
+
+
+if __name__ == '__main__':
+    MODEL_PATH = join(getcwd(), 'model')
+    DATA_PATH = join(getcwd(), 'data')
+
+    parser = argparse.ArgumentParser(description='Cost & calibration of the CRF marginals')
+    parser.add_argument('--manifest', type=str, default=manifest_path(MODEL_PATH, 'Stacked_BiLSTM_CRF_Fasttext_2315'))
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=1, help='intra-op threads while benchmarking')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.5, 0.7, 0.9, 0.95, 0.99])
+    parser.add_argument('--out', type=str, default=None, help='optional json report path')
+    args = parser.parse_args()
+
+    configure_workspace(seed=1873337)
+    torch.set_num_threads(args.threads)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model, word2idx, idx2label, manifest = build_from_manifest(args.manifest, device)
+    label2idx = {label: idx for idx, label in idx2label.items()}
+    test_tokens, test_labels = zip(*iter_tsv_sentences(join(DATA_PATH, 'test.tsv')))
+    batches = list(encode_batches(list(test_tokens), word2idx, args.batch_size, device))
+
+    timings = {'encoder': 0.0, 'viterbi': 0.0, 'marginals': 0.0}
+    tags_s, confidences_s = [], []
+    with torch.no_grad():
+        for inputs, mask in batches:
+            begin = time.perf_counter()
+            emissions = model(inputs)
+            encoded = time.perf_counter()
+            batch_tags = model.crf.decode(emissions, mask=mask)
+            decoded = time.perf_counter()
+            marginals = crf_marginals(model.crf, emissions, mask)
+            # the confidence of a token is the marginal of its Viterbi tag
+            tags = torch.zeros_like(inputs)
+            for idx, tags_ in enumerate(batch_tags):
+                tags[idx, :len(tags_)] = torch.as_tensor(tags_, dtype=torch.long)
+            confidences = marginals.gather(-1, tags.unsqueeze(-1)).squeeze(-1).tolist()
+            done = time.perf_counter()
+            timings['encoder'] += encoded - begin
+            timings['viterbi'] += decoded - encoded
+            timings['marginals'] += done - decoded
+            tags_s += batch_tags
+            confidences_s += [confidences_[:len(tags_)] for tags_, confidences_ in zip(batch_tags, confidences)]
+
+    buckets = {}
+    sentences = []
+    for tags, confidences, labels in zip(tags_s, confidences_s, test_labels):
+        errors = 0
+        for tag, confidence, label in zip(tags, confidences, labels):
+            bucket = min(int(confidence * 10), 9)
+            total, correct = buckets.get(bucket, (0, 0))
+            buckets[bucket] = (total + 1, correct + (tag == label2idx[label]))
+            errors += tag != label2idx[label]
+        sentences.append((min(confidences, default=1.0), errors))
+    total_errors = max(sum(errors for _, errors in sentences), 1)
+
+    plain = timings['encoder'] + timings['viterbi']
+    report = {
+        'model': manifest['name'],
+        'sentences': len(tags_s),
+        'seconds': timings,
+        'marginals_overhead': timings['marginals'] / max(plain, 1e-9),
+        'calibration': {f'{bucket / 10:.1f}-{(bucket + 1) / 10:.1f}': {'tokens': total, 'accuracy': correct / total}
+                        for bucket, (total, correct) in sorted(buckets.items())},
+        'thresholds': {str(threshold): {
+            'sentences_forwarded': sum(conf < threshold for conf, _ in sentences) / max(len(sentences), 1),
+            'errors_covered': sum(errors for conf, errors in sentences if conf < threshold) / total_errors}
+            for threshold in args.thresholds},
+    }
+
+    print("========== CRF Marginals ==========")
+    print(f"Encoder: {timings['encoder']:.3f}s, Viterbi: {timings['viterbi']:.3f}s, "
+          f"Marginals: {timings['marginals']:.3f}s (+{100 * report['marginals_overhead']:.1f}% over plain decoding)")
+    for bucket, stats in report['calibration'].items():
+        print(f"confidence {bucket}: {stats['tokens']} tokens, accuracy {stats['accuracy']:.4f}")
+    for threshold, stats in report['thresholds'].items():
+        print(f"min confidence < {threshold}: {100 * stats['sentences_forwarded']:.1f}% of the sentences, "
+              f"{100 * stats['errors_covered']:.1f}% of the token errors")
+    if args.out is not None:
+        with open(args.out, encoding='utf-8', mode='w+') as f:
+            json.dump(report, f, indent=2)
@@ -1,18 +1,10 @@
-import os
 import numpy as np
-import torch
-<<<<<<< Updated upstream:callbacks/modelcheckpoint.py
-from utilities import ensure_dir
-
-class ModelCheckpoint(object):
-=======
-from stud.utilities import ensure_dir
+from stud.utilities import ensure_dir, CheckpointWriter
 
 class ModelCheckpoint(object):
     """
-    Defines ModelCheckpoint callback
+    Defines ModelCheckpoint callback, checkpoints are written atomically on a background thread
     """
->>>>>>> Stashed changes:hw1/stud/callbacks/modelcheckpoint.py
 
     def __init__(self, checkpoint_dir,
                  monitor,
@@ -23,7 +15,8 @@ class ModelCheckpoint(object):
                  epoch_model_name = None,
                  mode='min',
                  epoch_freq=1,
-                 best = None):
+                 best = None,
+                 keep_last=3):
         self.monitor = monitor
         self.checkpoint_dir = checkpoint_dir
         self.save_best_only = save_best_only
@@ -47,23 +40,34 @@ class ModelCheckpoint(object):
         if best:
             self.best = best
         ensure_dir(self.checkpoint_dir.format(arch = self.arch))
+        best_filename = self.best_model_name.format(arch = self.arch) if self.best_model_name else f'{self.arch}_best.pth'
+        self.writer = CheckpointWriter(self.checkpoint_dir.format(arch = self.arch),
+                                       best_filename=best_filename,
+                                       keep_last=keep_last)
 
     def step(self, state,current):
+        is_best = self.monitor_op(current, self.best)
+        if is_best:
+            self.logger.info('\nEpoch %d: %s improved from %0.5f to %0.5f'% (state['epoch'], self.monitor, self.best,current))
+            self.best = current
+            state['best'] = self.best
         # 是否保存最好模型
         if self.save_best_only:
-            if self.monitor_op(current, self.best):
-                self.logger.info('\nEpoch %d: %s improved from %0.5f to %0.5f'% (state['epoch'], self.monitor, self.best,current))
-                self.best = current
-                state['best'] = self.best
-                best_path = os.path.join(self.checkpoint_dir.format(arch = self.arch), self.best_model_name.format(arch = self.arch))
-                torch.save(state, best_path)
+            if is_best:
+                self.writer.save(state, is_best=True)
         # 每隔几个epoch保存下模型
         else:
-            filename = os.path.join(self.checkpoint_dir.format(arch = self.arch), self.epoch_model_name.format(arch=self.arch,
-                                                                                epoch=state['epoch'],
-                                                                                val_loss=state[self.monitor]
-                                                                                )
-                                    )
+            filename = self.epoch_model_name.format(arch=self.arch,
+                                                    epoch=state['epoch'],
+                                                    val_loss=state[self.monitor])
             if state['epoch'] % self.epoch_freq == 0:
                 self.logger.info("\nEpoch %d: save model to disk."%(state['epoch']))
-                torch.save(state, filename)
+                self.writer.save(state, filename, is_best=is_best)
+            elif is_best:
+                self.writer.save(state, is_best=True)
+
+    def close(self):
+        """
+        Waits for pending checkpoints to be written
+        """
+        self.writer.close()
@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+from os import getcwd
+from os.path import join
+
+import torch
+from torch.utils.data import DataLoader
+
+from data_loader import TSVDatasetParser, CorpusProfiler
+from evaluator import Evaluator
+from models import HyperParameters, CRF_Model, write_manifest, manifest_path
+from utilities import (configure_workspace, load_pickle, save_pickle, atomic_save, prune_vocabulary,
+                       compress_state_dict)
+
+"""
+Shrinks a trained CRF_Model for deployment: prunes the vocabulary by training corpus frequency, then optionally
+compresses the remaining embeddings (low rank factorization or product quantization). Writes the compact
+checkpoint, the remapped word2idx and a json report of sizes and of the F1 delta on the test set.
+"""
+
+
+def evaluate_f1(model, test_set, word2idx, batch_size=128):
+    test_set.encoded_data = []
+    test_set.encode_dataset(word2idx, test_set.labels2idx)
+    test_loader = DataLoader(test_set, batch_size=batch_size, collate_fn=TSVDatasetParser.pad_batch)
+    evaluator = Evaluator(model, test_loader, is_crf=True)
+    with torch.no_grad():
+        evaluator.compute_scores()
+    return evaluator.macro_scores[2]
+
+
+def build_crf_model(model_name, word2idx, labels2idx, compression=None, **compression_params):
+    hp = HyperParameters(model_name, word2idx, labels2idx, None, 128)
+    hp.embedding_compression = compression
+    for key, value in compression_params.items():
+        setattr(hp, key, value)
+    model = CRF_Model(hp).to('cpu')
+    model.eval()
+    return model, hp
+
+
+def embedding_bytes(model):
+    module = model.word_embedding
+    return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+
+
+if __name__ == '__main__':
+    MODEL_PATH = join(getcwd(), 'model')
+    DATA_PATH = join(getcwd(), 'data')
+    model_name = 'Stacked_BiLSTM_CRF_Fasttext_2315'
+
+    parser = argparse.ArgumentParser(description='Prunes and compresses the embeddings table of a CRF_Model')
+    parser.add_argument('--model', type=str, default=join(MODEL_PATH, f'{model_name}.pth'))
+    parser.add_argument('--word2idx', type=str, default=join(MODEL_PATH, f'{model_name}_word2idx.pkl'))
+    parser.add_argument('--idx2label', type=str, default=join(MODEL_PATH, f'{model_name}_idx2label.pkl'))
+    parser.add_argument('--train', type=str, default=join(DATA_PATH, 'train.tsv'),
+                        help='corpus the words frequencies are counted on')
+    parser.add_argument('--test', type=str, default=join(DATA_PATH, 'test.tsv'))
+    parser.add_argument('--min-count', type=int, default=2, help='words seen less often are pruned')
+    parser.add_argument('--max-vocab', type=int, default=None, help='max vocabulary size after pruning')
+    parser.add_argument('--method', choices=['none', 'low_rank', 'pq'], default='none')
+    parser.add_argument('--rank', type=int, default=64, help='rank of the low rank factorization')
+    parser.add_argument('--subvectors', type=int, default=30, help='product quantization sub vectors per row')
+    parser.add_argument('--centroids', type=int, default=256, help='product quantization centroids per sub vector')
+    parser.add_argument('--out-dir', type=str, default=MODEL_PATH)
+    args = parser.parse_args()
+
+    configure_workspace(seed=1873337)
+    method = None if args.method == 'none' else args.method
+    compression_params = {'embedding_rank': args.rank, 'pq_subvectors': args.subvectors,
+                          'pq_centroids': args.centroids}
+    out_name = f'{model_name}_{args.method}'
+
+    word2idx = load_pickle(args.word2idx)
+    test_set = TSVDatasetParser(args.test, max_len=None, is_crf=True)
+    labels2idx = test_set.labels2idx
+
+    model, _ = build_crf_model(model_name, word2idx, labels2idx)
+    model.load_state_dict(torch.load(args.model, map_location='cpu'))
+    original_f1 = evaluate_f1(model, test_set, word2idx)
+    original_bytes = embedding_bytes(model)
+
+    token_counts = CorpusProfiler().update_from_file(args.train).token_counts
+    new_word2idx, kept_indices = prune_vocabulary(word2idx, token_counts, args.min_count, args.max_vocab)
+    state_dict = compress_state_dict(model.state_dict(), kept_indices, method, rank=args.rank,
+                                     num_subvectors=args.subvectors, num_centroids=args.centroids)
+
+    compressed_model, compressed_hp = build_crf_model(model_name, new_word2idx, labels2idx, method,
+                                                      **compression_params)
+    compressed_model.load_state_dict(state_dict)
+    compressed_f1 = evaluate_f1(compressed_model, test_set, new_word2idx)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    checkpoint_path = join(args.out_dir, f'{out_name}.pth')
+    atomic_save(compressed_model.state_dict(), checkpoint_path)
+    new_word2idx_path = join(args.out_dir, f'{out_name}_word2idx.pkl')
+    save_pickle(new_word2idx_path, new_word2idx)
+    # registers the compact model, so that it can be served with MODEL_MANIFEST
+    write_manifest(manifest_path(args.out_dir, out_name), out_name, 'CRF_Model', compressed_hp, checkpoint_path,
+                   new_word2idx_path, args.idx2label)
+
+    report = {
+        'checkpoint': checkpoint_path,
+        'hparams': {'vocab_size': len(new_word2idx), 'embedding_compression': method, **compression_params},
+        'vocab_size': {'before': len(word2idx), 'after': len(new_word2idx)},
+        'embedding_bytes': {'before': original_bytes, 'after': embedding_bytes(compressed_model)},
+        'checkpoint_bytes': {'before': os.path.getsize(args.model), 'after': os.path.getsize(checkpoint_path)},
+        'test_macro_f1': {'before': original_f1, 'after': compressed_f1, 'delta': compressed_f1 - original_f1},
+    }
+    with open(join(args.out_dir, f'{out_name}_report.json'), encoding='utf-8', mode='w+') as f:
+        json.dump(report, f, indent=2)
+
+    print("========== Compression Report ==========")
+    print(f"Vocab Size: {len(word2idx)} -> {len(new_word2idx)}")
+    print(f"Embeddings: {original_bytes / 2 ** 20:.2f} MiB -> {report['embedding_bytes']['after'] / 2 ** 20:.2f} MiB")
+    print(f"Checkpoint: {report['checkpoint_bytes']['before'] / 2 ** 20:.2f} MiB -> "
+          f"{report['checkpoint_bytes']['after'] / 2 ** 20:.2f} MiB")
+    print(f"Test Macro F1: {original_f1:.4f} -> {compressed_f1:.4f} (delta: {compressed_f1 - original_f1:+.4f})")
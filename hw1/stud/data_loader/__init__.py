@@ -1 +1,3 @@
 from stud.data_loader.parse_dataset import TSVDatasetParser
+from stud.data_loader.bucket_sampler import BucketBatchSampler
+from stud.data_loader.corpus_stats import CorpusProfiler, iter_tsv_sentences
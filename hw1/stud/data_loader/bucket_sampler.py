@@ -0,0 +1,104 @@
+import math
+import random
+from collections import defaultdict
+
+from torch.utils.data import Sampler
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Batch sampler that groups sentences of similar length into buckets, so that batches padded per batch
+    (see TSVDatasetParser.pad_batch) carry as little padding as possible.
+    Each batch is capped by the number of tokens it holds once padded (sentences num * longest sentence),
+    instead of a fixed number of sentences, which keeps the memory used per step predictable.
+    Sentences are shuffled within each bucket, and batches are shuffled across buckets every epoch.
+    """
+
+    def __init__(self, lengths, max_tokens=4096, bucket_width=5, max_batch_size=None,
+                 shuffle=True, drop_last=False, seed=1873337):
+        """
+        Args:
+            lengths: list of sentences lengths, one per dataset sample
+            max_tokens: upper bound of padded tokens per batch
+            bucket_width: sentences whose lengths fall within the same window of this width share a bucket
+            max_batch_size: optional upper bound of sentences per batch
+            shuffle: shuffle sentences within buckets and batches across buckets
+            drop_last: drop the last incomplete batch of every bucket
+            seed: base seed, the shuffling of epoch `e` is seeded with `seed + e`
+        """
+        # Sampler.__init__ does nothing, and torch dropped its data_source argument in later versions
+        if max_tokens <= 0 or bucket_width <= 0:
+            raise ValueError('max_tokens and bucket_width must be positive integers')
+        self.lengths = list(lengths)
+        self.max_tokens = max_tokens
+        self.bucket_width = bucket_width
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.start_batch = 0
+
+        self.buckets = defaultdict(list)
+        for idx, length in enumerate(self.lengths):
+            self.buckets[max(length - 1, 0) // bucket_width].append(idx)
+        self.buckets = dict(sorted(self.buckets.items()))
+
+    def bucket_batch_size(self, bucket_indices):
+        """
+        Number of sentences per batch in a bucket, so that the padded batch never exceeds max_tokens
+        """
+        longest = max(max(self.lengths[idx] for idx in bucket_indices), 1)
+        batch_size = max(self.max_tokens // longest, 1)
+        if self.max_batch_size is not None:
+            batch_size = min(batch_size, self.max_batch_size)
+        return batch_size
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def batches(self, epoch=None):
+        """
+        Builds the list of batches (lists of dataset indices) of a given epoch, deterministic given the seed
+        """
+        rng = random.Random(self.seed + (self.epoch if epoch is None else epoch))
+        batches = []
+        for bucket_indices in self.buckets.values():
+            indices = list(bucket_indices)
+            if self.shuffle:
+                rng.shuffle(indices)
+            batch_size = self.bucket_batch_size(indices)
+            for start in range(0, len(indices), batch_size):
+                batch = indices[start: start + batch_size]
+                if self.drop_last and len(batch) < batch_size:
+                    continue
+                batches.append(batch)
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
+
+    def state_dict(self):
+        return {'epoch': self.epoch, 'seed': self.seed}
+
+    def load_state_dict(self, state_dict):
+        self.epoch = state_dict['epoch']
+        self.seed = state_dict['seed']
+
+    def __iter__(self):
+        """
+        Yields the batches of the current epoch, skipping the first `start_batch` ones when resuming mid-epoch
+        """
+        start_batch, self.start_batch = self.start_batch, 0
+        for batch in self.batches()[start_batch:]:
+            yield batch
+        self.epoch += 1
+
+    def __len__(self):
+        num_batches = 0
+        for bucket_indices in self.buckets.values():
+            batch_size = self.bucket_batch_size(bucket_indices)
+            if self.drop_last:
+                num_batches += len(bucket_indices) // batch_size
+            else:
+                num_batches += math.ceil(len(bucket_indices) / batch_size)
+        return num_batches
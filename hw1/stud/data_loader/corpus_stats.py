@@ -0,0 +1,196 @@
+import argparse
+import json
+from collections import Counter
+
+
+def iter_tsv_sentences(file_path):
+    """
+    Streams a dataset in the task's tsv format one sentence at a time, without reading the whole file
+    Args:
+        file_path:
+
+    Returns:
+        generator of (tokens, labels) tuples
+    """
+    tokens, labels = [], []
+    with open(file_path, encoding='utf-8', mode='r') as file_:
+        for line in file_:
+            line = line.rstrip('\n')
+            if line.startswith('# '):
+                if tokens:
+                    yield tokens, labels
+                tokens, labels = [], []
+            elif line == '':
+                if tokens:
+                    yield tokens, labels
+                tokens, labels = [], []
+            elif line[0].isdigit():
+                columns = line.split('\t')
+                tokens.append(columns[1])
+                labels.append(columns[-1])
+    if tokens:
+        yield tokens, labels
+
+
+def _histogram_quantile(histogram, total, q):
+    """
+    Smallest value v of a {value: count} histogram such that at least q of the samples are <= v
+    """
+    cumulative = 0
+    for value in sorted(histogram):
+        cumulative += histogram[value]
+        if cumulative >= q * total:
+            return value
+    return max(histogram) if histogram else 0
+
+
+class CorpusProfiler:
+    """
+    Single pass, streaming corpus profiler. Keeps counters only (no sentence is stored), so that memory grows with
+    the number of distinct tokens, not with the size of the corpus.
+    Collects sentences lengths, tokens & types counts, OOV rate against a given vocabulary, labels distribution and
+    tokens characters lengths, then summarizes them to choose max_len, bucket boundaries and vocabulary cutoffs.
+    """
+
+    def __init__(self, vocab=None, lower=True):
+        """
+        Args:
+            vocab: optional word2idx (or any container of words) to measure the OOV rate against
+            lower: lowercase tokens before counting, as TSVDatasetParser does
+        """
+        self.vocab = vocab
+        self.lower = lower
+        self.num_sentences = 0
+        self.num_tokens = 0
+        self.num_oov = 0
+        self.length_histogram = Counter()
+        self.char_length_histogram = Counter()
+        self.token_counts = Counter()
+        self.label_counts = Counter()
+
+    def update(self, tokens, labels=None):
+        if self.lower:
+            tokens = [token.lower() for token in tokens]
+        self.num_sentences += 1
+        self.num_tokens += len(tokens)
+        self.length_histogram[len(tokens)] += 1
+        self.token_counts.update(tokens)
+        self.char_length_histogram.update(len(token) for token in tokens)
+        if labels is not None:
+            self.label_counts.update(labels)
+        if self.vocab is not None:
+            self.num_oov += sum(1 for token in tokens if token not in self.vocab)
+        return self
+
+    def update_from_file(self, file_path):
+        for tokens, labels in iter_tsv_sentences(file_path):
+            self.update(tokens, labels)
+        return self
+
+    def merge(self, other):
+        """
+        Merges the counters of a profiler built over another shard of the corpus
+        """
+        self.num_sentences += other.num_sentences
+        self.num_tokens += other.num_tokens
+        self.num_oov += other.num_oov
+        self.length_histogram.update(other.length_histogram)
+        self.char_length_histogram.update(other.char_length_histogram)
+        self.token_counts.update(other.token_counts)
+        self.label_counts.update(other.label_counts)
+        return self
+
+    def bucket_boundaries(self, num_buckets=8):
+        """
+        Sentences lengths splitting the corpus into num_buckets buckets holding the same number of sentences
+        """
+        boundaries = [_histogram_quantile(self.length_histogram, self.num_sentences, i / num_buckets)
+                      for i in range(1, num_buckets + 1)]
+        return sorted(set(boundaries))
+
+    def vocabulary_cutoffs(self, min_freqs=(1, 2, 3, 5, 10, 20)):
+        """
+        For each min frequency, the size of the vocabulary it yields and the share of corpus tokens it covers
+        """
+        cutoffs = {}
+        for min_freq in min_freqs:
+            kept = [count for count in self.token_counts.values() if count >= min_freq]
+            cutoffs[min_freq] = {'vocab_size': len(kept),
+                                 'token_coverage': sum(kept) / max(self.num_tokens, 1)}
+        return cutoffs
+
+    def summary(self, coverage=0.99, num_buckets=8):
+        """
+        Args:
+            coverage: share of sentences that must fit max_len without being truncated
+            num_buckets: number of length buckets to suggest boundaries for
+
+        Returns:
+            json serializable dict of the corpus statistics
+        """
+        lengths = self.length_histogram
+        mean_len = sum(length * count for length, count in lengths.items()) / max(self.num_sentences, 1)
+        return {
+            'sentences': self.num_sentences,
+            'tokens': self.num_tokens,
+            'types': len(self.token_counts),
+            'oov_rate': self.num_oov / max(self.num_tokens, 1) if self.vocab is not None else None,
+            'sentence_length': {
+                'mean': mean_len,
+                'p50': _histogram_quantile(lengths, self.num_sentences, 0.5),
+                'p90': _histogram_quantile(lengths, self.num_sentences, 0.9),
+                'p99': _histogram_quantile(lengths, self.num_sentences, 0.99),
+                'max': max(lengths) if lengths else 0,
+                'histogram': {str(length): lengths[length] for length in sorted(lengths)},
+            },
+            'suggested_max_len': _histogram_quantile(lengths, self.num_sentences, coverage),
+            'bucket_boundaries': self.bucket_boundaries(num_buckets),
+            'vocabulary_cutoffs': {str(k): v for k, v in self.vocabulary_cutoffs().items()},
+            'labels': dict(self.label_counts.most_common()),
+            'char_length': {
+                'p99': _histogram_quantile(self.char_length_histogram, self.num_tokens, 0.99),
+                'max': max(self.char_length_histogram) if self.char_length_histogram else 0,
+                'histogram': {str(length): self.char_length_histogram[length]
+                              for length in sorted(self.char_length_histogram)},
+            },
+        }
+
+    def to_json(self, path, **kwargs):
+        summary = self.summary(**kwargs)
+        with open(path, encoding='utf-8', mode='w+') as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+    def plot_lengths(self):
+        import matplotlib.pyplot as plt
+
+        plt.figure()
+        plt.title('Frequency of sentences Length')
+        plt.xlabel("Sentences' Lengths")
+        plt.ylabel("Frequency")
+        plt.bar(self.length_histogram.keys(), self.length_histogram.values())
+        plt.show()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profiles tsv datasets, writes a json summary')
+    parser.add_argument('files', nargs='+', type=str, help='tsv files to profile')
+    parser.add_argument('--vocab', type=str, default=None, help='pickled word2idx to compute the OOV rate against')
+    parser.add_argument('--out', type=str, default='corpus_stats.json', help='json summary path')
+    parser.add_argument('--coverage', type=float, default=0.99, help='share of sentences max_len must fit')
+    parser.add_argument('--buckets', type=int, default=8, help='number of length buckets')
+    args = parser.parse_args()
+
+    word2idx = None
+    if args.vocab is not None:
+        from stud.utilities import load_pickle
+        word2idx = load_pickle(args.vocab)
+
+    profiler = CorpusProfiler(vocab=word2idx)
+    for file_path in args.files:
+        profiler.update_from_file(file_path)
+    stats = profiler.to_json(args.out, coverage=args.coverage, num_buckets=args.buckets)
+    print(f"Sentences: {stats['sentences']}, Tokens: {stats['tokens']}, Types: {stats['types']}, "
+          f"OOV rate: {stats['oov_rate']}, Suggested max_len: {stats['suggested_max_len']}")
+    print(f"Bucket boundaries: {stats['bucket_boundaries']}")
+    print(f"Summary written to {args.out}")
@@ -1,12 +1,38 @@
-from collections import Counter
+from collections import Counter, deque
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
 import re
 import string
+import sys
 import nltk
 from nltk.corpus import stopwords
 
 alphanum = re.compile('^[a-zA-Z0-9_]+$')
 
 
+def count_tokens(sentences, lower=True):
+    """
+    Counts the tokens of one shard of sentences, shards counters are merged with Counter.update
+    """
+    counter = Counter()
+    for tokens in sentences:
+        counter.update([t.lower() for t in tokens] if lower else tokens)
+    return counter
+
+
+def iter_shards(sentences, shard_size):
+    """
+    Splits a (possibly lazy) iterable of sentences into lists of shard_size sentences, without materializing it
+    """
+    sentences = iter(sentences)
+    while True:
+        shard = list(islice(sentences, shard_size))
+        if not shard:
+            return
+        yield shard
+
+
 class MyTokenizer(object):
     def __init__(self, keepStopwords=False, keepNum=False, keepAlphaNum=False, lower=True, minlength=0,
                  vocabSize=5000, minfreq=10e-5, stopset=None, vocab=None):
@@ -38,6 +64,68 @@ class MyTokenizer(object):
             Vocab.update(tokens)
         self.vocab = Counter(Vocab)
 
+    def count_vocab(self, sentences, num_workers=1, shard_size=10000, max_pending=None):
+        """
+        Streams sentences in shards, counts each shard in a worker process and merges the shards counters.
+        At most max_pending shards are read ahead of the counting, so the corpus is never held in memory as a whole
+        Args:
+            sentences: iterable of lists of tokens, e.g. a generator reading a file
+            num_workers: number of counting processes, 1 counts in the current process
+            shard_size: number of sentences per shard
+            max_pending: shards queued to the workers at most, defaults to 2 * num_workers
+
+        Returns:
+            Counter of tokens
+        """
+        counter = Counter()
+        count_shard = partial(count_tokens, lower=self.lower)
+        if num_workers > 1:
+            max_pending = max_pending or 2 * num_workers
+            with Pool(num_workers) as pool:
+                pending = deque()
+                for shard in iter_shards(sentences, shard_size):
+                    pending.append(pool.apply_async(count_shard, (shard,)))
+                    if len(pending) >= max_pending:
+                        counter.update(pending.popleft().get())
+                while pending:
+                    counter.update(pending.popleft().get())
+        else:
+            for shard in iter_shards(sentences, shard_size):
+                counter.update(count_shard(shard))
+        self.vocab = counter
+        return counter
+
+    def build_vocab(self, sentences, min_count=1, top_k=None, pattern=None, specials=('<PAD>', '<UNK>'),
+                    num_workers=1, shard_size=10000):
+        """
+        Builds word2idx from a stream of sentences, keeping tokens that occur at least min_count times,
+        match the regex pattern (if given), and are among the top_k most frequent ones (if given)
+        Args:
+            sentences: iterable of lists of tokens
+            min_count:
+            top_k:
+            pattern: regex tokens must fully match to be kept
+            specials: tokens placed first in the vocabulary, e.g. <PAD> -> 0, <UNK> -> 1
+            num_workers:
+            shard_size:
+
+        Returns:
+            word2idx dict
+        """
+        counter = self.count_vocab(sentences, num_workers=num_workers, shard_size=shard_size)
+        regex = re.compile(pattern) if pattern is not None else None
+        kept = [(t, f) for t, f in counter.items()
+                if f >= min_count and (regex is None or regex.fullmatch(t))]
+        # most frequent first, ties broken alphabetically so that the vocabulary is deterministic
+        kept.sort(key=lambda item: (-item[1], item[0]))
+        if top_k is not None:
+            kept = kept[:top_k]
+        word2idx = {token: idx for idx, token in enumerate(specials)}
+        for token, _ in kept:
+            word2idx.setdefault(token, len(word2idx))
+        self.words2idx = word2idx
+        return word2idx
+
     def cleanTokens(self, Tokens):
         tokens_n = sum(self.vocab.values())
         filtered_voc = self.vocab.most_common(self.vocabSize)
@@ -60,15 +148,20 @@ class MyTokenizer(object):
         self.words2idx = words2idx
         print('Vocabulary')
         print(words[:12])
+        # hashed lookups, membership in the words list would cost O(vocabulary) per token
+        words_set = set(words)
         cleanTokens = []
         for tokens in Tokens:
-            cleanTokens.append([t for t in tokens if t in words])
+            cleanTokens.append([t for t in tokens if t in words_set])
         self.tokens = cleanTokens
 
 
 if __name__ == '__main__':
+    from stud.data_loader.corpus_stats import iter_tsv_sentences
+
+    dataset_path = sys.argv[1]
     tokenizer = MyTokenizer()
-    Tokens = [tokenizer.tokenize(text) for text in MyDatasetReader(dataset_path)]
+    Tokens = [tokenizer.tokenize(' '.join(tokens)) for tokens, _ in iter_tsv_sentences(dataset_path)]
     tokenizer.get_vocab(Tokens)
     print('Most frequent words')
     print(tokenizer.vocab.most_common(12))
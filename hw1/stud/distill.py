@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+from os import getcwd
+from os.path import join
+
+import torch
+from torch.optim import Adam
+from torch.utils.data import DataLoader
+
+from data_loader import TSVDatasetParser, BucketBatchSampler, iter_tsv_sentences
+from evaluator import benchmark_tagger, print_benchmark, crf_tagger, greedy_tagger
+from models import HyperParameters, BaselineModel, build_from_manifest, manifest_path, write_manifest
+from training import Distillation_Trainer
+from utilities import configure_workspace, torch_summarize
+
+"""
+Distills the Stacked BiLSTM CRF into a lightweight tagger (a narrow BiLSTM decoded greedily, no CRF),
+then reports the speed / F1 trade-off of the teacher and of the student on the test set.
+"""
+
+
+if __name__ == '__main__':
+    MODEL_PATH = join(getcwd(), 'model')
+    DATA_PATH = join(getcwd(), 'data')
+    teacher_name = 'Stacked_BiLSTM_CRF_Fasttext_2315'
+
+    parser = argparse.ArgumentParser(description='Distills the BiLSTM CRF into a smaller greedy tagger')
+    parser.add_argument('--teacher', type=str, default=manifest_path(MODEL_PATH, teacher_name),
+                        help='manifest of the teacher')
+    parser.add_argument('--hidden-dim', type=int, default=128, help='student LSTM hidden size')
+    parser.add_argument('--layers', type=int, default=1, help='student LSTM layers')
+    parser.add_argument('--temperature', type=float, default=2.0)
+    parser.add_argument('--alpha', type=float, default=0.7, help='weight of the distillation loss')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--max-tokens', type=int, default=4096, help='padded tokens per training batch')
+    parser.add_argument('--threads', type=int, default=1, help='intra-op threads while benchmarking')
+    parser.add_argument('--out-dir', type=str, default=MODEL_PATH)
+    args = parser.parse_args()
+
+    configure_workspace(seed=1873337)
+    train_dataset = TSVDatasetParser(join(DATA_PATH, 'train.tsv'), max_len=80, is_crf=True)
+    dev_dataset = TSVDatasetParser(join(DATA_PATH, 'dev.tsv'), max_len=80, is_crf=True)
+    teacher, word2idx, idx2label, teacher_manifest = build_from_manifest(args.teacher, train_dataset.get_device)
+    teacher_name = teacher_manifest['name']
+    labels2idx = {label: idx for idx, label in idx2label.items()}
+    train_dataset.encode_dataset(word2idx, labels2idx)
+    dev_dataset.encode_dataset(word2idx, labels2idx)
+    train_dataset_ = DataLoader(dataset=train_dataset, collate_fn=TSVDatasetParser.pad_batch,
+                                batch_sampler=BucketBatchSampler(train_dataset.lengths, args.max_tokens))
+    dev_dataset_ = DataLoader(dataset=dev_dataset, collate_fn=TSVDatasetParser.pad_batch,
+                              batch_sampler=BucketBatchSampler(dev_dataset.lengths, args.max_tokens, shuffle=False))
+
+    student_name = f'Distilled_BiLSTM_{args.layers}x{args.hidden_dim}'
+    hp = HyperParameters(student_name, word2idx, labels2idx, teacher.word_embedding.weight.detach().cpu(), 128)
+    hp.hidden_dim, hp.num_layers = args.hidden_dim, args.layers
+    student = BaselineModel(hp).to(train_dataset.get_device)
+    print(f'========== Student Summary ==========\n{torch_summarize(student)}')
+
+    trainer = Distillation_Trainer(teacher, student, Adam(student.parameters()),
+                                   temperature=args.temperature, alpha=args.alpha)
+    trainer.train(train_dataset_, dev_dataset_, epochs=args.epochs)
+    os.makedirs(args.out_dir, exist_ok=True)
+    student.save_checkpoint(join(args.out_dir, f'{student_name}.pt'))
+    write_manifest(manifest_path(args.out_dir, student_name), student_name, 'BaselineModel', hp,
+                   join(args.out_dir, f'{student_name}.pth'), teacher_manifest['vocab']['path'],
+                   teacher_manifest['labels']['path'], teacher_manifest['inference'])
+
+    torch.set_num_threads(args.threads)
+    test_tokens, test_labels = zip(*iter_tsv_sentences(join(DATA_PATH, 'test.tsv')))
+    test_tokens, test_labels = list(test_tokens), list(test_labels)
+    results = [benchmark_tagger(teacher_name, crf_tagger(teacher, word2idx, idx2label), test_tokens, test_labels,
+                                model=teacher),
+               benchmark_tagger(student_name, greedy_tagger(student, word2idx, idx2label), test_tokens, test_labels,
+                                model=student)]
+    print_benchmark(results)
+    with open(join(args.out_dir, f'{student_name}_benchmark.json'), encoding='utf-8', mode='w+') as f:
+        json.dump(results, f, indent=2)
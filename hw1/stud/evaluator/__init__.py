@@ -1 +1,2 @@
-from stud.evaluator.eval import Evaluator
\ No newline at end of file
+from stud.evaluator.eval import Evaluator
+from stud.evaluator.benchmark import benchmark_tagger, print_benchmark, crf_tagger, greedy_tagger
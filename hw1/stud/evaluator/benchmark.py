@@ -0,0 +1,90 @@
+import time
+from typing import Callable, List
+
+import torch
+from sklearn.metrics import f1_score
+from torch.nn.utils.rnn import pad_sequence
+
+
+def crf_tagger(model, word2idx, idx2label):
+    """
+    predict function of a CRF_Model: encodes, Viterbi decodes & maps tags to labels
+    """
+    def predict(tokens_s):
+        inputs = pad_sequence([torch.LongTensor([word2idx.get(word.lower(), 1) for word in tokens])
+                               for tokens in tokens_s], batch_first=True).to(model._device)
+        tags_s = model.predict_new(inputs, (inputs != 0).to(dtype=torch.uint8))
+        return [[idx2label[tag] for tag in tags] for tags in tags_s]
+
+    return predict
+
+
+def greedy_tagger(model, word2idx, idx2label):
+    """
+    predict function of a BaselineModel, decoded greedily
+    """
+    def predict(tokens_s):
+        return model.predict_sentences(tokens_s, word2idx, idx2label)
+
+    return predict
+
+
+def benchmark_tagger(name, predict: Callable[[List[List[str]]], List[List[str]]], tokens_s, labels_s,
+                     batch_size=32, warmup_batches=2, model=None, after_warmup=None):
+    """
+    Measures a tagger the way it is served: batches of raw sentences in, labels out (encoding & decoding included).
+    F1 is the macro F1 over tokens computed by hw1/evaluate.py
+    Args:
+        name: tagger name in the report
+        predict: function tagging a batch of tokenized sentences
+        tokens_s: test sentences
+        labels_s: gold labels
+        batch_size: sentences per call, as sent by the clients
+        warmup_batches: batches run before timing
+        model: optional nn.Module, to report its number of parameters
+        after_warmup: optional function called once the warmup batches are done, e.g. to reset the tagger counters
+
+    Returns:
+        dict of the tagger speed & accuracy
+    """
+    with torch.no_grad():
+        for start in range(0, min(warmup_batches * batch_size, len(tokens_s)), batch_size):
+            predict(tokens_s[start: start + batch_size])
+        if after_warmup is not None:
+            after_warmup()
+
+        predictions_s, latencies = [], []
+        for start in range(0, len(tokens_s), batch_size):
+            begin = time.perf_counter()
+            predictions_s += predict(tokens_s[start: start + batch_size])
+            latencies.append(time.perf_counter() - begin)
+
+    total_time = sum(latencies)
+    latencies.sort()
+    num_tokens = sum(len(tokens) for tokens in tokens_s)
+    flat_labels = [label for labels in labels_s for label in labels]
+    flat_predictions = [label for labels in predictions_s for label in labels]
+    return {
+        'name': name,
+        'macro_f1': f1_score(flat_labels, flat_predictions, average='macro'),
+        'sentences_per_sec': len(tokens_s) / max(total_time, 1e-9),
+        'tokens_per_sec': num_tokens / max(total_time, 1e-9),
+        'batch_latency_ms_p50': 1000 * latencies[len(latencies) // 2] if latencies else 0.0,
+        'batch_latency_ms_p99': 1000 * latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+        if latencies else 0.0,
+        'parameters': sum(p.numel() for p in model.parameters()) if model is not None else None,
+    }
+
+
+def print_benchmark(results):
+    """
+    Prints the speed / F1 trade-off of several taggers, relative to the first one
+    """
+    reference = results[0]
+    print("========== Speed / F1 ==========")
+    for result in results:
+        speedup = result['sentences_per_sec'] / max(reference['sentences_per_sec'], 1e-9)
+        f1_delta = result['macro_f1'] - reference['macro_f1']
+        print(f"{result['name']}: Macro F1: {result['macro_f1']:0.4f} ({f1_delta:+0.4f}), "
+              f"{result['sentences_per_sec']:0.1f} sentences/s (x{speedup:0.2f}), "
+              f"p99 batch latency: {result['batch_latency_ms_p99']:0.1f} ms, params: {result['parameters']}")
@@ -1,14 +1,16 @@
 import torch
 import os
-from typing import List, Any
+import random
+import threading
+from typing import List, Any, Tuple
 from model import Model
 from torch.utils.data import Dataset
 from torch.nn.utils.rnn import pad_sequence
 from torch.utils.data import DataLoader
 import nltk
 from stud.data_loader import TSVDatasetParser
-from stud.models import HyperParameters, CRF_Model
-from stud.utilities import load_pickle, configure_workspace
+from stud.models import BiLSTM_CRF_POS_Model, build_from_manifest, INFERENCE_DEFAULTS
+from stud.utilities import configure_workspace, LRUCache, window_spans, stitch_windows, tags_to_spans
 
 
 class TSVTestDataParser(Dataset):
@@ -34,49 +36,327 @@ class TSVTestDataParser(Dataset):
     def encode_data(self, word2idx):
         for sentence in self._tokens:
             self.encoded_data.append({
-                "inputs": torch.LongTensor([word2idx.get(word, 1) for word in sentence])
+                "inputs": torch.LongTensor([word2idx.get(word, 1) for word in sentence]),
+                "tokens": sentence
             })
 
     @staticmethod
     def pad_batch(batch):
-        return {"inputs": pad_sequence([sample["inputs"] for sample in batch], batch_first=True)}
+        return {"inputs": pad_sequence([sample["inputs"] for sample in batch], batch_first=True),
+                "tokens": [sample["tokens"] for sample in batch]}
 
     @staticmethod
     def decode_predictions(labels, idx2label):
         return list(map(lambda x: [idx2label.get(w) for w in x], labels))
 
 
+DEFAULT_MANIFEST = os.path.join('model', 'Stacked_BiLSTM_CRF_Fasttext_2315.manifest.json')
+
+
 def build_model(device: str) -> Model:
     configure_workspace(seed=1873337)
-    return StudentModel(device)
+    # MODEL_MANIFEST serves another registered model without code changes
+    model = StudentModel(device, manifest_path=os.environ.get('MODEL_MANIFEST'))
+    # CASCADE_GATE puts a cheap model in front of it, which lets entity free sentences skip it
+    if os.environ.get('CASCADE_GATE'):
+        gate = StudentModel(device, manifest_path=os.environ['CASCADE_GATE'])
+        model = CascadeModel(gate, model, threshold=float(os.environ.get('CASCADE_THRESHOLD', 0.9)),
+                             audit_rate=float(os.environ.get('CASCADE_AUDIT_RATE', 0.0)))
+    return model
+
+
+def batch_spans(tag_ids_s, scores_s, outside_idx):
+    """
+    tags_to_spans over lists of tag ids & scores of different lengths
+    """
+    if not tag_ids_s:
+        return []
+    lengths = torch.LongTensor([len(tag_ids) for tag_ids in tag_ids_s])
+    tags = pad_sequence([torch.as_tensor(tag_ids, dtype=torch.long) for tag_ids in tag_ids_s], batch_first=True)
+    scores = pad_sequence([torch.as_tensor(scores, dtype=torch.float) for scores in scores_s], batch_first=True)
+    return tags_to_spans(tags, lengths, outside_idx, scores)
+
+
+def labels_to_spans(predictions, label2idx, idx2label):
+    """
+    (labels, scores) of every sentence to (start, end, type, score) spans
+    """
+    spans_s = batch_spans([[label2idx[label] for label in labels] for labels, _ in predictions],
+                          [scores for _, scores in predictions], label2idx['O'])
+    return [[(start, end, idx2label[tag], score) for start, end, tag, score in spans] for spans in spans_s]
 
 
 class StudentModel(Model):
-    def __init__(self, device):
+    def __init__(self, device, manifest_path=None, **inference):
+        """
+        Args:
+            device:
+            manifest_path: manifest of the model to serve (see models.registry), defaults to DEFAULT_MANIFEST
+            **inference: overrides the inference options of the manifest:
+                batch_size: sentences per forward pass
+                cache_size: max number of sentences whose predictions are cached, 0 disables the cache
+                cache_max_tokens: optional bound of the total number of cached tokens
+                window_size: sentences longer than this (the training max_len) are tagged by overlapping windows,
+                             None tags them whole
+                window_overlap: tokens shared by consecutive windows
+                merge_policy: how the overlapping windows tags are merged, see stitch_windows
+                confidence: per token confidence of CRF models, 'marginals' or 'emissions'
+        """
+        unknown = set(inference) - set(INFERENCE_DEFAULTS)
+        if unknown:
+            raise ValueError(f'Unknown inference options: {sorted(unknown)}')
         self.device = device
-        self.word2idx = load_pickle(os.path.join(os.getcwd(), 'model', 'Stacked_BiLSTM_CRF_Fasttext_2315_word2idx.pkl'))
-        self.idx2label = load_pickle(os.path.join(os.getcwd(), 'model', 'Stacked_BiLSTM_CRF_Fasttext_2315_idx2label.pkl'))
+        self.manifest_path = manifest_path or os.path.join(os.getcwd(), DEFAULT_MANIFEST)
         self._build_model()
+        options = {**self.manifest['inference'], **inference}
+        self.batch_size = options['batch_size']
+        self.window_size = options['window_size']
+        self.window_overlap = options['window_overlap']
+        self.merge_policy = options['merge_policy']
+        self.confidence = options['confidence']
+        # Predictions of already seen sentences, keyed by the lowercased tokens (what the model actually sees)
+        self.cache = LRUCache(max_entries=options['cache_size'], max_weight=options['cache_max_tokens'],
+                              weigher=lambda key, value: len(key))
 
     def _build_model(self):
-        hp = HyperParameters(model_name_='BiLSTM_CRF', vocab=self.word2idx,
-                             label_vocab=self.idx2label, embeddings_=None,
-                             batch_size_=128)
-        model_path = os.path.join(os.getcwd(), 'model',
-                                  'Stacked_BiLSTM_CRF_Fasttext_2315.pth')
+        self.model, self.word2idx, self.idx2label, self.manifest = build_from_manifest(self.manifest_path,
+                                                                                       self.device)
+        if isinstance(self.model, BiLSTM_CRF_POS_Model):
+            raise ValueError(f"{self.manifest['name']}: PoS models can not be served, they need PoS tagged inputs")
+        self.label2idx = {label: idx for idx, label in self.idx2label.items()}
+
+    @property
+    def name(self):
+        return self.manifest['name']
 
-        self.model = CRF_Model(hp).to(self.device)
-        self.model.load_model(model_path)
-        self.model.eval()
+    @property
+    def cache_stats(self):
+        return self.cache.stats
 
     def predict(self, tokens: List[List[str]]) -> List[List[str]]:
+        return [list(labels) for labels, _ in self._predict_cached(tokens)]
+
+    def predict_with_confidence(self, tokens: List[List[str]]) -> List[Tuple[List[str], List[float]]]:
+        """
+        Labels along with the confidence of every token, e.g. to hand the least confident sentences over to a
+        stronger model. confidence='marginals' makes it the CRF posterior of the predicted tag
+        """
+        return [(list(labels), list(scores)) for labels, scores in self._predict_cached(tokens)]
+
+    def predict_spans(self, tokens: List[List[str]]) -> List[List[Tuple[int, int, str, float]]]:
+        """
+        Entity level output: runs of the same entity tag grouped into (start, end, type, score) spans, end
+        excluded, score the mean confidence of the span tokens
+        """
+        return labels_to_spans(self._predict_cached(tokens), self.label2idx, self.idx2label)
+
+    def _predict_cached(self, tokens: List[List[str]]) -> List[Tuple[Tuple[str, ...], Tuple[float, ...]]]:
+        """
+        Serves cached sentences directly, only the distinct sentences missing from the cache go through the model
+
+        Returns:
+            (labels, scores) of every sentence
+        """
+        keys = [tuple(token.lower() for token in sentence) for sentence in tokens]
+        predictions = [None] * len(keys)
+        misses = {}
+        for idx, key in enumerate(keys):
+            cached = self.cache.get(key)
+            if cached is not None:
+                predictions[idx] = cached
+            else:
+                misses.setdefault(key, []).append(idx)
+        if misses:
+            miss_keys = list(misses)
+            for key, pairs in zip(miss_keys, self._predict_batch([list(key) for key in miss_keys])):
+                labels_scores = (tuple(label for label, _ in pairs), tuple(score for _, score in pairs))
+                self.cache.put(key, labels_scores)
+                for idx in misses[key]:
+                    predictions[idx] = labels_scores
+        return predictions
+
+    def _predict_batch(self, tokens: List[List[str]]) -> List[List[Tuple[str, float]]]:
+        return self._windowed(tokens, self._predict_windows)
+
+    def _windowed(self, sentences, predict_windows):
+        """
+        Long sentences are split into windows which are batched along with the other sentences,
+        so that no batch gets padded to an arbitrarily long sentence
+        Args:
+            sentences: tokens or token ids sentences
+            predict_windows: predicts a list of windows, one prediction per token
+
+        Returns:
+            per token predictions of every sentence, stitched back from its windows
+        """
+        spans = [window_spans(len(sentence), self.window_size, self.window_overlap) for sentence in sentences]
+        windows = [sentence[start: end] for sentence, sentence_spans in zip(sentences, spans)
+                   for start, end in sentence_spans]
+        windows_predictions = iter(predict_windows(windows))
+        return [stitch_windows(len(sentence), sentence_spans, [next(windows_predictions) for _ in sentence_spans],
+                               self.merge_policy)
+                for sentence, sentence_spans in zip(sentences, spans)]
+
+    def _predict_windows(self, tokens: List[List[str]]) -> List[List[Tuple[str, float]]]:
+        """
+        Returns:
+            (label, score) pairs of every token
+        """
         data_set = TSVTestDataParser(tokens)
         data_set.encode_data(self.word2idx)
-        data_set_loader = DataLoader(dataset=data_set, batch_size=128,
+        data_set_loader = DataLoader(dataset=data_set, batch_size=self.batch_size,
                                      collate_fn=TSVTestDataParser.pad_batch)
+        predictions = []
         with torch.no_grad():
             for sample in data_set_loader:
                 inputs = sample["inputs"].to(self.device)
                 attention_mask = (inputs != 0).to(self.device, dtype=torch.uint8)
-                labels = self.model.predict_new(inputs, attention_mask)
-                return TSVTestDataParser.decode_predictions(labels, self.idx2label)
+                tags_s, scores = self.model.predict_with_scores(inputs, attention_mask, sample["tokens"],
+                                                                self.confidence)
+                for tags, token_scores in zip(tags_s, scores.tolist()):
+                    predictions.append([(self.idx2label[tag], score) for tag, score in zip(tags, token_scores)])
+        return predictions
+
+    def predict_encoded(self, token_ids: List[List[int]], spans=False):
+        """
+        Tags sentences already encoded with the model word2idx, returns tag ids (see idx2label), no string handling
+        Args:
+            token_ids:
+            spans: returns (start, end, tag id, score) spans instead of the tag ids
+        """
+        if spans:
+            predictions = self.predict_encoded_with_confidence(token_ids)
+            return batch_spans([tag_ids for tag_ids, _ in predictions], [scores for _, scores in predictions],
+                               self.label2idx['O'])
+        return self._windowed(token_ids, self._predict_encoded_windows)
+
+    def predict_encoded_with_confidence(self, token_ids: List[List[int]]) -> List[Tuple[List[int], List[float]]]:
+        predictions = self._windowed(token_ids, self._predict_encoded_windows_with_confidence)
+        return [([tag for tag, _ in sentence], [score for _, score in sentence]) for sentence in predictions]
+
+    def _predict_encoded_windows(self, token_ids):
+        predictions = []
+        with torch.no_grad():
+            for inputs, attention_mask in self._encoded_batches(token_ids):
+                predictions.extend(self.model.predict_new(inputs, attention_mask))
+        return predictions
+
+    def _predict_encoded_windows_with_confidence(self, token_ids):
+        """
+        Returns:
+            (tag id, score) pairs of every token
+        """
+        predictions = []
+        with torch.no_grad():
+            for inputs, attention_mask in self._encoded_batches(token_ids):
+                tags_s, scores = self.model.predict_with_scores(inputs, attention_mask, confidence=self.confidence)
+                predictions.extend(list(zip(tags, scores_)) for tags, scores_ in zip(tags_s, scores.tolist()))
+        return predictions
+
+    def _encoded_batches(self, token_ids):
+        for start in range(0, len(token_ids), self.batch_size):
+            batch = [torch.as_tensor(ids, dtype=torch.long) for ids in token_ids[start: start + self.batch_size]]
+            inputs = pad_sequence(batch, batch_first=True).to(self.device)
+            yield inputs, (inputs != 0).to(self.device, dtype=torch.uint8)
+
+
+class CascadeModel(Model):
+    """
+    Two stages tagger: a cheap gate model (e.g. the distilled greedy BiLSTM, see distill.py) tags every sentence,
+    only the sentences it is not confident to be entity free go on to the full model (the BiLSTM CRF), so that
+    entity sparse text mostly skips it. Both models must share the vocabulary & the label map.
+    """
+
+    def __init__(self, gate: StudentModel, full: StudentModel, threshold=0.9, audit_rate=0.0, seed=None):
+        """
+        Args:
+            gate: first stage
+            full: second stage
+            threshold: a sentence skips the full model only if the gate tags all its tokens "O" with a confidence
+                       of at least threshold, 1.0 sends every sentence to the full model
+            audit_rate: share of the skipped sentences tagged by the full model anyway, to measure live how often
+                        the gate misses entities (costs a full model pass on them, whose tags are then served)
+            seed: seed of the audit sampling
+        """
+        if gate.manifest['vocab']['sha256'] != full.manifest['vocab']['sha256'] or gate.idx2label != full.idx2label:
+            raise ValueError(f'{gate.name} and {full.name} do not share the vocabulary and the label map')
+        self.gate, self.full = gate, full
+        self.stages = (gate, full)
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.label2idx, self.idx2label = full.label2idx, full.idx2label
+        self.model, self.manifest, self.manifest_path = full.model, full.manifest, full.manifest_path
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def name(self):
+        return f'{self.full.name}_cascade'
+
+    @property
+    def cascade_stats(self):
+        with self._lock:
+            return {'threshold': self.threshold, 'sentences': self.sentences, 'forwarded': self.forwarded,
+                    'forwarded_rate': self.forwarded / self.sentences if self.sentences else None,
+                    'audited': self.audited, 'audit_misses': self.audit_misses,
+                    # share of the skipped sentences in which the full model does find entities
+                    'estimated_miss_rate': self.audit_misses / self.audited if self.audited else None}
+
+    @property
+    def cache_stats(self):
+        return {'gate': self.gate.cache_stats, 'full': self.full.cache_stats, 'cascade': self.cascade_stats}
+
+    def reset_stats(self):
+        with self._lock:
+            self.sentences, self.forwarded, self.audited, self.audit_misses = 0, 0, 0, 0
+
+    def _cascade(self, inputs, gate_predict, full_predict, outside):
+        """
+        Args:
+            inputs: sentences, as tokens or token ids
+            gate_predict, full_predict: functions tagging inputs into (tags, scores) pairs
+            outside: the "O" tag, as a label or a tag id
+
+        Returns:
+            (tags, scores) of every sentence
+        """
+        predictions = gate_predict(inputs)
+        forwarded, skipped = [], []
+        for idx, (tags, scores) in enumerate(predictions):
+            entity_free = all(tag == outside and score >= self.threshold for tag, score in zip(tags, scores))
+            (skipped if entity_free else forwarded).append(idx)
+        if forwarded:
+            for idx, prediction in zip(forwarded, full_predict([inputs[idx] for idx in forwarded])):
+                predictions[idx] = prediction
+
+        misses = 0
+        audited = [idx for idx in skipped if self._random.random() < self.audit_rate]
+        if audited:
+            # the full model pass is paid for anyway, its predictions are the ones returned
+            for idx, prediction in zip(audited, full_predict([inputs[idx] for idx in audited])):
+                misses += any(tag != outside for tag in prediction[0])
+                predictions[idx] = prediction
+        with self._lock:
+            self.sentences += len(predictions)
+            self.forwarded += len(forwarded)
+            self.audited += len(audited)
+            self.audit_misses += misses
+        return predictions
+
+    def predict(self, tokens: List[List[str]]) -> List[List[str]]:
+        return [labels for labels, _ in self.predict_with_confidence(tokens)]
+
+    def predict_with_confidence(self, tokens: List[List[str]]) -> List[Tuple[List[str], List[float]]]:
+        return self._cascade(tokens, self.gate.predict_with_confidence, self.full.predict_with_confidence, 'O')
+
+    def predict_spans(self, tokens: List[List[str]]) -> List[List[Tuple[int, int, str, float]]]:
+        return labels_to_spans(self.predict_with_confidence(tokens), self.label2idx, self.idx2label)
+
+    def predict_encoded(self, token_ids: List[List[int]], spans=False):
+        predictions = self._cascade(token_ids, self.gate.predict_encoded_with_confidence,
+                                    self.full.predict_encoded_with_confidence, self.label2idx['O'])
+        if spans:
+            return batch_spans([tags for tags, _ in predictions], [scores for _, scores in predictions],
+                               self.label2idx['O'])
+        return [tags for tags, _ in predictions]
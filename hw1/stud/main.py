@@ -5,7 +5,7 @@ from torch.nn import CrossEntropyLoss
 from torch.optim import Adam
 from torch.utils.data import DataLoader
 
-from data_loader import TSVDatasetParser
+from data_loader import TSVDatasetParser, BucketBatchSampler
 from evaluator import Evaluator
 from models import HyperParameters, BaselineModel
 from training import Trainer
@@ -57,10 +57,13 @@ if __name__ == '__main__':
                          pretrained_embeddings,
                          batch_size)
 
-    # , collate_fn=DatasetParser.pad_collate
-    train_dataset_ = DataLoader(dataset=train_dataset, batch_size=batch_size)
-    dev_dataset_ = DataLoader(dataset=dev_dataset, batch_size=batch_size)
-    test_dataset_ = DataLoader(dataset=test_dataset, batch_size=batch_size)
+    max_tokens = 4096
+    train_dataset_ = DataLoader(dataset=train_dataset, collate_fn=TSVDatasetParser.pad_batch,
+                                batch_sampler=BucketBatchSampler(train_dataset.lengths, max_tokens))
+    dev_dataset_ = DataLoader(dataset=dev_dataset, collate_fn=TSVDatasetParser.pad_batch,
+                              batch_sampler=BucketBatchSampler(dev_dataset.lengths, max_tokens, shuffle=False))
+    test_dataset_ = DataLoader(dataset=test_dataset, collate_fn=TSVDatasetParser.pad_batch,
+                               batch_sampler=BucketBatchSampler(test_dataset.lengths, max_tokens, shuffle=False))
 
     model = BaselineModel(hp).to(train_dataset.get_device)
     trainer = Trainer(
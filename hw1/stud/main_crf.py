@@ -9,11 +9,12 @@ from torch.optim import Adam
 from torch.utils.data import DataLoader
 
 from callbacks import WriterTensorboardX
-from data_loader import TSVDatasetParser
+from data_loader import TSVDatasetParser, BucketBatchSampler
 from evaluator import Evaluator
 from models import HyperParameters, BaselineModel, CRF_Model
 from training import Trainer, CRF_Trainer
-from utilities import configure_workspace, load_pretrained_embeddings, torch_summarize, load_pickle
+from utilities import configure_workspace, load_pretrained_embeddings, torch_summarize, CheckpointWriter, \
+    fit_oov_embeddings
 
 """
 Was implemented in order to test and run CRF Models
@@ -71,10 +72,13 @@ if __name__ == '__main__':
                          pretrained_embeddings,
                          batch_size)
 
-    # train_dataset_ = DataLoader(dataset=train_dataset, batch_size=batch_size, collate_fn=pad_per_batch)
-    train_dataset_ = DataLoader(dataset=train_dataset, batch_size=batch_size)
-    dev_dataset_ = DataLoader(dataset=dev_dataset, batch_size=batch_size)
-    test_dataset_ = DataLoader(dataset=test_dataset, batch_size=batch_size)
+    max_tokens = 4096
+    train_dataset_ = DataLoader(dataset=train_dataset, collate_fn=TSVDatasetParser.pad_batch,
+                                batch_sampler=BucketBatchSampler(train_dataset.lengths, max_tokens))
+    dev_dataset_ = DataLoader(dataset=dev_dataset, collate_fn=TSVDatasetParser.pad_batch,
+                              batch_sampler=BucketBatchSampler(dev_dataset.lengths, max_tokens, shuffle=False))
+    test_dataset_ = DataLoader(dataset=test_dataset, collate_fn=TSVDatasetParser.pad_batch,
+                               batch_sampler=BucketBatchSampler(test_dataset.lengths, max_tokens, shuffle=False))
 
     if not crf_model:
         model = BaselineModel(hp).to(train_dataset.get_device)
@@ -99,14 +103,23 @@ if __name__ == '__main__':
         log_path = join(getcwd(), 'runs', hp.model_name)
         writer_ = WriterTensorboardX(log_path, logger=logging, enable=True)
 
+        # Keeps "<model name>_last.pth" up to date, so that an interrupted run resumes where it stopped
+        checkpoint_writer = CheckpointWriter(RESOURCES_PATH, best_filename=f'{model.name}_best.pth', keep_last=1)
+        last_checkpoint = join(RESOURCES_PATH, f'{model.name}_last.pth')
+
         trainer = CRF_Trainer(
             model=model,
             loss_function=CrossEntropyLoss(ignore_index=train_dataset.labels2idx['<PAD>']),
             optimizer=Adam(model.parameters()),
             label_vocab=train_dataset.labels2idx,
-            writer=writer_
+            writer=writer_,
+            checkpoint_writer=checkpoint_writer
         )
-        trainer.train(train_dataset_, dev_dataset_, epochs=1)
+        trainer.train(train_dataset_, dev_dataset_, epochs=1, checkpoint_every=200,
+                      resume_from=last_checkpoint if os.path.exists(last_checkpoint) else None)
+        checkpoint_writer.close()
+        if model.oov_embedding is not None:
+            fit_oov_embeddings(model, train_dataset.word2idx)
         model.save_checkpoint(join(RESOURCES_PATH, f"{model.name}_model.pt"))
 
     evaluator = Evaluator(model, test_dataset_, crf_model)
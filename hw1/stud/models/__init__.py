@@ -1,2 +1,4 @@
 from stud.models.hyperparameters import HyperParameters
-from stud.models.models import BaselineModel, CRF_Model
+from stud.models.models import BaselineModel, CRF_Model, BiLSTM_CRF_POS_Model, crf_marginals
+from stud.models.registry import (ARCHITECTURES, INFERENCE_DEFAULTS, write_manifest, load_manifest,
+                                 build_from_manifest, list_models, manifest_path)
@@ -1,16 +1,55 @@
 class HyperParameters():
     def __init__(self, model_name_, vocab, label_vocab, embeddings_, batch_size_):
-        """Defines the model hyperparams"""
+        """Defines the model hyperparams, vocab & label_vocab are either the vocabularies or their sizes"""
         self.model_name = model_name_
-        self.vocab_size = len(vocab)
+        self.vocab_size = len(vocab) if isinstance(vocab, dict) else vocab
         self.hidden_dim = 512
         self.embedding_dim = 300
-        self.num_classes = len(label_vocab)
+        self.num_classes = len(label_vocab) if isinstance(label_vocab, dict) else label_vocab
         self.bidirectional = True
         self.num_layers = 2
         self.dropout = 0.4
         self.embeddings = embeddings_
         self.batch_size = batch_size_
+        # PoS tags embeddings (BiLSTM_CRF_POS_Model), the vocabulary size is 0 for the models not using them
+        self.pos_vocab_size = 0
+        self.pos_embeddings = None
+        # hashed char n-grams OOV embeddings (CRF_Model), 0 disables them, 2 ** 16 buckets is a sensible size
+        self.oov_buckets = 0
+        self.oov_ngram_range = (3, 6)
+        self.oov_cache_size = 10000
+        # word embeddings table compression (CRF_Model): None, 'low_rank' or 'pq', see utilities.compression
+        self.embedding_compression = None
+        self.embedding_rank = 64
+        self.pq_subvectors = 30
+        self.pq_centroids = 256
+        # CRF_Model encoder: 'lstm' or 'idcnn' (iterated dilated CNN, hidden_dim & num_layers are not used)
+        self.encoder = 'lstm'
+        self.idcnn_filters = 300
+        self.idcnn_kernel_size = 3
+        self.idcnn_dilations = (1, 2, 4)
+        self.idcnn_blocks = 4
+
+    def to_dict(self):
+        """
+        JSON serializable config of the architecture, the pretrained word & PoS embeddings are left out (they live
+        in the checkpoint anyway)
+        """
+        return {key: list(value) if isinstance(value, tuple) else value
+                for key, value in vars(self).items() if key not in ('embeddings', 'pos_embeddings')}
+
+    @classmethod
+    def from_dict(cls, config, embeddings_=None, pos_embeddings_=None):
+        """
+        Rebuilds the hyperparameters written by to_dict, keys missing from config keep their defaults so that
+        configs written before a field existed still load
+        """
+        hparams = cls(config['model_name'], config['vocab_size'], config['num_classes'], embeddings_,
+                      config.get('batch_size', 128))
+        hparams.pos_embeddings = pos_embeddings_
+        for key, value in config.items():
+            setattr(hparams, key, tuple(value) if isinstance(value, list) else value)
+        return hparams
 
     def _print_info(self):
         """
@@ -26,5 +65,9 @@ class HyperParameters():
               f"Layers Num: {self.num_layers}",
               f"Dropout: {self.dropout}",
               f"Pretrained_embeddings: {False if self.embeddings is None else True}",
-              f"PoS Pretrained_embeddings: {False if self.pos_embeddings is None else True}",
-              f"Batch Size: {self.batch_size}", sep='\n')
\ No newline at end of file
+              f"PoS Vocab Size: {self.pos_vocab_size}",
+              f"PoS Pretrained_embeddings: {self.pos_embeddings is not None}",
+              f"Batch Size: {self.batch_size}",
+              f"OOV Buckets: {self.oov_buckets}",
+              f"Embeddings Compression: {self.embedding_compression}",
+              f"Encoder: {self.encoder}", sep='\n')
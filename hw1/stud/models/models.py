@@ -1,10 +1,14 @@
+import os
 from typing import List
 
+import numpy as np
 import torch
 import torch.nn as nn
 from torch.nn.modules.module import _addindent
-from torch.nn.utils.rnn import pad_sequence
-from tqdm import tqdm
+from torch.nn.utils.rnn import pad_sequence, pack_padded_sequence, pad_packed_sequence
+
+from stud.utilities.lru_cache import LRUCache
+from stud.utilities.mmap_checkpoint import is_mmap_checkpoint, load_mmap_checkpoint, save_mmap_state_dict
 
 try:
     from torchcrf import CRF
@@ -13,6 +17,194 @@ except ModuleNotFoundError:
     from torchcrf import CRF
 
 
+def _save_state_dict(model, path, writer=None, mmap=False):
+    """
+    Writes the model state_dict once, atomically, either synchronously or through a CheckpointWriter.
+    mmap=True writes the memory mappable format instead (synchronously), see utilities.mmap_checkpoint
+    """
+    from stud.utilities.checkpoint_writer import atomic_save
+
+    if mmap:
+        save_mmap_state_dict(model.state_dict(), path)
+    elif writer is not None:
+        writer.save(model.state_dict(), os.path.relpath(path, writer.checkpoint_dir))
+    else:
+        atomic_save(model.state_dict(), path)
+
+
+class HashedCharNgramEmbedding(nn.Module):
+    """
+    Composes word vectors from character n-grams (fastText like): a word vector is the mean of the vectors of
+    "<word>" and of its n-grams. N-grams are hashed into a fixed number of buckets, so the table size does not
+    depend on the vocabulary, and any word, seen or not during training, gets a vector.
+    """
+
+    def __init__(self, num_buckets, embedding_dim, min_n=3, max_n=6):
+        super(HashedCharNgramEmbedding, self).__init__()
+        self.num_buckets = num_buckets
+        self.min_n = min_n
+        self.max_n = max_n
+        self.ngram_embedding = nn.EmbeddingBag(num_buckets, embedding_dim, mode='mean')
+
+    @staticmethod
+    def fnv1a(text):
+        """
+        32 bits FNV-1a hash, unlike hash(...) it is stable across processes and python versions
+        """
+        hash_ = 0x811c9dc5
+        for byte in text.encode('utf-8'):
+            hash_ = ((hash_ ^ byte) * 0x01000193) & 0xffffffff
+        return hash_
+
+    def ngram_ids(self, word):
+        word = f'<{word}>'
+        ngrams = [word] + [word[i: i + n] for n in range(self.min_n, self.max_n + 1)
+                           for i in range(len(word) - n + 1)]
+        return [self.fnv1a(ngram) % self.num_buckets for ngram in ngrams]
+
+    def forward(self, words):
+        # [Words_Num] -> [Words_Num, Embedding_Dim]
+        ids, offsets = [], []
+        for word in words:
+            offsets.append(len(ids))
+            ids.extend(self.ngram_ids(word))
+        device = self.ngram_embedding.weight.device
+        return self.ngram_embedding(torch.LongTensor(ids).to(device), torch.LongTensor(offsets).to(device))
+
+
+class LowRankEmbedding(nn.Module):
+    """
+    Embedding table factorized as [Vocab_Size, Rank] x [Rank, Embedding_Dim], see utilities.compression
+    """
+
+    def __init__(self, num_embeddings, embedding_dim, rank):
+        super(LowRankEmbedding, self).__init__()
+        self.factors = nn.Embedding(num_embeddings, rank)
+        self.basis = nn.Parameter(torch.zeros(rank, embedding_dim))
+
+    @property
+    def weight(self):
+        return self.factors.weight @ self.basis
+
+    def forward(self, x):
+        # [Samples_Num, Seq_Len] -> [Samples_Num, Seq_Len, Embedding_Dim]
+        return self.factors(x) @ self.basis
+
+
+class PQEmbedding(nn.Module):
+    """
+    Product quantized embedding table: every vector is split into num_subvectors chunks and each chunk is stored
+    as the index of its nearest centroid in a per chunk codebook, see utilities.compression
+    """
+
+    def __init__(self, num_embeddings, embedding_dim, num_subvectors=30, num_centroids=256):
+        super(PQEmbedding, self).__init__()
+        if embedding_dim % num_subvectors != 0:
+            raise ValueError(f'embedding_dim ({embedding_dim}) must be divisible by num_subvectors ({num_subvectors})')
+        self.embedding_dim = embedding_dim
+        codes_dtype = torch.uint8 if num_centroids <= 256 else torch.int32
+        self.register_buffer('codes', torch.zeros(num_embeddings, num_subvectors, dtype=codes_dtype))
+        self.codebooks = nn.Parameter(torch.zeros(num_subvectors, num_centroids, embedding_dim // num_subvectors))
+
+    @property
+    def weight(self):
+        return self(torch.arange(self.codes.shape[0], device=self.codes.device))
+
+    def forward(self, x):
+        # [Samples_Num, Seq_Len] -> [Samples_Num, Seq_Len, Num_Subvectors] -> [Samples_Num, Seq_Len, Embedding_Dim]
+        codes = self.codes[x].long()
+        subspaces = torch.arange(self.codebooks.shape[0], device=codes.device)
+        return self.codebooks[subspaces, codes].reshape(*x.shape, self.embedding_dim)
+
+
+class IDCNNEncoder(nn.Module):
+    """
+    Iterated dilated CNN encoder (Strubell et al., 2017): a block of dilated convolutions, whose receptive field
+    grows exponentially with depth, applied num_blocks times with shared weights. Unlike the LSTM, every position
+    is computed in parallel, there is no time dependency.
+    """
+
+    def __init__(self, input_dim, filters=300, kernel_size=3, dilations=(1, 2, 4), num_blocks=4, dropout=0.4):
+        super(IDCNNEncoder, self).__init__()
+        self.num_blocks = num_blocks
+        self.output_dim = filters
+        self.input_projection = nn.Conv1d(input_dim, filters, kernel_size, padding=kernel_size // 2)
+        self.block = nn.ModuleList([nn.Conv1d(filters, filters, kernel_size, dilation=dilation,
+                                              padding=dilation * (kernel_size // 2)) for dilation in dilations])
+        self.dropout = nn.Dropout(dropout)
+
+    def forward(self, x, mask=None):
+        # padding positions are zeroed at the input and after every convolution, so that they never leak into the
+        # receptive field of real tokens (the input projection already looks at the neighbouring positions)
+        if mask is not None:
+            mask = mask.unsqueeze(-1).to(x.dtype)
+            x = x * mask
+            mask = mask.transpose(1, 2)
+        # [Samples_Num, Seq_Len, Input_Dim] -> [Samples_Num, Filters, Seq_Len]
+        o = self._masked(torch.relu(self.input_projection(x.transpose(1, 2))), mask)
+        for _ in range(self.num_blocks):
+            for conv in self.block:
+                o = self._masked(torch.relu(conv(o)), mask)
+            o = self.dropout(o)
+        # [Samples_Num, Seq_Len, Filters]
+        return o.transpose(1, 2)
+
+    @staticmethod
+    def _masked(o, mask):
+        return o * mask if mask is not None else o
+
+
+def build_word_embedding(hparams):
+    """
+    Word embeddings table, compressed according to hparams.embedding_compression (None, 'low_rank' or 'pq')
+    """
+    compression = getattr(hparams, 'embedding_compression', None)
+    if compression == 'low_rank':
+        return LowRankEmbedding(hparams.vocab_size, hparams.embedding_dim, hparams.embedding_rank)
+    if compression == 'pq':
+        return PQEmbedding(hparams.vocab_size, hparams.embedding_dim, hparams.pq_subvectors, hparams.pq_centroids)
+    if compression is not None:
+        raise ValueError(f'Unknown embedding compression: {compression}')
+    return nn.Embedding(hparams.vocab_size, hparams.embedding_dim)
+
+
+def crf_marginals(crf, emissions, mask=None):
+    """
+    Posterior probability of every tag at every position, p(y_t = k | x), by the forward-backward algorithm in
+    log space, batched: each step is a [Samples_Num, Tags_Num, Tags_Num] logsumexp, the loops only run over time.
+    Padding must be a suffix (as for crf.decode), the scores are carried through it unchanged.
+    Args:
+        crf: torchcrf.CRF, batch_first
+        emissions: [Samples_Num, Seq_Len, Tags_Num]
+        mask: [Samples_Num, Seq_Len], defaults to all positions
+
+    Returns:
+        [Samples_Num, Seq_Len, Tags_Num] marginals, 0 on padding positions
+    """
+    if mask is None:
+        mask = torch.ones(emissions.shape[:2], dtype=torch.bool, device=emissions.device)
+    mask = mask.bool()
+    seq_len = emissions.shape[1]
+    transitions = crf.transitions.unsqueeze(0)
+    step_mask = mask.unsqueeze(-1)
+
+    # alphas[t]: log sum of the scores of the paths y_0..y_t, emission at t included
+    alphas = [crf.start_transitions + emissions[:, 0]]
+    for t in range(1, seq_len):
+        alpha = torch.logsumexp(alphas[-1].unsqueeze(2) + transitions, dim=1) + emissions[:, t]
+        alphas.append(torch.where(step_mask[:, t], alpha, alphas[-1]))
+    # betas[t]: log sum of the scores of the paths y_t+1..end, emission at t excluded
+    betas = [crf.end_transitions.expand_as(alphas[-1])]
+    for t in range(seq_len - 2, -1, -1):
+        beta = torch.logsumexp(transitions + (emissions[:, t + 1] + betas[-1]).unsqueeze(1), dim=2)
+        betas.append(torch.where(step_mask[:, t + 1], beta, betas[-1]))
+    betas.reverse()
+
+    log_partition = torch.logsumexp(alphas[-1] + crf.end_transitions, dim=-1)
+    log_marginals = torch.stack(alphas, dim=1) + torch.stack(betas, dim=1) - log_partition.view(-1, 1, 1)
+    return log_marginals.exp() * step_mask.to(emissions.dtype)
+
+
 class BaselineModel(nn.Module):
     def __init__(self, hparams):
         super(BaselineModel, self).__init__()
@@ -27,17 +219,24 @@ class BaselineModel(nn.Module):
         self.lstm = nn.LSTM(hparams.embedding_dim, hparams.hidden_dim,
                             bidirectional=hparams.bidirectional,
                             num_layers=hparams.num_layers,
-                            dropout=hparams.dropout if hparams.num_layers > 1 else 0)
+                            dropout=hparams.dropout if hparams.num_layers > 1 else 0,
+                            batch_first=True)
 
         lstm_output_dim = hparams.hidden_dim if hparams.bidirectional is False else hparams.hidden_dim * 2
         self.dropout = nn.Dropout(hparams.dropout)
         self.classifier = nn.Linear(lstm_output_dim, hparams.num_classes)
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         # [Samples_Num, Seq_Len]
         embeddings = self.word_embedding(x)
         # [Samples_Num, Seq_Len]
-        o, _ = self.lstm(embeddings)
+        if lengths is None:
+            o, _ = self.lstm(embeddings)
+        else:
+            # packed, so that the backward direction does not read the padding first
+            packed = pack_padded_sequence(embeddings, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            o, _ = self.lstm(packed)
+            o, _ = pad_packed_sequence(o, batch_first=True, total_length=x.shape[1])
         # [Samples_Num, Seq_Len, Tags_Num]
         o = self.dropout(o)
         # [Samples_Num, Seq_Len, Tags_Num]
@@ -45,33 +244,75 @@ class BaselineModel(nn.Module):
         # [Samples_Num, Seq_Len]
         return logits
 
-    def save_checkpoint(self, model_path):
-        torch.save(self, model_path)
+    def save_checkpoint(self, model_path, writer=None, mmap=False):
         model_checkpoint = model_path.replace('.pt', '.pth')
-        torch.save(self.state_dict(), model_checkpoint)
+        _save_state_dict(self, model_checkpoint, writer, mmap)
 
     def load_model(self, path):
+        if is_mmap_checkpoint(path):
+            load_mmap_checkpoint(self, path, self._device)
+            return
         state_dict = torch.load(path, map_location=self._device)
         self.load_state_dict(state_dict)
 
-    def predict_sentences(self, tokens: List[List[str]], words2idx, idx2label):
+    def predict_new(self, x, mask=None, tokens=None):
+        """
+        Greedy counterpart of CRF_Model.predict_new, so that both models are served the same way
+        Args:
+            x: [Samples_Num, Seq_Len] words indices
+            mask: optional [Samples_Num, Seq_Len], defaults to the non padding positions
+            tokens: unused, the baseline has no OOV embeddings
+
+        Returns:
+            list of tags ids lists, trimmed to the sentences lengths
+        """
+        mask = (x != 0) if mask is None else mask.bool()
+        lengths = mask.sum(-1)
+        logits = self(x, lengths.clamp(min=1))
+        # <PAD> (label 0) is never a valid prediction
+        predictions = (torch.argmax(logits[:, :, 1:], -1) + 1).tolist()
+        return [tags[:length] for tags, length in zip(predictions, lengths.tolist())]
+
+    def predict_with_scores(self, x, mask=None, tokens=None, confidence=None):
+        """
+        predict_new along with a per token confidence, the softmax probability of the predicted tag
+        (confidence is unused, it is the only one a greedy tagger has)
+
+        Returns:
+            list of tags ids lists, [Samples_Num, Seq_Len] scores
+        """
+        mask = (x != 0) if mask is None else mask.bool()
+        lengths = mask.sum(-1)
+        probabilities = torch.softmax(self(x, lengths.clamp(min=1))[:, :, 1:], dim=-1)
+        scores, tags = probabilities.max(dim=-1)
+        return [tags_[:length] for tags_, length in zip((tags + 1).tolist(), lengths.tolist())], scores
+
+    def predict_sentences(self, tokens: List[List[str]], words2idx, idx2label, batch_size=128):
+        """
+        Tags sentences by batches of sentences of similar lengths, which keeps padding low
+        Args:
+            tokens: list of sentences, each a list of tokens
+            words2idx:
+            idx2label:
+            batch_size: sentences per forward pass
+
+        Returns:
+            list of tags lists, aligned with tokens
+        """
         self.eval()
-        predictions_lst = []
-<<<<<<< Updated upstream:models/models.py
-        tokens_ = [[_x.lower() for _x in x] for x in tokens]
-        for inputs in tqdm(tokens_):
-            inputs = torch.LongTensor([words2idx.get(word, 1) for word in inputs]).unsqueeze(0).to(self.device)
-=======
-        for inputs in tqdm(tokens):
-            inputs = torch.LongTensor(
-                [words2idx.get(word, 1) for word in inputs]).unsqueeze(0).to(self._device)
->>>>>>> Stashed changes:hw1/stud/models/models.py
-            logits = self.predict(inputs)
-            predictions = torch.argmax(logits, -1).view(-1)
-            valid_indices = predictions != 0
-            predictions_ = predictions[valid_indices]
-            predictions_lst.append([idx2label.get(tag)
-                                    for tag in predictions_[0]])
+        encoded = [torch.LongTensor([words2idx.get(word.lower(), 1) for word in sentence]) for sentence in tokens]
+        order = sorted((idx for idx in range(len(encoded)) if len(encoded[idx])), key=lambda idx: len(encoded[idx]))
+        predictions_lst = [[] for _ in tokens]
+        with torch.no_grad():
+            for start in range(0, len(order), batch_size):
+                batch = order[start: start + batch_size]
+                lengths = torch.LongTensor([len(encoded[idx]) for idx in batch])
+                inputs = pad_sequence([encoded[idx] for idx in batch], batch_first=True).to(self._device)
+                logits = self(inputs, lengths)
+                # <PAD> (label 0) is never a valid prediction
+                predictions = (torch.argmax(logits[:, :, 1:], -1) + 1).tolist()
+                for idx, length, tags in zip(batch, lengths.tolist(), predictions):
+                    predictions_lst[idx] = [idx2label.get(tag) for tag in tags[:length]]
         return predictions_lst
 
 
@@ -80,29 +321,84 @@ class CRF_Model(nn.Module):
         super(CRF_Model, self).__init__()
         self._device = 'cuda' if torch.cuda.is_available() else 'cpu'
         self.name = hparams.model_name
-        self.word_embedding = nn.Embedding(
-            hparams.vocab_size, hparams.embedding_dim)
-        if hparams.embeddings is not None:
+        self.word_embedding = build_word_embedding(hparams)
+        if hparams.embeddings is not None and isinstance(self.word_embedding, nn.Embedding):
             print("initializing embeddings from pretrained")
             self.word_embedding.weight.data.copy_(hparams.embeddings)
 
-        self.lstm = nn.LSTM(hparams.embedding_dim, hparams.hidden_dim,
-                            bidirectional=hparams.bidirectional,
-                            num_layers=hparams.num_layers,
-                            dropout=hparams.dropout if hparams.num_layers > 1 else 0,
-                            batch_first=True)
+        # 'lstm' (stacked BiLSTM) or 'idcnn' (iterated dilated CNN)
+        self.encoder = getattr(hparams, 'encoder', 'lstm')
+        if self.encoder == 'idcnn':
+            self.idcnn = IDCNNEncoder(hparams.embedding_dim, hparams.idcnn_filters, hparams.idcnn_kernel_size,
+                                      hparams.idcnn_dilations, hparams.idcnn_blocks, hparams.dropout)
+            encoder_output_dim = self.idcnn.output_dim
+        elif self.encoder == 'lstm':
+            self.lstm = nn.LSTM(hparams.embedding_dim, hparams.hidden_dim,
+                                bidirectional=hparams.bidirectional,
+                                num_layers=hparams.num_layers,
+                                dropout=hparams.dropout if hparams.num_layers > 1 else 0,
+                                batch_first=True)
+            encoder_output_dim = hparams.hidden_dim if hparams.bidirectional is False else hparams.hidden_dim * 2
+        else:
+            raise ValueError(f'Unknown encoder: {self.encoder}')
 
-        lstm_output_dim = hparams.hidden_dim if hparams.bidirectional is False else hparams.hidden_dim * 2
         self.dropout = nn.Dropout(hparams.dropout)
-        self.classifier = nn.Linear(lstm_output_dim, hparams.num_classes)
+        self.classifier = nn.Linear(encoder_output_dim, hparams.num_classes)
         self.crf = CRF(hparams.num_classes, batch_first=True)
 
-    def forward(self, x):
-        # [Samples_Num, Seq_Len]
+        # Composes vectors of <UNK> tokens from their characters n-grams, disabled when oov_buckets is 0
+        self.oov_embedding = None
+        if getattr(hparams, 'oov_buckets', 0):
+            min_n, max_n = hparams.oov_ngram_range
+            self.oov_embedding = HashedCharNgramEmbedding(hparams.oov_buckets, hparams.embedding_dim, min_n, max_n)
+            self.oov_cache = LRUCache(max_entries=hparams.oov_cache_size)
+
+    def embed(self, x, tokens=None):
+        """
+        Looks up word embeddings, <UNK> positions get the vector composed from their tokens characters n-grams
+        Args:
+            x: [Samples_Num, Seq_Len] words indices
+            tokens: optional list of lists of the (lowercased) tokens x was encoded from
+
+        Returns:
+            [Samples_Num, Seq_Len, Embedding_Dim]
+        """
         embeddings = self.word_embedding(x)
+        if tokens is None or self.oov_embedding is None:
+            return embeddings
+        oov_positions = (x == 1).nonzero()
+        if len(oov_positions) == 0:
+            return embeddings
+        words = [tokens[i][j] for i, j in oov_positions.tolist()]
+        embeddings = embeddings.clone()
+        embeddings[oov_positions[:, 0], oov_positions[:, 1]] = self.compose_oov(words)
+        return embeddings
+
+    def compose_oov(self, words):
+        """
+        Composed vectors of OOV words. At inference they are served from a bounded LRU cache, so that frequent
+        OOV tokens are composed once while memory stays fixed
+        """
+        if self.training:
+            return self.oov_embedding(words)
+        vectors = [self.oov_cache.get(word) for word in words]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            composed = self.oov_embedding([words[i] for i in missing]).detach()
+            for i, vector in zip(missing, composed):
+                self.oov_cache.put(words[i], vector)
+                vectors[i] = vector
+        return torch.stack(vectors)
+
+    def forward(self, x, tokens=None):
+        # [Samples_Num, Seq_Len]
+        embeddings = self.embed(x, tokens)
         embeddings = self.dropout(embeddings)
         # [Samples_Num, Seq_Len]
-        o, _ = self.lstm(embeddings)
+        if self.encoder == 'idcnn':
+            o = self.idcnn(embeddings, mask=x != 0)
+        else:
+            o, _ = self.lstm(embeddings)
         # [Samples_Num, Seq_Len, Tags_Num]
         o = self.dropout(o)
         # [Samples_Num, Seq_Len, Tags_Num]
@@ -114,26 +410,85 @@ class CRF_Model(nn.Module):
         emissions = self(x)
         return self.crf(emissions, tags, mask=mask)
 
-    def predict(self, x):
+    def log_probs_and_decode(self, x, tags, mask=None):
+        """
+        Runs the encoder once, and derives from the same emissions both the CRF log likelihood of tags
+        and the Viterbi decoded tags
+        Args:
+            x:
+            tags:
+            mask:
+
+        Returns:
+            (log likelihood summed over the batch, list of decoded tags per sentence)
+        """
         emissions = self(x)
-        return self.crf.decode(emissions)
+        return self.crf(emissions, tags, mask=mask), self.crf.decode(emissions, mask=mask)
 
-    def predict_new(self, x, mask=None):
+    def predict(self, x, marginals=False):
         emissions = self(x)
+        if marginals:
+            return self.crf.decode(emissions), crf_marginals(self.crf, emissions)
+        return self.crf.decode(emissions)
+
+    def predict_new(self, x, mask=None, tokens=None, marginals=False):
+        """
+        Viterbi decoding
+        Args:
+            x: [Samples_Num, Seq_Len] words indices
+            mask:
+            tokens: optional lowercased tokens, see embed
+            marginals: also returns the [Samples_Num, Seq_Len, Tags_Num] tags marginals (see crf_marginals),
+                       about the cost of a second decoding
+
+        Returns:
+            list of tags ids lists[, marginals]
+        """
+        emissions = self(x, tokens)
+        if marginals:
+            return self.crf.decode(emissions, mask=mask), crf_marginals(self.crf, emissions, mask)
         return self.crf.decode(emissions, mask=mask)
 
-    def save_checkpoint(self, model_path):
+    def predict_with_scores(self, x, mask=None, tokens=None, confidence='emissions'):
         """
-        Saves the model checkpoint
+        predict_new along with a per token confidence of the Viterbi tag
+        Args:
+            x:
+            mask:
+            tokens:
+            confidence: 'emissions', its softmax probability under the emissions alone (ignores the transitions),
+                        or 'marginals', its posterior probability p(y_t | x) under the CRF (forward-backward)
+
+        Returns:
+            list of tags ids lists, [Samples_Num, Seq_Len] scores
+        """
+        emissions = self(x, tokens)
+        tags_s = self.crf.decode(emissions, mask=mask)
+        tags = torch.zeros(x.shape, dtype=torch.long, device=emissions.device)
+        for idx, tags_ in enumerate(tags_s):
+            tags[idx, :len(tags_)] = torch.as_tensor(tags_, dtype=torch.long)
+        if confidence == 'marginals':
+            probabilities = crf_marginals(self.crf, emissions, mask)
+        elif confidence == 'emissions':
+            probabilities = torch.softmax(emissions, dim=-1)
+        else:
+            raise ValueError(f'Unknown confidence: {confidence}')
+        scores = probabilities.gather(-1, tags.unsqueeze(-1)).squeeze(-1)
+        return tags_s, scores
+
+    def save_checkpoint(self, model_path, writer=None, mmap=False):
+        """
+        Saves the model state_dict checkpoint, written atomically to "model_path" with a ".pth" extension
         Args:
             model_path:
+            writer: optional CheckpointWriter, if given the checkpoint is written on its background thread
+            mmap: write the memory mappable format, which load_model maps instead of unpickling
 
         Returns:
 
         """
-        torch.save(self, model_path)
         model_checkpoint = model_path.replace('.pt', '.pth')
-        torch.save(self.state_dict(), model_checkpoint)
+        _save_state_dict(self, model_checkpoint, writer, mmap)
 
     def load_model(self, path):
         """
@@ -144,9 +499,14 @@ class CRF_Model(nn.Module):
         Returns:
 
         """
-        state_dict = torch.load(path) if self._device == 'cuda' else torch.load(path,
-                                                                                map_location=torch.device(self._device))
-        self.load_state_dict(state_dict)
+        if is_mmap_checkpoint(path):
+            load_mmap_checkpoint(self, path, self._device)
+        else:
+            state_dict = torch.load(path) if self._device == 'cuda' else \
+                torch.load(path, map_location=torch.device(self._device))
+            self.load_state_dict(state_dict)
+        if self.oov_embedding is not None:
+            self.oov_cache.clear()
 
     def encode_tokens(self, tokens, word2idx):
         """
@@ -185,7 +545,7 @@ class BiLSTM_CRF_POS_Model(nn.Module):
             self.word_embedding.weight.data.copy_(hparams.embeddings)
         if hparams.pos_embeddings is not None:
             print("initializing pos embeddings from pretrained")
-            self.word_embedding.weight.data.copy_(hparams.embeddings)
+            self.pos_embedding.weight.data.copy_(hparams.pos_embeddings)
 
         self.word_dropout = nn.Dropout(hparams.dropout)
         self.pos_dropout = nn.Dropout(hparams.dropout)
@@ -222,26 +582,24 @@ class BiLSTM_CRF_POS_Model(nn.Module):
         emissions = self(x, pos)
         return self.crf(emissions, tags, mask=mask)
 
-    def predict(self, x, mask, pos):
+    def predict(self, x, mask, pos, marginals=False):
+        """
+        marginals=True also returns the tags marginals, see crf_marginals
+        """
         self.eval()
-<<<<<<< Updated upstream:models/models.py
-        predictions_lst = []
-        tokens_ = [[_x.lower() for _x in x] for x in tokens]
-        for inputs in tqdm(tokens_):
-            inputs = torch.LongTensor([words2idx.get(word, 1) for word in inputs]).unsqueeze(0).to(self.device)
-            predictions = self.predict(inputs)
-            predictions_lst.append([idx2label.get(tag) for tag in predictions[0]])
-        return predictions_lst
-=======
         with torch.no_grad():
             emissions = self(x, pos)
+            if marginals:
+                return self.crf.decode(emissions, mask=mask), crf_marginals(self.crf, emissions, mask)
             return self.crf.decode(emissions, mask=mask)
 
-    def save_checkpoint(self, dir_path):
-        torch.save(self, f"{dir_path}.pt")
-        torch.save(self.state_dict(), f"{dir_path}.pth")
+    def save_checkpoint(self, dir_path, writer=None, mmap=False):
+        _save_state_dict(self, f"{dir_path}.pth", writer, mmap)
 
     def load_model(self, path):
+        if is_mmap_checkpoint(path):
+            load_mmap_checkpoint(self, path, self._device)
+            return
         state_dict = torch.load(path) if self._device == 'cuda' else torch.load(path, map_location=self._device)
         self.load_state_dict(state_dict)
 
@@ -278,4 +636,3 @@ class BiLSTM_CRF_POS_Model(nn.Module):
                          for p in self.parameters() if p.requires_grad)
         print(f"Number of parameters: {num_params:,}")
         print('==================================================')
->>>>>>> Stashed changes:hw1/stud/models/models.py
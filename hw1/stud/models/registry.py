@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+from os.path import dirname, join, isabs
+
+from stud.models.hyperparameters import HyperParameters
+from stud.models.models import BaselineModel, CRF_Model, BiLSTM_CRF_POS_Model
+from stud.utilities.utils import load_pickle
+
+"""
+Model registry: every servable checkpoint ships with a manifest ("<name>.manifest.json", next to the checkpoint)
+describing how to rebuild it, i.e. the architecture, its hyperparameters, the vocabulary & label map files (with
+their sha256, so a checkpoint is never served with the wrong vocabulary) and the inference options it was validated
+with (batch size, sliding windows, cache, ...). Serving, evaluation and benchmarking instantiate models from the
+manifest instead of hardcoding names and dims.
+"""
+
+MANIFEST_SUFFIX = '.manifest.json'
+MANIFEST_VERSION = 1
+
+ARCHITECTURES = {
+    'CRF_Model': CRF_Model,
+    'BaselineModel': BaselineModel,
+    'BiLSTM_CRF_POS_Model': BiLSTM_CRF_POS_Model,
+}
+
+# inference options a manifest may set, with the defaults used when it does not
+INFERENCE_DEFAULTS = {
+    'batch_size': 128,
+    # None tags sentences whole, a manifest opts into sliding windows by setting the size (e.g. the training max_len)
+    'window_size': None,
+    'window_overlap': 16,
+    'merge_policy': 'center',
+    'cache_size': 10000,
+    'cache_max_tokens': None,
+    # per token confidence of CRF models, 'emissions' or 'marginals' (opt-in, forward-backward on every batch),
+    # see CRF_Model.predict_with_scores
+    'confidence': 'emissions',
+}
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, mode='rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def manifest_path(model_dir, name):
+    return join(model_dir, f'{name}{MANIFEST_SUFFIX}')
+
+
+def list_models(model_dir):
+    """
+    Names of the models of model_dir having a manifest
+    """
+    if not os.path.isdir(model_dir):
+        return []
+    return sorted(file_name[:-len(MANIFEST_SUFFIX)] for file_name in os.listdir(model_dir)
+                  if file_name.endswith(MANIFEST_SUFFIX))
+
+
+def write_manifest(path, name, architecture, hparams, checkpoint, word2idx_path, idx2label_path, inference=None):
+    """
+    Writes the manifest of a checkpoint, file paths are stored relative to the manifest directory
+    Args:
+        path: manifest path, see manifest_path
+        name: model name
+        architecture: one of ARCHITECTURES
+        hparams: HyperParameters of the model
+        checkpoint: checkpoint path, torch or memory mappable format
+        word2idx_path:
+        idx2label_path:
+        inference: inference options overriding INFERENCE_DEFAULTS
+
+    Returns:
+        the manifest dict
+    """
+    if architecture not in ARCHITECTURES:
+        raise ValueError(f'Unknown architecture: {architecture}')
+    unknown = set(inference or {}) - set(INFERENCE_DEFAULTS)
+    if unknown:
+        raise ValueError(f'Unknown inference options: {sorted(unknown)}')
+    base_dir = dirname(os.path.abspath(path))
+    idx2label = load_pickle(idx2label_path)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'name': name,
+        'architecture': architecture,
+        'hparams': hparams.to_dict(),
+        'checkpoint': os.path.relpath(checkpoint, base_dir),
+        'vocab': {'path': os.path.relpath(word2idx_path, base_dir), 'sha256': file_sha256(word2idx_path)},
+        'labels': {'path': os.path.relpath(idx2label_path, base_dir), 'sha256': file_sha256(idx2label_path),
+                   'idx2label': {str(idx): label for idx, label in idx2label.items()}},
+        'inference': {**INFERENCE_DEFAULTS, **(inference or {})},
+    }
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, encoding='utf-8', mode='w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def load_manifest(path, verify=True):
+    """
+    Reads a manifest, resolving its file paths against the manifest directory
+    Args:
+        path:
+        verify: checks the vocabulary & label map files against their recorded sha256
+
+    Returns:
+        the manifest dict, inference options completed with INFERENCE_DEFAULTS
+    """
+    with open(path, encoding='utf-8', mode='r') as f:
+        manifest = json.load(f)
+    if manifest.get('version', MANIFEST_VERSION) > MANIFEST_VERSION:
+        raise ValueError(f"{path}: manifest version {manifest['version']} is newer than supported "
+                         f"({MANIFEST_VERSION})")
+    if manifest['architecture'] not in ARCHITECTURES:
+        raise ValueError(f"{path}: unknown architecture {manifest['architecture']}")
+    base_dir = dirname(os.path.abspath(path))
+
+    def resolve(file_path):
+        return file_path if isabs(file_path) else join(base_dir, file_path)
+
+    manifest['checkpoint'] = resolve(manifest['checkpoint'])
+    for key in ('vocab', 'labels'):
+        manifest[key]['path'] = resolve(manifest[key]['path'])
+        if verify and manifest[key].get('sha256') and file_sha256(manifest[key]['path']) != manifest[key]['sha256']:
+            raise ValueError(f"{path}: {manifest[key]['path']} does not match the sha256 recorded in the manifest")
+    manifest['inference'] = {**INFERENCE_DEFAULTS, **manifest.get('inference', {})}
+    return manifest
+
+
+def build_from_manifest(manifest, device='cpu', load_weights=True):
+    """
+    Instantiates the model a manifest describes
+    Args:
+        manifest: manifest dict or manifest path
+        device:
+        load_weights: False builds the architecture only, e.g. to train it
+
+    Returns:
+        model (in eval mode), word2idx, idx2label, manifest
+    """
+    if not isinstance(manifest, dict):
+        manifest = load_manifest(manifest)
+    word2idx = load_pickle(manifest['vocab']['path'])
+    idx2label = {int(idx): label for idx, label in manifest['labels']['idx2label'].items()}
+    hparams = HyperParameters.from_dict(manifest['hparams'])
+    if hparams.vocab_size != len(word2idx) or hparams.num_classes != len(idx2label):
+        raise ValueError(f"{manifest['name']}: the vocabularies do not match the hyperparameters sizes")
+    model = ARCHITECTURES[manifest['architecture']](hparams).to(device)
+    if load_weights:
+        model.load_model(manifest['checkpoint'])
+    model.eval()
+    return model, word2idx, idx2label, manifest
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Writes the manifest of a trained checkpoint')
+    parser.add_argument('checkpoint', type=str)
+    parser.add_argument('--name', type=str, required=True)
+    parser.add_argument('--architecture', choices=sorted(ARCHITECTURES), default='CRF_Model')
+    parser.add_argument('--word2idx', type=str, required=True)
+    parser.add_argument('--idx2label', type=str, required=True)
+    parser.add_argument('--config', type=str, default=None,
+                        help='json of the hyperparameters overriding the defaults, e.g. {"encoder": "idcnn"}')
+    parser.add_argument('--inference', type=str, default=None, help='json of the inference options')
+    args = parser.parse_args()
+
+    hp = HyperParameters(args.name, load_pickle(args.word2idx), load_pickle(args.idx2label), None, 128)
+    for key, value in json.loads(args.config or '{}').items():
+        setattr(hp, key, tuple(value) if isinstance(value, list) else value)
+    out_path = manifest_path(dirname(os.path.abspath(args.checkpoint)), args.name)
+    write_manifest(out_path, args.name, args.architecture, hp, args.checkpoint, args.word2idx, args.idx2label,
+                   json.loads(args.inference or '{}'))
+    print(f'Manifest written to {out_path}')
@@ -0,0 +1,124 @@
+import struct
+from typing import List, Tuple, Union
+
+import numpy as np
+
+"""
+Compact binary protocol of the tagging service (content type CONTENT_TYPE), all integers little endian.
+
+Request:  MAGIC | flags: uint8 | sentences num: uint32 | tokens offsets: uint32[sentences num + 1] | payload
+    flags & TOKEN_IDS == 0: payload = characters offsets: uint32[tokens num + 1] | utf-8 bytes of the tokens
+    flags & TOKEN_IDS != 0: payload = token ids: int32[tokens num], already encoded with the model word2idx
+    flags & SPANS != 0: entity spans are requested instead of tags
+Response: MAGIC | flags: uint8 | sentences num: uint32 | tokens offsets: uint32[sentences num + 1] | tag ids: uint8[]
+Spans response (flags & SPANS): MAGIC | flags | sentences num | spans offsets: uint32[sentences num + 1] |
+    starts: uint32[spans num] | ends (excluded): uint32[spans num] | tag ids: uint8[spans num] | scores: float32[]
+
+Sentence i spans tokens offsets[i]: offsets[i + 1]. Tag ids map to labels through the service idx2label (GET /labels).
+"""
+
+CONTENT_TYPE = 'application/x-ner-binary'
+MAGIC = b'NER1'
+TOKEN_IDS = 1
+SPANS = 2
+
+_HEADER = struct.Struct('<4sBI')
+
+
+def _sentence_offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype='<u4')
+    offsets[1:] = np.cumsum(lengths)
+    return offsets
+
+
+def _pack(flags, lengths, payload):
+    offsets = _sentence_offsets(lengths)
+    return b''.join([_HEADER.pack(MAGIC, flags, len(lengths)), offsets.tobytes(), *payload])
+
+
+def _unpack_header(buffer):
+    magic, flags, num_sentences = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a binary tagging request/response')
+    start = _HEADER.size
+    offsets = np.frombuffer(buffer, dtype='<u4', count=num_sentences + 1, offset=start)
+    return flags, offsets, start + offsets.nbytes
+
+
+def encode_tokens(tokens_s: List[List[str]], spans=False) -> bytes:
+    words = [token.encode('utf-8') for tokens in tokens_s for token in tokens]
+    char_offsets = _sentence_offsets([len(word) for word in words])
+    return _pack(SPANS if spans else 0, [len(tokens) for tokens in tokens_s], [char_offsets.tobytes(), *words])
+
+
+def encode_token_ids(ids_s: List[List[int]], spans=False) -> bytes:
+    ids = np.fromiter((idx for ids in ids_s for idx in ids), dtype='<i4')
+    return _pack(TOKEN_IDS | (SPANS if spans else 0), [len(ids) for ids in ids_s], [ids.tobytes()])
+
+
+def wants_spans(buffer: bytes) -> bool:
+    flags, _, _ = _unpack_header(buffer)
+    return bool(flags & SPANS)
+
+
+def decode_request(buffer: bytes) -> Tuple[bool, Union[List[List[str]], List[np.ndarray]]]:
+    """
+    Returns:
+        (True, list of int32 arrays of token ids) or (False, list of lists of tokens)
+    """
+    flags, offsets, start = _unpack_header(buffer)
+    num_tokens = int(offsets[-1])
+    if len(offsets) == 1:
+        return bool(flags & TOKEN_IDS), []
+    if flags & TOKEN_IDS:
+        ids = np.frombuffer(buffer, dtype='<i4', count=num_tokens, offset=start)
+        return True, np.split(ids, offsets[1:-1])
+    char_offsets = np.frombuffer(buffer, dtype='<u4', count=num_tokens + 1, offset=start)
+    text = buffer[start + char_offsets.nbytes:]
+    words = [text[char_offsets[i]: char_offsets[i + 1]].decode('utf-8') for i in range(num_tokens)]
+    return False, [words[offsets[i]: offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def encode_tags(tag_ids_s: List[List[int]]) -> bytes:
+    tag_ids = np.fromiter((tag for tags in tag_ids_s for tag in tags), dtype=np.uint8)
+    return _pack(0, [len(tags) for tags in tag_ids_s], [tag_ids.tobytes()])
+
+
+def _check_response_flags(flags, expected):
+    if flags != expected:
+        raise ValueError(f"Expected a {'spans' if expected & SPANS else 'tags'} response, got flags {flags}")
+
+
+def decode_tags(buffer: bytes) -> List[np.ndarray]:
+    flags, offsets, start = _unpack_header(buffer)
+    _check_response_flags(flags, 0)
+    if len(offsets) == 1:
+        return []
+    tag_ids = np.frombuffer(buffer, dtype=np.uint8, count=int(offsets[-1]), offset=start)
+    return np.split(tag_ids, offsets[1:-1])
+
+
+def encode_spans(spans_s: List[List[Tuple[int, int, int, float]]]) -> bytes:
+    """
+    Args:
+        spans_s: (start, end, tag id, score) spans of every sentence
+    """
+    spans = [span for spans in spans_s for span in spans]
+    columns = [np.fromiter((span[0] for span in spans), dtype='<u4', count=len(spans)),
+               np.fromiter((span[1] for span in spans), dtype='<u4', count=len(spans)),
+               np.fromiter((span[2] for span in spans), dtype=np.uint8, count=len(spans)),
+               np.fromiter((span[3] for span in spans), dtype='<f4', count=len(spans))]
+    return _pack(SPANS, [len(spans) for spans in spans_s], [column.tobytes() for column in columns])
+
+
+def decode_spans(buffer: bytes) -> List[List[Tuple[int, int, int, float]]]:
+    flags, offsets, start = _unpack_header(buffer)
+    _check_response_flags(flags, SPANS)
+    num_spans = int(offsets[-1])
+    columns = []
+    for dtype in ('<u4', '<u4', np.uint8, '<f4'):
+        column = np.frombuffer(buffer, dtype=dtype, count=num_spans, offset=start)
+        columns.append(column.tolist())
+        start += column.nbytes
+    spans = list(zip(*columns))
+    return [spans[offsets[i]: offsets[i + 1]] for i in range(len(offsets) - 1)]
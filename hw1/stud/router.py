@@ -0,0 +1,270 @@
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from stud.implementation import StudentModel, CascadeModel
+
+"""
+Serves several registered models from one process: requests are routed to a model by name (the X-Model header)
+or split by percentage, a model can be hot swapped from a new manifest without dropping traffic, and a shadow
+model can tag a sample of the traffic in the background, reporting its latency and its agreement with the model
+that answered.
+
+The routing state is an immutable RoutingTable replaced as a whole, a request reads it once and keeps the models it
+got even if they are swapped meanwhile, so loading a model never blocks nor fails the requests in flight.
+"""
+
+RoutingTable = namedtuple('RoutingTable', ['models', 'default', 'weights', 'shadow', 'shadow_rate'])
+
+
+class UnknownModelError(KeyError):
+    """
+    The model a request asked for is not registered
+    """
+
+
+class LatencyStats:
+    """
+    Count, mean and percentiles of the last `window` latencies
+    """
+
+    def __init__(self, window=1000):
+        self.count, self.total = 0, 0.0
+        self._recent = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self._recent.append(seconds)
+
+    def summary(self):
+        recent = sorted(self._recent)
+
+        def percentile(q):
+            return 1000 * recent[min(int(len(recent) * q), len(recent) - 1)] if recent else 0.0
+
+        return {'count': self.count, 'mean_ms': 1000 * self.total / max(self.count, 1),
+                'p50_ms': percentile(0.5), 'p99_ms': percentile(0.99)}
+
+
+class ShadowStats:
+    """
+    Agreement of a shadow model with the models it shadows, over the sampled requests
+    """
+
+    def __init__(self, shadow, window=1000):
+        self.shadow = shadow
+        self.requests, self.sentences, self.exact_sentences = 0, 0, 0
+        self.tokens, self.agreeing_tokens = 0, 0
+        self.dropped, self.errors = 0, 0
+        self.primary_latency = LatencyStats(window)
+        self.shadow_latency = LatencyStats(window)
+
+    def add(self, primary_predictions, shadow_predictions, primary_seconds, shadow_seconds):
+        self.requests += 1
+        self.primary_latency.add(primary_seconds)
+        self.shadow_latency.add(shadow_seconds)
+        for primary, shadow in zip(primary_predictions, shadow_predictions):
+            self.sentences += 1
+            self.exact_sentences += primary == shadow
+            self.tokens += len(primary)
+            self.agreeing_tokens += sum(p == s for p, s in zip(primary, shadow))
+
+    def summary(self):
+        return {'model': self.shadow, 'requests': self.requests, 'dropped': self.dropped, 'errors': self.errors,
+                'sentences': self.sentences,
+                'token_agreement': self.agreeing_tokens / self.tokens if self.tokens else None,
+                'sentence_agreement': self.exact_sentences / self.sentences if self.sentences else None,
+                'primary_latency': self.primary_latency.summary(),
+                'shadow_latency': self.shadow_latency.summary()}
+
+
+class ModelRouter:
+    def __init__(self, device='cpu', max_shadow_pending=4, seed=None):
+        """
+        Args:
+            device: device the models are loaded on
+            max_shadow_pending: shadow predictions queued at most, sampled requests beyond it are dropped so that
+                                a slow shadow model never builds up a backlog
+            seed: seed of the traffic split & shadow sampling
+        """
+        self.device = device
+        self.max_shadow_pending = max_shadow_pending
+        self._table = RoutingTable({}, None, {}, None, 0.0)
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._latency = {}
+        self._shadow_stats = None
+        self._shadow_pending = 0
+        self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow')
+
+    @property
+    def table(self):
+        return self._table
+
+    def _update(self, **changes):
+        with self._lock:
+            table = self._table._replace(**changes)
+            if table.default is not None and table.default not in table.models:
+                raise ValueError(f'Unknown default model: {table.default}')
+            if table.shadow is not None and table.shadow not in table.models:
+                raise ValueError(f'Unknown shadow model: {table.shadow}')
+            unknown = set(table.weights) - set(table.models)
+            if unknown:
+                raise ValueError(f'Unknown models in the traffic split: {sorted(unknown)}')
+            self._table = table
+
+    def add(self, name, student_model, default=False):
+        """
+        Registers a loaded model, replacing (hot swapping) the model with the same name if any
+        """
+        with self._lock:
+            table = self._table
+            self._table = table._replace(models={**table.models, name: student_model},
+                                         default=name if default or table.default is None else table.default)
+
+    def load(self, manifest_path, name=None, default=False, cascade=None, **inference):
+        """
+        Loads a model from its manifest and registers it under name (the manifest name by default). The model is
+        built before the routing table is touched, until then requests keep using the previous model.
+        Args:
+            manifest_path:
+            name:
+            default: makes it the default model
+            cascade: optional {"gate": manifest path[, "threshold", "audit_rate"]}, serves the model behind a
+                     gate model, see CascadeModel
+            **inference: inference options overriding the manifest ones
+
+        Returns:
+            the name the model is registered under
+        """
+        student_model = StudentModel(self.device, manifest_path=manifest_path, **inference)
+        if cascade is not None:
+            gate = StudentModel(self.device, manifest_path=cascade['gate'])
+            student_model = CascadeModel(gate, student_model, cascade.get('threshold', 0.9),
+                                         cascade.get('audit_rate', 0.0))
+        name = name or student_model.name
+        self.add(name, student_model, default)
+        return name
+
+    def remove(self, name):
+        with self._lock:
+            table = self._table
+            if name not in table.models:
+                raise KeyError(name)
+            if name == table.default:
+                raise ValueError(f'{name} is the default model, set another default first')
+            self._table = table._replace(models={key: val for key, val in table.models.items() if key != name},
+                                         weights={key: val for key, val in table.weights.items() if key != name},
+                                         shadow=None if table.shadow == name else table.shadow)
+
+    def set_default(self, name):
+        self._update(default=name)
+
+    def set_weights(self, weights):
+        """
+        Splits the traffic without an explicit model by percentage, e.g. {"a": 90, "b": 10}, {} sends it all to
+        the default model
+        """
+        if any(weight < 0 for weight in weights.values()) or (weights and sum(weights.values()) <= 0):
+            raise ValueError('Traffic split weights must be positive')
+        self._update(weights=dict(weights))
+
+    def set_shadow(self, name, rate=0.1):
+        """
+        Shadows a sample (rate) of the traffic with model name, None stops shadowing. Resets the shadow stats
+        """
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError('The shadow rate must be in [0, 1]')
+        self._update(shadow=name, shadow_rate=rate if name is not None else 0.0)
+        with self._stats_lock:
+            self._shadow_stats = ShadowStats(name) if name is not None else None
+
+    def route(self, name=None, table=None):
+        """
+        Picks the model serving a request: name if given, else by traffic split, else the default one
+
+        Returns:
+            name, StudentModel
+        """
+        table = table or self._table
+        if name is None and table.weights:
+            names, weights = zip(*table.weights.items())
+            name = self._random.choices(names, weights)[0]
+        name = name or table.default
+        if name not in table.models:
+            raise UnknownModelError(f'Unknown model: {name}')
+        return name, table.models[name]
+
+    def predict(self, tokens_s, name=None, spans=False):
+        """
+        Tags tokens_s with the routed model, sampled requests are tagged by the shadow model in the background
+        Args:
+            tokens_s:
+            name: model to use, routed if None
+            spans: entity spans instead of tags, see StudentModel.predict_spans
+
+        Returns:
+            name of the model that answered, predictions
+        """
+        table = self._table
+        name, student_model = self.route(name, table)
+        begin = time.perf_counter()
+        predictions_s = student_model.predict_spans(tokens_s) if spans else student_model.predict(tokens_s)
+        elapsed = time.perf_counter() - begin
+        with self._stats_lock:
+            self._latency.setdefault(name, LatencyStats()).add(elapsed)
+        if table.shadow is not None and table.shadow != name and self._random.random() < table.shadow_rate:
+            self._submit_shadow(table.models[table.shadow], tokens_s, student_model,
+                                None if spans else predictions_s, elapsed)
+        return name, predictions_s
+
+    def _submit_shadow(self, shadow_model, tokens_s, primary_model, predictions_s, primary_seconds):
+        """
+        The agreement is measured on tags, for span requests the primary tags are read back from its cache
+        """
+        with self._stats_lock:
+            stats = self._shadow_stats
+            if stats is None:
+                return
+            if self._shadow_pending >= self.max_shadow_pending:
+                stats.dropped += 1
+                return
+            self._shadow_pending += 1
+
+        def run_shadow():
+            try:
+                primary_predictions_s = predictions_s or primary_model.predict(tokens_s)
+                begin = time.perf_counter()
+                shadow_predictions_s = shadow_model.predict(tokens_s)
+                shadow_seconds = time.perf_counter() - begin
+                with self._stats_lock:
+                    stats.add(primary_predictions_s, shadow_predictions_s, primary_seconds, shadow_seconds)
+            except Exception:
+                with self._stats_lock:
+                    stats.errors += 1
+            finally:
+                with self._stats_lock:
+                    self._shadow_pending -= 1
+
+        self._shadow_executor.submit(run_shadow)
+
+    @property
+    def stats(self):
+        table = self._table
+        with self._stats_lock:
+            return {
+                'default': table.default,
+                'weights': table.weights,
+                'models': {name: {'manifest': student_model.manifest_path,
+                                  'latency': self._latency[name].summary() if name in self._latency else None,
+                                  'cache': student_model.cache_stats}
+                           for name, student_model in table.models.items()},
+                'shadow': self._shadow_stats.summary() if self._shadow_stats is not None else None,
+            }
+
+    def shutdown(self):
+        self._shadow_executor.shutdown(wait=True)
@@ -0,0 +1,171 @@
+import argparse
+import json
+import multiprocessing
+import os
+from collections import deque
+from itertools import islice
+
+import torch
+from tqdm.auto import tqdm
+
+from stud.data_loader.corpus_stats import iter_tsv_sentences
+from stud.data_loader.dataset_tokenizer import iter_shards
+from stud.implementation import StudentModel, DEFAULT_MANIFEST
+
+"""
+Offline bulk tagging: streams a tsv (task format) or plain text (one whitespace tokenized sentence per line) corpus,
+splits it into shards of consecutive sentences, tags the shards on worker processes each holding its own model, and
+writes the predictions in input order as conll, tsv or jsonl. Inside a shard sentences are batched by length.
+Blank lines of a text corpus are kept as empty sentences, so that output sentence i is always input line i.
+After every shard the output is synced and "<output>.progress" records how far it got, running the same command
+again resumes from there.
+
+    PYTHONPATH=hw1 python -m stud.tag_corpus data/corpus.txt --output tagged.jsonl --format jsonl --workers 8
+"""
+
+_model = None
+
+
+def _init_worker(device, threads, manifest_path):
+    global _model
+    torch.set_num_threads(threads)
+    _model = StudentModel(device, manifest_path=manifest_path)
+
+
+def _tag_shard(sentences, batch_size):
+    """
+    Tags a shard, batching sentences of similar length together to keep padding low
+    """
+    labels = [[] for _ in sentences]
+    order = sorted((idx for idx, tokens in enumerate(sentences) if tokens), key=lambda idx: len(sentences[idx]))
+    for start in range(0, len(order), batch_size):
+        batch = order[start: start + batch_size]
+        for idx, predictions in zip(batch, _model.predict([sentences[idx] for idx in batch])):
+            labels[idx] = predictions
+    return labels
+
+
+def iter_sentences(file_path, input_format):
+    if input_format == 'tsv':
+        for tokens, _ in iter_tsv_sentences(file_path):
+            yield tokens
+    else:
+        with open(file_path, encoding='utf-8', mode='r') as file_:
+            for line in file_:
+                yield line.split()
+
+
+def format_sentence(tokens, labels, output_format):
+    if output_format == 'jsonl':
+        return json.dumps({'tokens': tokens, 'labels': labels}) + '\n'
+    if output_format == 'tsv':
+        rows = [f'{idx}\t{token}\t{label}' for idx, (token, label) in enumerate(zip(tokens, labels), start=1)]
+        return '\n'.join([f"# {' '.join(tokens)}", *rows]) + '\n\n'
+    return ''.join(f'{token}\t{label}\n' for token, label in zip(tokens, labels)) + '\n'
+
+
+class ProgressFile:
+    """
+    Number of shards fully written and the output size at that point, replaced atomically after every shard
+    """
+
+    def __init__(self, output_path, shard_size):
+        self.path = f'{output_path}.progress'
+        self.shard_size = shard_size
+        self.shards_done, self.sentences_done, self.output_bytes = 0, 0, 0
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8', mode='r') as f:
+                state = json.load(f)
+            if state['shard_size'] != shard_size:
+                raise ValueError(f"Can not resume with shard size {shard_size}, the run to resume used "
+                                 f"{state['shard_size']}")
+            self.shards_done, self.sentences_done, self.output_bytes = \
+                state['shards_done'], state['sentences_done'], state['output_bytes']
+
+    def update(self, num_sentences, output_bytes):
+        self.shards_done += 1
+        self.sentences_done += num_sentences
+        self.output_bytes = output_bytes
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, encoding='utf-8', mode='w') as f:
+            json.dump({'shard_size': self.shard_size, 'shards_done': self.shards_done,
+                       'sentences_done': self.sentences_done, 'output_bytes': self.output_bytes}, f)
+        os.replace(tmp_path, self.path)
+
+
+def tag_corpus(input_path, output_path, input_format='tsv', output_format='conll', device='cpu', workers=1,
+               shard_size=10000, batch_size=128, max_pending=None, manifest_path=None):
+    """
+    Args:
+        input_path:
+        output_path:
+        input_format: 'tsv' or 'text'
+        output_format: 'conll', 'tsv' or 'jsonl'
+        device:
+        workers: number of worker processes, each loads its own model
+        shard_size: sentences per shard, the unit of work and of resumption
+        batch_size: sentences per forward pass inside a shard
+        max_pending: max shards read ahead of the writer, bounds memory, defaults to 2 per worker
+        manifest_path: manifest of the model to tag with (see models.registry), defaults to DEFAULT_MANIFEST
+
+    Returns:
+        number of sentences tagged
+    """
+    progress = ProgressFile(output_path, shard_size)
+    if progress.shards_done and (not os.path.exists(output_path) or
+                                 os.path.getsize(output_path) < progress.output_bytes):
+        raise ValueError(f'{output_path} is missing or shorter than the {progress.output_bytes} bytes recorded in '
+                         f'{progress.path}, delete {progress.path} to tag the corpus from the start')
+    max_pending = max_pending or 2 * workers
+    # resolved here, the workers may not share the current directory
+    manifest_path = os.path.abspath(manifest_path or DEFAULT_MANIFEST)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # CUDA can not be used in forked processes
+    context = multiprocessing.get_context('spawn' if device == 'cuda' else None)
+
+    mode = 'r+b' if progress.shards_done else 'wb'
+    with open(output_path, mode=mode) as out, \
+            context.Pool(workers, initializer=_init_worker, initargs=(device, threads, manifest_path)) as pool:
+        # drops whatever was written after the last completed shard
+        out.seek(progress.output_bytes)
+        out.truncate()
+        progress_bar = tqdm(desc='Tagging', unit=' sentences', initial=progress.sentences_done)
+        shards = iter_shards(iter_sentences(input_path, input_format), shard_size)
+        pending = deque()
+
+        def write_next():
+            sentences, result = pending.popleft()
+            for tokens, labels in zip(sentences, result.get()):
+                out.write(format_sentence(tokens, labels, output_format).encode('utf-8'))
+            out.flush()
+            os.fsync(out.fileno())
+            progress.update(len(sentences), out.tell())
+            progress_bar.update(len(sentences))
+
+        for shard in islice(shards, progress.shards_done, None):
+            pending.append((shard, pool.apply_async(_tag_shard, (shard, batch_size))))
+            if len(pending) >= max_pending:
+                write_next()
+        while pending:
+            write_next()
+        progress_bar.close()
+    return progress.sentences_done
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tags a corpus offline with sharded, parallel workers')
+    parser.add_argument('input', type=str, help='corpus to tag')
+    parser.add_argument('--output', type=str, required=True)
+    parser.add_argument('--manifest', type=str, default=os.path.join(os.getcwd(), DEFAULT_MANIFEST),
+                        help='manifest of the model to tag with')
+    parser.add_argument('--input-format', choices=['tsv', 'text'], default='tsv')
+    parser.add_argument('--format', choices=['conll', 'tsv', 'jsonl'], default='conll')
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument('--shard-size', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=128)
+    args = parser.parse_args()
+
+    tagged = tag_corpus(args.input, args.output, args.input_format, args.format, args.device, args.workers,
+                        args.shard_size, args.batch_size, manifest_path=args.manifest)
+    print(f"{tagged} sentences tagged, written to {args.output}")
@@ -1,3 +1,3 @@
-from stud.training.train import Trainer, CRF_Trainer
+from stud.training.train import Trainer, CRF_Trainer, Distillation_Trainer
 from stud.training.earlystopping import EarlyStopping
 from stud.training.writeTensorBoard import WriterTensorboardX
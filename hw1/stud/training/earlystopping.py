@@ -34,6 +34,13 @@ class EarlyStopping(object):
 
         return False
 
+    def state_dict(self):
+        return {'best': self.best, 'num_bad_epochs': self.num_bad_epochs}
+
+    def load_state_dict(self, state_dict):
+        self.best = state_dict['best']
+        self.num_bad_epochs = state_dict['num_bad_epochs']
+
     def _init_is_better(self, mode, min_delta, percentage):
         if mode not in {'min', 'max'}:
             raise ValueError('mode ' + mode + ' is unknown!')
@@ -1,21 +1,52 @@
+import os
 import time
 import logging
+import itertools
 import torch
 from stud.callbacks import ProgressBar
+from stud.utilities import CheckpointWriter, training_state, restore_training_state
 from stud.training.earlystopping import EarlyStopping
 from tqdm.auto import tqdm
 from torch.nn.utils import clip_grad_norm_
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 import pkbar
+import torch.nn.functional as F
 from sklearn.metrics import f1_score
 
-try:
-    from torchcrf import CRF
-except ModuleNotFoundError:
-    import os
 
-    os.system('pip install pytorch-crf')
-    from torchcrf import CRF
+def iterate_from(data_loader, start_step=0):
+    """
+    Enumerates the batches of a DataLoader, skipping the first start_step ones when resuming mid-epoch.
+    A BucketBatchSampler skips them without loading them, any other sampler has them loaded and discarded.
+    """
+    batch_sampler = getattr(data_loader, 'batch_sampler', None)
+    if start_step and hasattr(batch_sampler, 'start_batch'):
+        batch_sampler.start_batch = start_step
+        return enumerate(data_loader, start=start_step)
+    return itertools.islice(enumerate(data_loader), start_step, None)
+
+
+def save_training_state(checkpoint_writer, model, optimizer, epoch, step, scheduler, early_stopping, data_loader,
+                        **extra):
+    """
+    Hands the full training state to the checkpoint writer as "<model name>_last.pth", if there is one
+    """
+    if checkpoint_writer is None:
+        return
+    state = training_state(model, optimizer, epoch, step, scheduler, early_stopping,
+                           getattr(data_loader, 'batch_sampler', None), **extra)
+    checkpoint_writer.save(state, f'{model.name}_last.pth')
+
+
+def resume_training_state(resume_from, model, optimizer, scheduler, early_stopping, data_loader):
+    """
+    Returns:
+        (start epoch, start step, trainer's running values) of a training_state checkpoint or of a fresh start
+    """
+    if resume_from is None:
+        return 0, 0, {}
+    return restore_training_state(resume_from, model, optimizer, scheduler, early_stopping,
+                                  getattr(data_loader, 'batch_sampler', None))
 
 
 class F1_score(object):
@@ -38,7 +69,7 @@ class F1_score(object):
 
 
 class Trainer:
-    def __init__(self, model, loss_function, optimizer, batch_num, num_classes, verbose):
+    def __init__(self, model, loss_function, optimizer, batch_num, num_classes, verbose, checkpoint_writer=None):
         """
         Creates a trainer object to train baseline models
         Args:
@@ -48,15 +79,17 @@ class Trainer:
             batch_num:
             num_classes:
             verbose:
+            checkpoint_writer: CheckpointWriter the resumable training state is written to
         """
         self.model = model
         self.loss_function = loss_function
         self.optimizer = optimizer
         self._verbose = verbose
+        self.checkpoint_writer = checkpoint_writer
         self.evaluator = F1_score(num_classes)
         self.progressbar = ProgressBar(n_batch=batch_num, loss_name='loss')
 
-    def train(self, train_dataset, valid_dataset, epochs=1, save_to=None):
+    def train(self, train_dataset, valid_dataset, epochs=1, save_to=None, resume_from=None, checkpoint_every=None):
         """
         Train the model on a given train dataset, and every epoch, computes val_loss. Trainer object is backed up
         with Early Stopping, Gradient clipping, ReduceLROnPlateau to avoid over-fitting.
@@ -65,16 +98,20 @@ class Trainer:
             valid_dataset:
             epochs:
             save_to:
+            resume_from: path of a "<model name>_last.pth" training state to resume from
+            checkpoint_every: also write the training state every this many batches, not only every epoch
 
         Returns:
 
         """
-        train_loss = 0.0
         es = EarlyStopping(patience=5)
-        for epoch in tqdm(range(epochs), desc="Training Epochs"):
-            epoch_loss = 0.0
+        start_epoch, start_step, resumed = resume_training_state(resume_from, self.model, self.optimizer, None, es,
+                                                                 train_dataset)
+        train_loss = resumed.get('train_loss', 0.0)
+        for epoch in tqdm(range(start_epoch, epochs), desc="Training Epochs"):
+            epoch_loss = resumed.get('epoch_loss', 0.0) if epoch == start_epoch else 0.0
             self.model.train()
-            for step, sample in enumerate(train_dataset):
+            for step, sample in iterate_from(train_dataset, start_step if epoch == start_epoch else 0):
                 start = time.time()
                 inputs = sample['inputs']
                 labels = sample['outputs']
@@ -94,6 +131,9 @@ class Trainer:
                                       loss=sample_loss.item(),
                                       f1=f1_score_.item(),
                                       use_time=time.time() - start)
+                if checkpoint_every and (step + 1) % checkpoint_every == 0:
+                    save_training_state(self.checkpoint_writer, self.model, self.optimizer, epoch, step + 1, None, es,
+                                        train_dataset, train_loss=train_loss, epoch_loss=epoch_loss)
 
             avg_epoch_loss = epoch_loss / len(train_dataset)
             train_loss += avg_epoch_loss
@@ -107,6 +147,10 @@ class Trainer:
                 print(
                     f"Early Stopping callback was activated at epoch num: {epoch}")
                 break
+            save_training_state(self.checkpoint_writer, self.model, self.optimizer, epoch + 1, 0, None, es,
+                                train_dataset, train_loss=train_loss)
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.flush()
         avg_epoch_loss = train_loss / epochs
         if save_to is not None:
             torch.save(self.model, save_to)
@@ -143,15 +187,23 @@ class Trainer:
 
 
 class CRF_Trainer:
-    def __init__(self, model, loss_function, optimizer, label_vocab, writer):
+    def __init__(self, model, loss_function, optimizer, label_vocab, writer, checkpoint_writer=None,
+                 accumulation_steps=1):
+        """
+        Args:
+            accumulation_steps: number of micro-batches whose gradients are accumulated before each optimizer
+                                step, the effective batch is accumulation_steps times larger than the loaded one
+        """
         self.model = model
         self.loss_function = loss_function
         self.optimizer = optimizer
         self.label_vocab = label_vocab
         self._device = 'cuda' if torch.cuda.is_available() else 'cpu'
         self.writer = writer
+        self.checkpoint_writer = checkpoint_writer
+        self.accumulation_steps = max(accumulation_steps, 1)
 
-    def train(self, train_dataset, valid_dataset, epochs=1):
+    def train(self, train_dataset, valid_dataset, epochs=1, resume_from=None, checkpoint_every=None):
         """
         Train the model on a given train dataset, and every epoch, computes val_loss. Trainer object is backed up
         with Early Stopping, clip_grad_norm_, ReduceLROnPlateau to avoid over-fitting.
@@ -159,29 +211,39 @@ class CRF_Trainer:
             train_dataset:
             valid_dataset:
             epochs:
+            resume_from: path of a "<model name>_last.pth" training state to resume from
+            checkpoint_every: also write the training state every this many batches, not only every epoch
 
         Returns:
 
         """
         es = EarlyStopping(patience=10)
         scheduler = ReduceLROnPlateau(self.optimizer, 'min', patience=2)
-        train_loss = 0.0
-        epoch, step = 0, 0
-        for epoch in tqdm(range(epochs), desc=f'Training Epoch # {epoch + 1} / {epochs}'):
-            epoch_loss = 0.0
+        start_epoch, start_step, resumed = resume_training_state(resume_from, self.model, self.optimizer, scheduler,
+                                                                 es, train_dataset)
+        train_loss = resumed.get('train_loss', 0.0)
+        epoch, step = start_epoch, start_step
+        for epoch in tqdm(range(start_epoch, epochs), desc=f'Training Epoch # {epoch + 1} / {epochs}'):
+            epoch_loss = resumed.get('epoch_loss', 0.0) if epoch == start_epoch else 0.0
+            num_updates = resumed.get('num_updates', 0) if epoch == start_epoch else 0
             self.model.train()
-            for step, sample in tqdm(enumerate(train_dataset), desc=f'Train on batch # {step + 1}'):
-                inputs, labels = sample['inputs'], sample['outputs']
-                mask = (inputs != 0).to(self._device, dtype=torch.uint8)
-                self.optimizer.zero_grad()
-                # Pass the inputs directly, log_probabilities already calls forward
-                sample_loss = -self.model.log_probs(inputs, labels, mask)
-                sample_loss.backward()
-                clip_grad_norm_(self.model.parameters(), 5.)  # Gradient Clipping
-                self.optimizer.step()
-                epoch_loss += sample_loss.tolist()
-
-            avg_epoch_loss = epoch_loss / len(train_dataset)
+            micro_batches = []
+            batches = iterate_from(train_dataset, start_step if epoch == start_epoch else 0)
+            for step, sample in tqdm(batches, desc=f'Train on batch # {step + 1}'):
+                micro_batches.append(sample)
+                if len(micro_batches) < self.accumulation_steps and step + 1 < len(train_dataset):
+                    continue
+                epoch_loss += self.accumulate_step(micro_batches)
+                num_updates += 1
+                # the training state is only written between optimizer steps, never mid accumulation
+                first_step = step + 1 - len(micro_batches)
+                if checkpoint_every and (step + 1) // checkpoint_every != first_step // checkpoint_every:
+                    save_training_state(self.checkpoint_writer, self.model, self.optimizer, epoch, step + 1,
+                                        scheduler, es, train_dataset, train_loss=train_loss, epoch_loss=epoch_loss,
+                                        num_updates=num_updates)
+                micro_batches = []
+
+            avg_epoch_loss = epoch_loss / max(num_updates, 1)
             train_loss += avg_epoch_loss
             valid_loss, valid_acc = self.evaluate(valid_dataset)
             epoch_summary = f'Epoch #: {epoch + 1} [loss: {avg_epoch_loss:0.4f}, val_loss: {valid_loss:0.4f}]'
@@ -197,10 +259,41 @@ class CRF_Trainer:
             if es.step(valid_loss):
                 print(f"Early Stopping activated on epoch #: {epoch}")
                 break
+            save_training_state(self.checkpoint_writer, self.model, self.optimizer, epoch + 1, 0, scheduler, es,
+                                train_dataset, train_loss=train_loss)
 
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.flush()
         avg_epoch_loss = train_loss / epochs
         return avg_epoch_loss
 
+    def accumulate_step(self, micro_batches):
+        """
+        Performs one optimizer step over several micro-batches. The CRF negative log-likelihood of every
+        sentence is summed and normalized by the number of tokens of all micro-batches, hence the gradients
+        are the ones a single batch made of all of them would get, while the activations of only one
+        micro-batch are live at a time (the inputs of all of them are held)
+        Args:
+            micro_batches: list of padded batches
+
+        Returns:
+            per token loss of the effective batch
+        """
+        masks = [(sample['inputs'] != 0) for sample in micro_batches]
+        num_tokens = max(sum(int(mask.sum()) for mask in masks), 1)
+        self.optimizer.zero_grad()
+        step_loss = 0.0
+        for sample, mask in zip(micro_batches, masks):
+            inputs, labels = sample['inputs'].to(self._device), sample['outputs'].to(self._device)
+            mask = mask.to(self._device, dtype=torch.uint8)
+            # Pass the inputs directly, log_probabilities already calls forward
+            sample_loss = -self.model.log_probs(inputs, labels, mask) / num_tokens
+            sample_loss.backward()
+            step_loss += sample_loss.item()
+        clip_grad_norm_(self.model.parameters(), 5.)  # Gradient Clipping
+        self.optimizer.step()
+        return step_loss
+
     def evaluate(self, valid_dataset):
         """
         Used to compute val_loss on dev/valid dataset
@@ -208,50 +301,76 @@ class CRF_Trainer:
             valid_dataset:
 
         Returns:
-
+            per token val_loss, per token accuracy
         """
-        valid_loss = 0.0
+        valid_loss, num_tokens, num_correct = 0.0, 0, 0
         # set dropout to 0!! Needed when we are in inference mode.
         self.model.eval()
         with torch.no_grad():
             for sample in tqdm(valid_dataset, desc='Computing Val Loss'):
-                inputs = sample['inputs']
-                labels = sample['outputs']
+                inputs = sample['inputs'].to(self._device)
+                labels = sample['outputs'].to(self._device)
                 mask = (inputs != 0).to(self._device, dtype=torch.uint8)
-                sample_loss = -self.model.log_probs(inputs, labels, mask).sum()
-                valid_loss += sample_loss.tolist()
+                # emissions are computed once, for both the CRF NLL and the masked Viterbi decoding
+                log_likelihood, predictions = self.model.log_probs_and_decode(inputs, labels, mask)
+                valid_loss -= log_likelihood.item()
 
-                # Compute accuracy
-                predictions = self.model.predict(inputs)
-                # argmax is a list, must convert to tensor
-                argmax = labels.new_tensor(predictions)
-                acc = (labels == argmax.squeeze()).float().mean()
+                # Compute accuracy over the non padded tokens, decoded sequences are already unpadded
+                valid_labels = labels[mask.bool()].tolist()
+                valid_predictions = [tag for sentence in predictions for tag in sentence]
+                num_correct += sum(p == l for p, l in zip(valid_predictions, valid_labels))
+                num_tokens += len(valid_labels)
 
-        return valid_loss / len(valid_dataset), acc / len(valid_dataset)
+        num_tokens = max(num_tokens, 1)
+        return valid_loss / num_tokens, num_correct / num_tokens
 
 
 class BiLSTM_CRF_POS_Trainer:
     """
     BiLSTM CRF POS Model trainer
     """
-    def __init__(self, model, loss_function, optimizer, label_vocab, writer):
+    def __init__(self, model, loss_function, optimizer, label_vocab, writer, checkpoint_writer=None):
+        """
+        Args:
+            checkpoint_writer: CheckpointWriter the best and the resumable checkpoints are handed to, so that
+                               training never waits for disk I/O. Defaults to a writer on "model/"
+        """
         self.model = model
         self.loss_function = loss_function
         self.optimizer = optimizer
         self.label_vocab = label_vocab
         self._device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.writer = writer
+        self.checkpoint_writer = checkpoint_writer
 
-    def train(self, train_dataset, valid_dataset, epochs=1):
+    def train(self, train_dataset, valid_dataset, epochs=1, resume_from=None, checkpoint_every=None):
+        """
+        Args:
+            train_dataset:
+            valid_dataset:
+            epochs:
+            resume_from: path of a "<model name>_last.pth" training state to resume from
+            checkpoint_every: also write the training state every this many batches, not only every epoch
+
+        Returns:
+
+        """
+        checkpoint_writer = self.checkpoint_writer or CheckpointWriter(os.path.join(os.getcwd(), 'model'),
+                                                                       best_filename=f'{self.model.name}_ckpt_best.pth',
+                                                                       keep_last=1)
         es = EarlyStopping(patience=5)
         scheduler = ReduceLROnPlateau(self.optimizer, 'min', patience=2, verbose=True)
-        train_loss, best_val_loss = 0.0, float(1e4)
-        epoch, step = 0, 0
-        for epoch in range(1, epochs + 1):
-            epoch_loss = 0.0
+        start_epoch, start_step, resumed = resume_training_state(resume_from, self.model, self.optimizer, scheduler,
+                                                                 es, train_dataset)
+        train_loss = resumed.get('train_loss', 0.0)
+        best_val_loss = resumed.get('best_val_loss', float(1e4))
+        start_epoch = max(start_epoch, 1)
+        epoch, step = start_epoch, start_step
+        for epoch in range(start_epoch, epochs + 1):
+            epoch_loss = resumed.get('epoch_loss', 0.0) if epoch == start_epoch else 0.0
             print(f'Epoch: {epoch}/{epochs}')
             bar = pkbar.Kbar(target=len(train_dataset))
-            for step, sample in enumerate(train_dataset):
+            for step, sample in iterate_from(train_dataset, start_step if epoch == start_epoch else 0):
                 self.model.train()
                 inputs, labels, pos = sample['inputs'].to(self._device), sample['outputs'].to(self._device), sample[
                     'pos'].to(self._device)
@@ -264,6 +383,10 @@ class BiLSTM_CRF_POS_Trainer:
                 self.optimizer.step()
                 epoch_loss += sample_loss.tolist()
                 bar.update(step, values=[("loss", sample_loss.item())])
+                if checkpoint_every and (step + 1) % checkpoint_every == 0:
+                    save_training_state(checkpoint_writer, self.model, self.optimizer, epoch, step + 1, scheduler, es,
+                                        train_dataset, train_loss=train_loss, epoch_loss=epoch_loss,
+                                        best_val_loss=best_val_loss)
             avg_epoch_loss = epoch_loss / len(train_dataset)
             train_loss += avg_epoch_loss
             valid_loss = self.evaluate(valid_dataset)
@@ -278,14 +401,18 @@ class BiLSTM_CRF_POS_Trainer:
             if is_best:
                 logging.info("Model Checkpoint saved")
                 best_val_loss = valid_loss
-                model_dir = os.path.join(os.getcwd(), 'model',
-                                         f'{self.model.name}_ckpt_best')
-                self.model.save_checkpoint(model_dir)
+                checkpoint_writer.save(self.model.state_dict(), is_best=True)
             scheduler.step(valid_loss)
             if es.step(valid_loss):
                 print(f"Early Stopping activated on epoch #: {epoch}")
                 break
+            save_training_state(checkpoint_writer, self.model, self.optimizer, epoch + 1, 0, scheduler, es,
+                                train_dataset, train_loss=train_loss, best_val_loss=best_val_loss)
 
+        if self.checkpoint_writer is None:
+            checkpoint_writer.close()
+        else:
+            checkpoint_writer.flush()
         avg_epoch_loss = train_loss / epochs
         return avg_epoch_loss
 
@@ -302,3 +429,135 @@ class BiLSTM_CRF_POS_Trainer:
                 sample_loss = -self.model.log_probs(inputs, labels, mask, pos).sum()
                 valid_loss += sample_loss.tolist()
         return valid_loss / len(valid_dataset)
+
+
+class Distillation_Trainer:
+    """
+    Trains a small tagger (e.g. a narrow, single layer BaselineModel decoded greedily) to imitate a trained CRF_Model:
+    the student per token distributions are fitted to the softened teacher emissions (KL divergence at temperature
+    T, scaled by T^2) and to the gold labels (cross entropy), weighted by alpha and 1 - alpha.
+    """
+
+    def __init__(self, teacher, student, optimizer, temperature=2.0, alpha=0.7, writer=None, checkpoint_writer=None):
+        """
+        Args:
+            teacher: trained CRF_Model, frozen
+            student: model returning per token logits over the same labels
+            optimizer: optimizer of the student parameters
+            temperature: softens both distributions, higher values transfer more of the teacher ranking of labels
+            alpha: weight of the distillation term, 1 - alpha weights the gold labels term
+            writer:
+            checkpoint_writer: CheckpointWriter the resumable training state is written to
+        """
+        self.teacher = teacher
+        self.student = student
+        self.optimizer = optimizer
+        self.temperature = temperature
+        self.alpha = alpha
+        self._device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.writer = writer
+        self.checkpoint_writer = checkpoint_writer
+        self.teacher.eval()
+        for param in self.teacher.parameters():
+            param.requires_grad_(False)
+
+    def soft_targets(self, inputs):
+        """
+        Teacher per token logits the student learns from: its CRF emissions
+        """
+        with torch.no_grad():
+            return self.teacher(inputs)
+
+    def distillation_loss(self, student_logits, teacher_logits, labels, mask):
+        student_logits, teacher_logits, labels = student_logits[mask], teacher_logits[mask], labels[mask]
+        soft_loss = F.kl_div(F.log_softmax(student_logits / self.temperature, dim=-1),
+                             F.softmax(teacher_logits / self.temperature, dim=-1),
+                             reduction='batchmean') * self.temperature ** 2
+        hard_loss = F.cross_entropy(student_logits, labels)
+        return self.alpha * soft_loss + (1 - self.alpha) * hard_loss
+
+    def train(self, train_dataset, valid_dataset, epochs=1, resume_from=None, checkpoint_every=None):
+        """
+        Args:
+            train_dataset:
+            valid_dataset:
+            epochs:
+            resume_from: path of a "<student name>_last.pth" training state to resume from
+            checkpoint_every: also write the training state every this many batches, not only every epoch
+
+        Returns:
+            average training loss
+        """
+        es = EarlyStopping(patience=5)
+        scheduler = ReduceLROnPlateau(self.optimizer, 'min', patience=2)
+        start_epoch, start_step, resumed = resume_training_state(resume_from, self.student, self.optimizer, scheduler,
+                                                                 es, train_dataset)
+        train_loss = resumed.get('train_loss', 0.0)
+        for epoch in tqdm(range(start_epoch, epochs), desc='Distillation Epochs'):
+            epoch_loss = resumed.get('epoch_loss', 0.0) if epoch == start_epoch else 0.0
+            self.student.train()
+            batches = iterate_from(train_dataset, start_step if epoch == start_epoch else 0)
+            for step, sample in tqdm(batches, desc='Distilling batches', leave=False):
+                inputs, labels = sample['inputs'].to(self._device), sample['outputs'].to(self._device)
+                mask = inputs != 0
+                teacher_logits = self.soft_targets(inputs)
+                self.optimizer.zero_grad()
+                sample_loss = self.distillation_loss(self.student(inputs, mask.sum(-1)), teacher_logits, labels, mask)
+                sample_loss.backward()
+                clip_grad_norm_(self.student.parameters(), 5.)  # Gradient Clipping
+                self.optimizer.step()
+                epoch_loss += sample_loss.item()
+                if checkpoint_every and (step + 1) % checkpoint_every == 0:
+                    save_training_state(self.checkpoint_writer, self.student, self.optimizer, epoch, step + 1,
+                                        scheduler, es, train_dataset, train_loss=train_loss, epoch_loss=epoch_loss)
+
+            avg_epoch_loss = epoch_loss / len(train_dataset)
+            train_loss += avg_epoch_loss
+            valid_loss, valid_acc, agreement = self.evaluate(valid_dataset)
+            print(f'Epoch #: {epoch + 1} [loss: {avg_epoch_loss:0.4f}, val_loss: {valid_loss:0.4f}, '
+                  f'val_acc: {valid_acc:0.4f}, teacher agreement: {agreement:0.4f}]')
+
+            if self.writer:
+                self.writer.set_step(epoch, 'train')
+                self.writer.add_scalar('loss', avg_epoch_loss)
+                self.writer.set_step(epoch, 'valid')
+                self.writer.add_scalar('val_loss', valid_loss)
+
+            scheduler.step(valid_loss)
+            if es.step(valid_loss):
+                print(f"Early Stopping activated on epoch #: {epoch}")
+                break
+            save_training_state(self.checkpoint_writer, self.student, self.optimizer, epoch + 1, 0, scheduler, es,
+                                train_dataset, train_loss=train_loss)
+
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.flush()
+        return train_loss / epochs
+
+    def evaluate(self, valid_dataset):
+        """
+        Returns:
+            per token distillation loss, student per token accuracy, share of tokens where student and teacher
+            (Viterbi decoded) agree
+        """
+        valid_loss, num_tokens, num_correct, num_agree = 0.0, 0, 0, 0
+        self.student.eval()
+        with torch.no_grad():
+            for sample in tqdm(valid_dataset, desc='Computing Val Loss', leave=False):
+                inputs, labels = sample['inputs'].to(self._device), sample['outputs'].to(self._device)
+                mask = inputs != 0
+                teacher_logits = self.soft_targets(inputs)
+                student_logits = self.student(inputs, mask.sum(-1))
+                batch_tokens = int(mask.sum())
+                valid_loss += self.distillation_loss(student_logits, teacher_logits, labels, mask).item() * batch_tokens
+
+                predictions = student_logits.argmax(-1)[mask]
+                teacher_predictions = torch.LongTensor([tag for sentence in
+                                                        self.teacher.crf.decode(teacher_logits, mask.to(torch.uint8))
+                                                        for tag in sentence]).to(self._device)
+                num_correct += int((predictions == labels[mask]).sum())
+                num_agree += int((predictions == teacher_predictions).sum())
+                num_tokens += batch_tokens
+
+        num_tokens = max(num_tokens, 1)
+        return valid_loss / num_tokens, num_correct / num_tokens, num_agree / num_tokens
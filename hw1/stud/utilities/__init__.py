@@ -1,3 +1,11 @@
 from stud.utilities.model_utils import (save_checkpoint, load_checkpoint, plot_history, load_pretrained_embeddings,
-                                        torch_summarize, train_pos2vec, save_pos_embeddings)
+                                        torch_summarize, train_pos2vec, save_pos_embeddings, training_state,
+                                        restore_training_state, get_rng_state, set_rng_state,
+                                        fit_oov_embeddings)
 from stud.utilities.utils import configure_workspace, load_pickle, save_pickle, ensure_dir
+from stud.utilities.checkpoint_writer import CheckpointWriter, atomic_save, snapshot_to_cpu
+from stud.utilities.lru_cache import LRUCache
+from stud.utilities.compression import prune_vocabulary, low_rank_factorize, product_quantize, compress_state_dict
+from stud.utilities.mmap_checkpoint import save_mmap_state_dict, load_mmap_state_dict, load_mmap_checkpoint
+from stud.utilities.sliding_window import window_spans, stitch_windows
+from stud.utilities.spans import tags_to_spans
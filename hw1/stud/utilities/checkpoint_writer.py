@@ -0,0 +1,160 @@
+import logging
+import os
+import queue
+import threading
+
+import torch
+
+
+def snapshot_to_cpu(state):
+    """
+    Recursively copies every tensor of a (nested) state to CPU memory, so that the training thread
+    can keep updating the weights in place while the snapshot is being serialized
+    """
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return type(state)((key, snapshot_to_cpu(value)) for key, value in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot_to_cpu(value) for value in state)
+    return state
+
+
+def atomic_save(obj, path):
+    """
+    Serializes obj to a temporary file next to path, flushes it to disk, then renames it over path.
+    Readers either see the previous checkpoint or the new one, never a torn file.
+    """
+    dir_path = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(dir_path, f'.{os.path.basename(path)}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, mode='wb') as f:
+            torch.save(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _fsync_dir(dir_path)
+
+
+def _fsync_dir(dir_path):
+    """
+    Persists the rename itself, not supported on every platform
+    """
+    try:
+        fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints on a background thread, the training thread only pays for copying tensors to CPU.
+    Keeps the last `keep_last` checkpoints plus the best one, older checkpoints are deleted.
+    """
+
+    def __init__(self, checkpoint_dir, best_filename='best.pth', keep_last=3, max_pending=2):
+        """
+        Args:
+            checkpoint_dir: directory checkpoints are written to
+            best_filename: file name of the best checkpoint
+            keep_last: number of most recent checkpoints to keep, 0 keeps only the best one
+            max_pending: max number of snapshots waiting to be written, save(...) blocks beyond it
+                         which bounds the CPU memory held by snapshots
+        """
+        if not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        self.checkpoint_dir = checkpoint_dir
+        self.best_path = os.path.join(checkpoint_dir, best_filename)
+        self.keep_last = keep_last
+        self.saved_paths = []
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name='CheckpointWriter', daemon=True)
+        self._thread.start()
+
+    def save(self, state, filename=None, is_best=False):
+        """
+        Snapshots state to CPU and schedules it to be written
+        Args:
+            state: object to serialize, typically a state_dict or a dict of state_dicts
+            filename: file name of a regular checkpoint, subject to retention. If None only the best
+                      checkpoint is written
+            is_best: whether state is the best checkpoint so far
+
+        Returns:
+
+        """
+        self._raise_pending_error()
+        if filename is None and not is_best:
+            return
+        path = None if filename is None else os.path.join(self.checkpoint_dir, filename)
+        self._queue.put((snapshot_to_cpu(state), path, is_best))
+
+    def flush(self):
+        """
+        Blocks until every scheduled checkpoint is on disk
+        """
+        self._queue.join()
+        self._raise_pending_error()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_pending_error()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            try:
+                self._write(*item)
+            except Exception as e:
+                logging.error(f'Checkpoint could not be written: {e}', exc_info=True)
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, snapshot, path, is_best):
+        if path is None:
+            atomic_save(snapshot, self.best_path)
+            return
+        atomic_save(snapshot, path)
+        if is_best:
+            self._publish_best(snapshot, path)
+        if path in self.saved_paths:
+            self.saved_paths.remove(path)
+        self.saved_paths.append(path)
+        while len(self.saved_paths) > self.keep_last:
+            old_path = self.saved_paths.pop(0)
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    def _publish_best(self, snapshot, path):
+        """
+        Hard links the freshly written checkpoint as the best one rather than serializing it twice,
+        falls back to writing it again where hard links are not supported
+        """
+        tmp_path = f'{self.best_path}.{os.getpid()}.lnk'
+        try:
+            os.link(path, tmp_path)
+            os.replace(tmp_path, self.best_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            atomic_save(snapshot, self.best_path)
+
+    def _raise_pending_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('A previous checkpoint could not be written') from error
@@ -0,0 +1,103 @@
+import torch
+
+SPECIAL_TOKENS = ('<PAD>', '<UNK>', '<BOS>', '<EOS>')
+
+
+def prune_vocabulary(word2idx, token_counts, min_count=2, max_size=None):
+    """
+    Keeps the special tokens and the words seen at least min_count times, most frequent first.
+    Pruned words are encoded as <UNK> afterwards.
+    Args:
+        word2idx:
+        token_counts: {word: count} over the training corpus, e.g. CorpusProfiler.token_counts
+        min_count:
+        max_size: optional max vocabulary size, special tokens included
+
+    Returns:
+        new word2idx, LongTensor of the old indices of the kept rows (new index i <- old row kept_indices[i])
+    """
+    specials = [word for word in SPECIAL_TOKENS if word in word2idx]
+    words = [word for word in word2idx if word not in specials and token_counts.get(word, 0) >= min_count]
+    words.sort(key=lambda word: (-token_counts[word], word2idx[word]))
+    if max_size is not None:
+        words = words[:max(max_size - len(specials), 0)]
+    kept_words = specials + words
+    new_word2idx = {word: idx for idx, word in enumerate(kept_words)}
+    kept_indices = torch.LongTensor([word2idx[word] for word in kept_words])
+    return new_word2idx, kept_indices
+
+
+def low_rank_factorize(weight, rank):
+    """
+    Truncated SVD of an embedding table:
+    weight [Vocab_Size, Embedding_Dim] ~= factors [Vocab_Size, Rank] @ basis [Rank, Embedding_Dim]
+    """
+    u, s, v = torch.svd(weight.float())
+    factors = u[:, :rank] * s[:rank]
+    basis = v[:, :rank].t().contiguous()
+    return factors, basis
+
+
+def kmeans(x, num_centroids, iterations=25, generator=None):
+    """
+    Plain Lloyd's k-means, centroids are initialized from random rows of x, empty clusters keep their centroid
+    Returns:
+        centroids [Num_Centroids, Dim], assignments [Num_Rows]
+    """
+    num_centroids = min(num_centroids, x.shape[0])
+    centroids = x[torch.randperm(x.shape[0], generator=generator)[:num_centroids]].clone()
+    assignments = None
+    for _ in range(iterations):
+        new_assignments = torch.cdist(x, centroids).argmin(dim=1)
+        if assignments is not None and torch.equal(new_assignments, assignments):
+            break
+        assignments = new_assignments
+        sums = torch.zeros_like(centroids).index_add_(0, assignments, x)
+        counts = torch.bincount(assignments, minlength=num_centroids).unsqueeze(1)
+        centroids = torch.where(counts > 0, sums / counts.clamp(min=1), centroids)
+    return centroids, assignments
+
+
+def product_quantize(weight, num_subvectors=30, num_centroids=256, iterations=25, seed=1873337):
+    """
+    Product quantization of an embedding table: each row is split into num_subvectors chunks, every chunk
+    is replaced by the index of its nearest centroid, centroids being learnt per chunk with k-means
+    Returns:
+        codes [Vocab_Size, Num_Subvectors], codebooks [Num_Subvectors, Num_Centroids, Embedding_Dim / Num_Subvectors]
+    """
+    vocab_size, embedding_dim = weight.shape
+    if embedding_dim % num_subvectors != 0:
+        raise ValueError(f'embedding_dim ({embedding_dim}) must be divisible by num_subvectors ({num_subvectors})')
+    generator = torch.Generator().manual_seed(seed)
+    subvectors = weight.float().reshape(vocab_size, num_subvectors, embedding_dim // num_subvectors)
+    codes = torch.zeros(vocab_size, num_subvectors, dtype=torch.long)
+    codebooks = torch.zeros(num_subvectors, num_centroids, embedding_dim // num_subvectors)
+    for m in range(num_subvectors):
+        centroids, assignments = kmeans(subvectors[:, m], num_centroids, iterations, generator)
+        codebooks[m, :centroids.shape[0]] = centroids
+        codes[:, m] = assignments
+    return codes, codebooks
+
+
+def compress_state_dict(state_dict, kept_indices=None, method=None, rank=64, num_subvectors=30, num_centroids=256):
+    """
+    Prunes (kept_indices) then compresses ('low_rank' or 'pq') the word embeddings of a CRF_Model state_dict,
+    the result loads into a CRF_Model whose hparams.embedding_compression is method
+    """
+    state_dict = dict(state_dict)
+    weight = state_dict.pop('word_embedding.weight').cpu()
+    if kept_indices is not None:
+        weight = weight[kept_indices]
+    if method is None:
+        state_dict['word_embedding.weight'] = weight
+    elif method == 'low_rank':
+        factors, basis = low_rank_factorize(weight, rank)
+        state_dict['word_embedding.factors.weight'] = factors
+        state_dict['word_embedding.basis'] = basis
+    elif method == 'pq':
+        codes, codebooks = product_quantize(weight, num_subvectors, num_centroids)
+        state_dict['word_embedding.codes'] = codes.to(torch.uint8 if num_centroids <= 256 else torch.int32)
+        state_dict['word_embedding.codebooks'] = codebooks
+    else:
+        raise ValueError(f'Unknown embedding compression: {method}')
+    return state_dict
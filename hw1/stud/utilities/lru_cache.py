@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread safe least recently used cache, bounded by a number of entries and optionally by a total weight
+    (e.g. number of tokens), which keeps the memory it holds fixed whatever the traffic is.
+    Keeps hits, misses and evictions counts.
+    """
+
+    def __init__(self, max_entries=10000, max_weight=None, weigher=None):
+        """
+        Args:
+            max_entries: max number of cached entries
+            max_weight: optional bound of the sum of the entries weights
+            weigher: function(key, value) -> weight of an entry, defaults to 1 per entry
+        """
+        self.max_entries = max_entries
+        self.max_weight = max_weight
+        self.weigher = weigher or (lambda key, value: 1)
+        self._entries = OrderedDict()
+        self._weights = {}
+        self._lock = threading.Lock()
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        weight = self.weigher(key, value)
+        if self.max_entries <= 0 or (self.max_weight is not None and weight > self.max_weight):
+            return
+        with self._lock:
+            if key in self._entries:
+                self.weight -= self._weights[key]
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._weights[key] = weight
+            self.weight += weight
+            while len(self._entries) > self.max_entries or \
+                    (self.max_weight is not None and self.weight > self.max_weight):
+                old_key, _ = self._entries.popitem(last=False)
+                self.weight -= self._weights.pop(old_key)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._weights.clear()
+            self.weight = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries),
+                'weight': self.weight,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+import torch
+
+from stud.utilities.checkpoint_writer import _fsync_dir
+
+"""
+Memory mappable state_dict format:
+    8 bytes magic | 8 bytes little endian header length | JSON header | padding | tensors data
+The header maps every tensor name to its dtype, shape and offset in the file, offsets are aligned to ALIGNMENT
+bytes. Loading maps the file and binds the tensors to the module parameters without copying them: load time and
+resident memory at startup do not depend on the model size, pages are read lazily and shared by every process
+mapping the file.
+"""
+
+MAGIC = b'NERMMAP1'
+ALIGNMENT = 64
+
+_DTYPES = {torch.float32: 'float32', torch.float64: 'float64', torch.float16: 'float16', torch.int64: 'int64',
+           torch.int32: 'int32', torch.int16: 'int16', torch.int8: 'int8', torch.uint8: 'uint8', torch.bool: 'bool'}
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def is_mmap_checkpoint(path):
+    with open(path, mode='rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save_mmap_state_dict(state_dict, path):
+    """
+    Writes a state_dict in the memory mappable format, atomically (temporary file then rename)
+    """
+    arrays, tensors_info, offset = [], {}, 0
+    for name, tensor in state_dict.items():
+        if tensor.dtype not in _DTYPES:
+            raise TypeError(f"Tensor '{name}' has an unsupported dtype: {tensor.dtype}")
+        array = tensor.detach().cpu().contiguous().numpy()
+        offset = _aligned(offset)
+        tensors_info[name] = {'dtype': _DTYPES[tensor.dtype], 'shape': list(array.shape), 'offset': offset}
+        arrays.append((offset, array))
+        offset += array.nbytes
+
+    header = json.dumps({'alignment': ALIGNMENT, 'tensors': tensors_info}).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    dir_path = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(dir_path, f'.{os.path.basename(path)}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, mode='wb') as f:
+            f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+            for tensor_offset, array in arrays:
+                f.seek(data_start + tensor_offset)
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _fsync_dir(dir_path)
+
+
+def load_mmap_state_dict(path):
+    """
+    Maps a checkpoint written by save_mmap_state_dict, returned tensors are views over the mapping.
+    The mapping is copy on write: pages are shared until a tensor is modified in place.
+    """
+    with open(path, mode='rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{path}' is not a memory mapped checkpoint")
+        header_len, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    data_start = _aligned(len(MAGIC) + 8 + header_len)
+    buffer = np.memmap(path, dtype=np.uint8, mode='c')
+
+    state_dict = {}
+    for name, info in header['tensors'].items():
+        dtype = np.dtype(info['dtype'])
+        count = int(np.prod(info['shape'], dtype=np.int64))
+        start = data_start + info['offset']
+        array = buffer[start: start + count * dtype.itemsize].view(dtype).reshape(info['shape'])
+        state_dict[name] = torch.from_numpy(array)
+    return state_dict
+
+
+def bind_state_dict(module, state_dict):
+    """
+    Replaces the module parameters & buffers by the given tensors instead of copying them (load_state_dict copies).
+    Parameters are frozen, the module is meant for inference.
+    """
+    expected = set(module.state_dict().keys())
+    missing, unexpected = expected - set(state_dict), set(state_dict) - expected
+    if missing or unexpected:
+        raise RuntimeError(f'Error(s) in binding state_dict: missing keys {sorted(missing)}, '
+                           f'unexpected keys {sorted(unexpected)}')
+    for name, tensor in state_dict.items():
+        module_path, _, attr = name.rpartition('.')
+        owner = module
+        for attr_name in module_path.split('.') if module_path else []:
+            owner = getattr(owner, attr_name)
+        current = getattr(owner, attr)
+        if tuple(current.shape) != tuple(tensor.shape):
+            raise RuntimeError(f"Size mismatch for '{name}': checkpoint {tuple(tensor.shape)}, "
+                               f"model {tuple(current.shape)}")
+        if attr in owner._parameters:
+            setattr(owner, attr, torch.nn.Parameter(tensor, requires_grad=False))
+        else:
+            owner._buffers[attr] = tensor
+    # RNNs keep a list of their weights to hand them to the fused kernels
+    for submodule in module.modules():
+        if isinstance(submodule, torch.nn.RNNBase) and hasattr(submodule, '_flat_weights_names'):
+            submodule._flat_weights = [getattr(submodule, weight) for weight in submodule._flat_weights_names]
+
+
+def load_mmap_checkpoint(module, path, device='cpu'):
+    """
+    Loads a memory mapped checkpoint into module: bound without copy on CPU, copied to the device otherwise
+    """
+    state_dict = load_mmap_state_dict(path)
+    if torch.device(device).type == 'cpu':
+        bind_state_dict(module, state_dict)
+        module.memory_mapped = True
+    else:
+        module.load_state_dict(state_dict)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts a torch.save state_dict checkpoint to the mmap format')
+    parser.add_argument('checkpoint', type=str, help='state_dict checkpoint written by torch.save')
+    parser.add_argument('output', type=str, help='memory mapped checkpoint path')
+    args = parser.parse_args()
+    save_mmap_state_dict(torch.load(args.checkpoint, map_location='cpu'), args.output)
+    print(f"Memory mapped checkpoint written to {args.output}")
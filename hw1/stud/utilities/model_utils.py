@@ -1,5 +1,6 @@
 import io
 import os
+import random
 import torch
 import multiprocessing
 from gensim.models import Word2Vec
@@ -8,7 +9,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from tqdm.auto import tqdm
 
-from stud.models import BaselineModel
+from stud.utilities.checkpoint_writer import atomic_save
 
 
 def save_checkpoint(state, is_best, filename='/output/checkpoint.pth.tar'):
@@ -24,7 +25,7 @@ def save_checkpoint(state, is_best, filename='/output/checkpoint.pth.tar'):
     """
     if is_best:
         print("Saving a new best model")
-        torch.save(state, filename)  # save checkpoint
+        atomic_save(state, filename)  # save checkpoint
 
 
 def load_checkpoint(resume_weights_path, hyperparams):
@@ -37,19 +38,105 @@ def load_checkpoint(resume_weights_path, hyperparams):
     Returns:
 
     """
-    cuda = torch.cuda.is_available()
-    if cuda:
-        checkpoint = torch.load(resume_weights_path)
+    from stud.models import BaselineModel
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    checkpoint = torch.load(resume_weights_path, map_location=torch.device(device))
 
     start_epoch = checkpoint['epoch']
-    best_validation_loss = checkpoint['best_val_loss']
+    best_validation_loss = checkpoint.get('best_val_loss')
     model = BaselineModel(hyperparams)
-    model.load_state_dict(checkpoint['state_dict'])
+    model.load_state_dict(checkpoint['state_dict'] if 'state_dict' in checkpoint else checkpoint['model'])
     print(
-        f"loaded checkpoint '{checkpoint}' (trained for {start_epoch} epochs, val loss: {best_validation_loss})")
+        f"loaded checkpoint '{resume_weights_path}' (trained for {start_epoch} epochs, val loss: {best_validation_loss})")
     return model
 
 
+def get_rng_state():
+    """
+    Captures python, numpy and torch (CPU & CUDA) random generators states
+    """
+    return {'python': random.getstate(),
+            'numpy': np.random.get_state(),
+            'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None}
+
+
+def set_rng_state(rng_state):
+    random.setstate(rng_state['python'])
+    np.random.set_state(rng_state['numpy'])
+    torch.set_rng_state(rng_state['torch'].cpu())
+    if rng_state.get('cuda') is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([state.cpu() for state in rng_state['cuda']])
+
+
+def training_state(model, optimizer, epoch, step, scheduler=None, early_stopping=None, sampler=None, **extra):
+    """
+    Gathers everything needed to resume training exactly where it stopped
+    Args:
+        model:
+        optimizer:
+        epoch: epoch to resume from
+        step: number of batches of that epoch already trained on
+        scheduler: lr scheduler exposing state_dict()
+        early_stopping: EarlyStopping object
+        sampler: batch sampler exposing state_dict(), e.g. BucketBatchSampler
+        **extra: trainer's running values, e.g. accumulated losses
+
+    Returns:
+        state dict, to be written with atomic_save or a CheckpointWriter
+    """
+    return {'epoch': epoch,
+            'step': step,
+            'model': model.state_dict(),
+            'optimizer': optimizer.state_dict(),
+            'scheduler': scheduler.state_dict() if scheduler is not None else None,
+            'early_stopping': early_stopping.state_dict() if early_stopping is not None else None,
+            'sampler': sampler.state_dict() if hasattr(sampler, 'state_dict') else None,
+            'rng': get_rng_state(),
+            'extra': extra}
+
+
+def _load_training_state(path, device):
+    """
+    The training state holds the python & numpy random generators states, which torch >= 2.6 no longer unpickles
+    by default (weights_only), older versions do not know the argument
+    """
+    try:
+        return torch.load(path, map_location=torch.device(device), weights_only=False)
+    except TypeError:
+        return torch.load(path, map_location=torch.device(device))
+
+
+def restore_training_state(path, model, optimizer, scheduler=None, early_stopping=None, sampler=None):
+    """
+    Restores a training_state(...) checkpoint in place, on whichever device is available
+    Args:
+        path:
+        model:
+        optimizer:
+        scheduler:
+        early_stopping:
+        sampler:
+
+    Returns:
+        (epoch, step, extra) to resume the training loop from
+    """
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    state = _load_training_state(path, device)
+    model.load_state_dict(state['model'])
+    optimizer.load_state_dict(state['optimizer'])
+    if scheduler is not None and state.get('scheduler') is not None:
+        scheduler.load_state_dict(state['scheduler'])
+    if early_stopping is not None and state.get('early_stopping') is not None:
+        early_stopping.load_state_dict(state['early_stopping'])
+    if hasattr(sampler, 'load_state_dict') and state.get('sampler') is not None:
+        sampler.load_state_dict(state['sampler'])
+    set_rng_state(state['rng'])
+    print(f"Resuming training from '{path}' (epoch: {state['epoch']}, step: {state['step']})")
+    return state['epoch'], state['step'], state.get('extra', {})
+
+
 def load_pretrained_embeddings(file_name, word2idx, embeddings_size, is_crf=False, save_to=None):
     """
     Loads pretrained embeddings for Fasttext files, creates tensors full of zeros [vocab size, Embedding size], and
@@ -93,6 +180,50 @@ def load_pretrained_embeddings(file_name, word2idx, embeddings_size, is_crf=Fals
     return pretrained_embeddings
 
 
+def fit_oov_embeddings(model, word2idx, epochs=10, batch_size=512, lr=1e-2, verbose=True):
+    """
+    Trains the hashed char n-grams embeddings of a trained model (model.oov_embedding) to reproduce its word
+    embeddings from their spelling, so that at inference <UNK> tokens get a vector close to the one
+    a similarly spelled in-vocabulary word has. Only the n-grams embeddings are updated.
+    Args:
+        model: model having word_embedding & oov_embedding (i.e. CRF_Model built with hparams.oov_buckets > 0)
+        word2idx:
+        epochs:
+        batch_size:
+        lr:
+        verbose:
+
+    Returns:
+        final mean squared error
+    """
+    if getattr(model, 'oov_embedding', None) is None:
+        raise ValueError('model has no OOV embeddings, set hparams.oov_buckets > 0')
+    words = [word for word in word2idx if not (word.startswith('<') and word.endswith('>'))]
+    targets = model.word_embedding.weight.detach()
+    optimizer = torch.optim.Adam(model.oov_embedding.parameters(), lr=lr)
+    device = targets.device
+    was_training = model.training
+    model.train()
+    epoch_loss = 0.0
+    for epoch in range(epochs):
+        random.shuffle(words)
+        epoch_loss = 0.0
+        for start in range(0, len(words), batch_size):
+            batch = words[start: start + batch_size]
+            indices = torch.LongTensor([word2idx[word] for word in batch]).to(device)
+            optimizer.zero_grad()
+            loss = torch.nn.functional.mse_loss(model.oov_embedding(batch), targets[indices])
+            loss.backward()
+            optimizer.step()
+            epoch_loss += loss.item() * len(batch)
+        epoch_loss /= max(len(words), 1)
+        if verbose:
+            print(f'| OOV Epoch: {epoch + 1:02} | MSE: {epoch_loss:.6f} |')
+    model.train(was_training)
+    model.oov_cache.clear()
+    return epoch_loss
+
+
 def plot_history(history):
     """
     Utility function to plot training history [NOT USED]
@@ -0,0 +1,38 @@
+def window_spans(length, window_size=None, overlap=0):
+    """
+    Splits a sentence into overlapping windows of at most window_size tokens, the last one ends on the sentence end
+    Args:
+        length: sentence length
+        window_size: None keeps the sentence whole
+        overlap: tokens shared by two consecutive windows
+
+    Returns:
+        list of (start, end) spans covering the sentence
+    """
+    if window_size is None or length <= window_size:
+        return [(0, length)]
+    if not 0 <= overlap < window_size:
+        raise ValueError(f'overlap ({overlap}) must be in [0, window_size ({window_size}))')
+    stride = window_size - overlap
+    starts = list(range(0, length - window_size + 1, stride))
+    if starts[-1] + window_size < length:
+        starts.append(length - window_size)
+    return [(start, start + window_size) for start in starts]
+
+
+def stitch_windows(length, spans, windows_tags, policy='center'):
+    """
+    Merges the tags predicted on overlapping windows back into one tags list.
+    'center': a token takes the tag of the window where it is farthest from an edge, i.e. where the BiLSTM
+              had the most context on both sides
+    'first': a token takes the tag of the first window covering it
+    """
+    if policy not in ('center', 'first'):
+        raise ValueError(f'Unknown merge policy: {policy}')
+    tags, best_scores = [None] * length, [float('-inf')] * length
+    for (start, end), window_tags in zip(spans, windows_tags):
+        for offset, tag in enumerate(window_tags):
+            score = min(offset, end - start - 1 - offset) if policy == 'center' else -start
+            if score > best_scores[start + offset]:
+                tags[start + offset], best_scores[start + offset] = tag, score
+    return tags
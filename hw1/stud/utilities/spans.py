@@ -0,0 +1,45 @@
+import torch
+
+
+def tags_to_spans(tags, lengths, outside_idx, scores=None, pad_idx=0):
+    """
+    Groups runs of the same entity tag (IO tagging) into spans, vectorized over the whole batch: span boundaries
+    are found by comparing the tags tensor with itself shifted by one position, no per token Python loop
+    Args:
+        tags: [Samples_Num, Seq_Len] tag ids tensor
+        lengths: [Samples_Num] sentences lengths, positions beyond them are padding
+        outside_idx: tag id of "O"
+        scores: optional [Samples_Num, Seq_Len] per token confidence, a span scores the mean of its tokens
+        pad_idx: tag id of "<PAD>", never part of a span
+
+    Returns:
+        list (one per sentence) of lists of (start, end, tag id, score) spans, end excluded, score None if no
+        scores are given
+    """
+    if tags.numel() == 0:
+        return [[] for _ in range(tags.shape[0])]
+    positions = torch.arange(tags.shape[1], device=tags.device).unsqueeze(0)
+    entity = (positions < lengths.to(tags.device).unsqueeze(1)) & (tags != outside_idx) & (tags != pad_idx)
+    # a span starts where the previous token is not an entity or has another type, and ends symmetrically
+    no_entity = torch.zeros_like(entity[:, :1])
+    previous_entity = torch.cat([no_entity, entity[:, :-1]], dim=1)
+    next_entity = torch.cat([entity[:, 1:], no_entity], dim=1)
+    same_as_previous = torch.cat([no_entity, tags[:, 1:] == tags[:, :-1]], dim=1)
+    same_as_next = torch.cat([tags[:, 1:] == tags[:, :-1], no_entity], dim=1)
+    starts = (entity & ~(previous_entity & same_as_previous)).nonzero()
+    ends = (entity & ~(next_entity & same_as_next)).nonzero()
+    # nonzero is row major, so the i-th start and the i-th end belong to the same span
+    rows, start_cols, end_cols = starts[:, 0], starts[:, 1], ends[:, 1] + 1
+    span_tags = tags[rows, start_cols]
+
+    span_scores = None
+    if scores is not None:
+        cumulative = torch.cat([torch.zeros_like(scores[:, :1]), scores.cumsum(dim=1)], dim=1)
+        span_scores = ((cumulative[rows, end_cols] - cumulative[rows, start_cols]) /
+                       (end_cols - start_cols).to(scores.dtype)).tolist()
+
+    spans_s = [[] for _ in range(tags.shape[0])]
+    for idx, (row, start, end, tag) in enumerate(zip(rows.tolist(), start_cols.tolist(), end_cols.tolist(),
+                                                     span_tags.tolist())):
+        spans_s[row].append((start, end, tag, span_scores[idx] if span_scores is not None else None))
+    return spans_s
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the stud package is imported the way the server does, from the hw1 directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,72 @@
+import importlib
+import json
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('flask')
+
+from stud import implementation, protocol  # noqa: E402
+
+
+class ConstantTagger:
+    name = 'default'
+    manifest_path = None
+    cache_stats = None
+    idx2label = {0: '<PAD>', 1: 'O'}
+    label2idx = {'<PAD>': 0, 'O': 1}
+
+    def predict(self, tokens_s):
+        return [['O'] * len(tokens) for tokens in tokens_s]
+
+
+@pytest.fixture(scope='module')
+def client():
+    # app.py builds its default model at import time
+    patch = pytest.MonkeyPatch()
+    patch.setattr(implementation, 'build_model', lambda device: ConstantTagger())
+    patch.delenv('EXTRA_MODELS', raising=False)
+    app = importlib.import_module('app')
+    patch.undo()
+    return app.app.test_client()
+
+
+def test_known_model(client):
+    response = client.post('/', json={'tokens_s': [['a', 'b']]}, headers={'X-Model': 'default'})
+    assert response.status_code == 200 and response.json['predictions_s'] == [['O', 'O']]
+
+
+def test_unknown_model_json_request(client):
+    response = client.post('/', json={'tokens_s': [['a']]}, headers={'X-Model': 'missing'})
+    assert response.status_code == 404
+    assert response.json['message'] == 'Unknown model: missing'
+
+
+def test_unknown_model_labels(client):
+    assert client.get('/labels', headers={'X-Model': 'missing'}).status_code == 404
+
+
+def test_unknown_model_binary_request(client):
+    response = client.post('/', data=protocol.encode_tokens([['a']]), content_type=protocol.CONTENT_TYPE,
+                           headers={'X-Model': 'missing'})
+    assert response.status_code == 404
+
+
+def test_malformed_request_is_still_a_bad_request(client):
+    assert client.post('/', json={'sentences': [['a']]}).status_code == 400
+
+
+def test_stream(client):
+    body = b'["a", "b"]\n{"tokens": ["c"]}\n\n["d"]'
+    response = client.post('/stream?batch_size=2&echo=0', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200 and response.headers['X-Model'] == 'default'
+    assert [json.loads(line) for line in response.get_data(as_text=True).splitlines()] == [
+        {'index': 0, 'predictions': ['O', 'O']}, {'index': 1, 'predictions': ['O']},
+        {'index': 2, 'predictions': ['O']}]
+
+
+def test_stream_reports_errors_in_band(client):
+    response = client.post('/stream?batch_size=1', data=b'["a"]\nnot json\n', content_type='application/x-ndjson')
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0] == {'index': 0, 'predictions': ['O'], 'tokens': ['a']}
+    assert lines[1]['error'] == 'Bad request' and lines[1]['index'] == 1
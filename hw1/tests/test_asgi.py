@@ -0,0 +1,86 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('torch')
+
+import asgi  # noqa: E402
+
+
+class ConstantTagger:
+    idx2label = {0: '<PAD>', 1: 'O'}
+    label2idx = {'<PAD>': 0, 'O': 1}
+    cache_stats = None
+
+    def predict(self, tokens_s):
+        return [['O'] * len(tokens) for tokens in tokens_s]
+
+
+@pytest.fixture
+def service(monkeypatch):
+    service = asgi.InferenceService(max_queue=4, workers=1)
+    monkeypatch.setattr(asgi, 'service', service)
+    yield service
+    service.executor.shutdown(wait=True)
+
+
+def request(method, path, chunks=(b'',), query=b'', content_type=b'application/json'):
+    """
+    Runs one request through the ASGI app, the body arriving in the given chunks
+
+    Returns:
+        status, body
+    """
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': idx < len(chunks) - 1}
+                for idx, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+             'headers': [(b'content-type', content_type)]}
+    asyncio.run(asgi.app(scope, receive, send))
+    return sent[0]['status'], b''.join(message.get('body', b'') for message in sent[1:])
+
+
+def test_not_ready_until_the_model_is_loaded(service):
+    assert request('GET', '/health')[0] == 200
+    assert request('GET', '/ready')[0] == 503
+    assert request('POST', '/', [b'{"tokens_s": [["a"]]}'])[0] == 503
+    assert request('POST', '/stream', [b'["a"]\n'])[0] == 503
+
+
+def test_json_request(service):
+    service.model = ConstantTagger()
+    status, body = request('POST', '/', [b'{"tokens_s": [["a", "b"]], "echo": false}'])
+    assert status == 200 and json.loads(body) == {'predictions_s': [['O', 'O']]}
+    assert request('POST', '/', [b'{"sentences": []}'])[0] == 400
+
+
+def test_full_queue_is_rejected(service):
+    service.model = ConstantTagger()
+    service.max_queue = 0
+    status, body = request('POST', '/', [b'{"tokens_s": [["a"]]}'])
+    assert status == 503 and json.loads(body)['message'] == 'Too many pending requests'
+
+
+def test_stream_reads_lines_across_chunks(service):
+    service.model = ConstantTagger()
+    chunks = [b'["a", "b"]\n{"tok', b'ens": ["c"]}\n\n', b'["d"]']
+    status, body = request('POST', '/stream', chunks, query=b'batch_size=2&echo=0')
+    assert status == 200
+    assert [json.loads(line) for line in body.decode('utf-8').splitlines()] == [
+        {'index': 0, 'predictions': ['O', 'O']}, {'index': 1, 'predictions': ['O']},
+        {'index': 2, 'predictions': ['O']}]
+
+
+def test_stream_reports_errors_in_band(service):
+    service.model = ConstantTagger()
+    status, body = request('POST', '/stream', [b'["a"]\nnot json\n'], query=b'batch_size=1')
+    lines = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+    assert status == 200 and lines[0]['index'] == 0 and lines[1]['error'] == 'Bad request' and lines[1]['index'] == 1
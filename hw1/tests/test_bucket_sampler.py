@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+pytest.importorskip('torch')
+
+from stud.data_loader.bucket_sampler import BucketBatchSampler  # noqa: E402
+
+
+def make_sampler(**kwargs):
+    lengths = [random.Random(idx).randint(1, 40) for idx in range(200)]
+    return BucketBatchSampler(lengths, max_tokens=120, **kwargs)
+
+
+def test_batches_respect_max_tokens_and_cover_the_dataset():
+    sampler = make_sampler()
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    assert sorted(idx for batch in batches for idx in batch) == list(range(200))
+    assert all(len(batch) * max(sampler.lengths[idx] for idx in batch) <= 120 for batch in batches)
+
+
+def test_epochs_are_deterministic_given_the_seed():
+    first, second = make_sampler(), make_sampler()
+    assert list(first) == list(second)
+    # __iter__ moves to the next epoch, whose shuffling differs
+    assert list(first) == list(second) != first.batches(epoch=0)
+
+
+def test_start_batch_resumes_mid_epoch():
+    sampler = make_sampler()
+    sampler.set_epoch(3)
+    full_epoch = list(sampler)
+
+    resumed = make_sampler()
+    resumed.load_state_dict({'epoch': 3, 'seed': sampler.seed})
+    resumed.start_batch = 5
+    assert list(resumed) == full_epoch[5:]
+    # start_batch only applies to the epoch being resumed
+    assert resumed.epoch == 4 and list(resumed) == sampler.batches(epoch=4)
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip('torch')
+
+from stud.implementation import CascadeModel  # noqa: E402
+
+
+class FixedTagger:
+    """
+    Tags every token with the same label & confidence, counting the sentences it tagged
+    """
+
+    def __init__(self, name, label, score):
+        self.name, self.label, self.score = name, label, score
+        self.manifest, self.manifest_path, self.model = {'vocab': {'sha256': 'vocab'}}, None, None
+        self.idx2label = {0: '<PAD>', 1: 'O', 2: 'PER'}
+        self.label2idx = {label: idx for idx, label in self.idx2label.items()}
+        self.tagged = 0
+
+    def predict_with_confidence(self, tokens_s):
+        self.tagged += len(tokens_s)
+        return [([self.label] * len(tokens), [self.score] * len(tokens)) for tokens in tokens_s]
+
+
+def test_confident_sentences_skip_the_full_model():
+    gate, full = FixedTagger('gate', 'O', 0.99), FixedTagger('full', 'PER', 1.0)
+    cascade = CascadeModel(gate, full, threshold=0.9)
+    assert cascade.predict([['a', 'b'], ['c']]) == [['O', 'O'], ['O']]
+    assert full.tagged == 0
+    assert cascade.cascade_stats['forwarded_rate'] == 0.0
+
+
+def test_unconfident_sentences_are_forwarded():
+    gate, full = FixedTagger('gate', 'O', 0.5), FixedTagger('full', 'PER', 1.0)
+    cascade = CascadeModel(gate, full, threshold=0.9)
+    assert cascade.predict([['a', 'b']]) == [['PER', 'PER']]
+    assert cascade.cascade_stats['forwarded_rate'] == 1.0
+
+
+def test_audited_sentences_serve_the_full_predictions():
+    gate, full = FixedTagger('gate', 'O', 0.99), FixedTagger('full', 'PER', 1.0)
+    cascade = CascadeModel(gate, full, threshold=0.9, audit_rate=1.0, seed=0)
+    assert cascade.predict([['a', 'b'], ['c']]) == [['PER', 'PER'], ['PER']]
+    stats = cascade.cascade_stats
+    assert (stats['forwarded'], stats['audited'], stats['audit_misses']) == (0, 2, 2)
+
+    cascade.reset_stats()
+    assert cascade.cascade_stats['sentences'] == 0 and cascade.cascade_stats['audited'] == 0
@@ -0,0 +1,56 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from stud.utilities.compression import prune_vocabulary, low_rank_factorize, product_quantize, \
+    compress_state_dict  # noqa: E402
+
+
+def test_prune_vocabulary_keeps_specials_and_frequent_words():
+    word2idx = {'<PAD>': 0, '<UNK>': 1, 'rare': 2, 'common': 3, 'often': 4, 'tie': 5}
+    token_counts = {'rare': 1, 'common': 9, 'often': 4, 'tie': 4}
+    new_word2idx, kept_indices = prune_vocabulary(word2idx, token_counts, min_count=2)
+    # most frequent first, ties keep their old order
+    assert list(new_word2idx) == ['<PAD>', '<UNK>', 'common', 'often', 'tie']
+    assert kept_indices.tolist() == [0, 1, 3, 4, 5]
+    new_word2idx, kept_indices = prune_vocabulary(word2idx, token_counts, min_count=1, max_size=4)
+    assert list(new_word2idx) == ['<PAD>', '<UNK>', 'common', 'often']
+    assert kept_indices.tolist() == [0, 1, 3, 4]
+
+
+def test_low_rank_factorize_is_exact_at_full_rank():
+    weight = torch.randn(12, 5, generator=torch.Generator().manual_seed(0))
+    factors, basis = low_rank_factorize(weight, rank=5)
+    assert factors.shape == (12, 5) and basis.shape == (5, 5)
+    assert torch.allclose(factors @ basis, weight, atol=1e-5)
+    factors, basis = low_rank_factorize(weight, rank=2)
+    assert (factors @ basis).shape == weight.shape
+
+
+def test_product_quantize_reconstructs_repeated_rows():
+    # as many centroids as distinct rows: every chunk is its own centroid
+    rows = torch.randn(3, 4, generator=torch.Generator().manual_seed(0))
+    weight = rows.repeat(4, 1)
+    codes, codebooks = product_quantize(weight, num_subvectors=2, num_centroids=3)
+    assert codes.shape == (12, 2) and codebooks.shape == (2, 3, 2)
+    reconstructed = torch.cat([codebooks[m][codes[:, m]] for m in range(2)], dim=1)
+    assert torch.allclose(reconstructed, weight)
+    with pytest.raises(ValueError):
+        product_quantize(weight, num_subvectors=3)
+
+
+def test_compress_state_dict_prunes_then_compresses():
+    state_dict = {'word_embedding.weight': torch.randn(6, 4), 'classifier.bias': torch.zeros(3)}
+    kept_indices = torch.LongTensor([0, 1, 3])
+    pruned = compress_state_dict(state_dict, kept_indices)
+    assert torch.equal(pruned['word_embedding.weight'], state_dict['word_embedding.weight'][kept_indices])
+    assert pruned['classifier.bias'] is state_dict['classifier.bias']
+    low_rank = compress_state_dict(state_dict, kept_indices, method='low_rank', rank=2)
+    assert 'word_embedding.weight' not in low_rank
+    assert low_rank['word_embedding.factors.weight'].shape == (3, 2)
+    assert low_rank['word_embedding.basis'].shape == (2, 4)
+    pq = compress_state_dict(state_dict, method='pq', num_subvectors=2, num_centroids=4)
+    assert pq['word_embedding.codes'].dtype == torch.uint8
+    assert pq['word_embedding.codebooks'].shape == (2, 4, 2)
+    with pytest.raises(ValueError):
+        compress_state_dict(state_dict, method='zip')
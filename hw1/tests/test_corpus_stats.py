@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('nltk')
+
+from stud.data_loader.corpus_stats import CorpusProfiler, iter_tsv_sentences  # noqa: E402
+
+TSV = ('# id 0\n1\tThe\tO\n2\tRome\tLOC\n\n'
+       '# id 1\n1\tPaolo\tPER\n2\tvisits\tO\n3\tRome\tLOC\n\n'
+       '# id 2\n1\tthe\tO\n')
+
+
+def test_tsv_sentences_are_streamed(tmp_path):
+    path = tmp_path / 'dev.tsv'
+    path.write_text(TSV, encoding='utf-8')
+    assert list(iter_tsv_sentences(str(path))) == [(['The', 'Rome'], ['O', 'LOC']),
+                                                   (['Paolo', 'visits', 'Rome'], ['PER', 'O', 'LOC']),
+                                                   (['the'], ['O'])]
+
+
+def test_profiler_counts_and_summary(tmp_path):
+    path = tmp_path / 'dev.tsv'
+    path.write_text(TSV, encoding='utf-8')
+    profiler = CorpusProfiler(vocab={'the', 'rome'}).update_from_file(str(path))
+    assert profiler.num_sentences == 3 and profiler.num_tokens == 6
+    assert profiler.token_counts == {'the': 2, 'rome': 2, 'paolo': 1, 'visits': 1}
+    assert profiler.label_counts == {'O': 3, 'LOC': 2, 'PER': 1}
+    summary = profiler.to_json(str(tmp_path / 'stats.json'), coverage=0.5, num_buckets=3)
+    assert json.loads((tmp_path / 'stats.json').read_text(encoding='utf-8')) == summary
+    assert summary['types'] == 4
+    assert summary['oov_rate'] == pytest.approx(2 / 6)
+    assert summary['sentence_length']['max'] == 3
+    assert summary['suggested_max_len'] == 2
+    assert summary['bucket_boundaries'] == [1, 2, 3]
+    assert summary['vocabulary_cutoffs']['2'] == {'vocab_size': 2, 'token_coverage': pytest.approx(4 / 6)}
+
+
+def test_merged_shards_match_a_single_pass():
+    sentences = [['a', 'b'], ['b'], ['c', 'a', 'b'], ['a'] * 7]
+    single = CorpusProfiler()
+    for tokens in sentences:
+        single.update(tokens)
+    merged = CorpusProfiler().update(sentences[0]).update(sentences[1])
+    merged.merge(CorpusProfiler().update(sentences[2]).update(sentences[3]))
+    assert merged.summary() == single.summary()
+    assert single.bucket_boundaries(num_buckets=2) == [2, 7]
+    assert single.vocabulary_cutoffs(min_freqs=(1, 3)) == {
+        1: {'vocab_size': 3, 'token_coverage': 1.0},
+        3: {'vocab_size': 2, 'token_coverage': pytest.approx(12 / 13)},
+    }
@@ -0,0 +1,56 @@
+import itertools
+
+import pytest
+
+torch = pytest.importorskip('torch')
+torchcrf = pytest.importorskip('torchcrf')
+
+from stud.models.models import crf_marginals  # noqa: E402
+
+
+def brute_force_marginals(crf, emissions, length):
+    """
+    Enumerates every tag path of one sentence, each weighted by its probability under the CRF (exp of the log
+    likelihood torchcrf computes)
+    """
+    num_tags = emissions.shape[-1]
+    marginals = torch.zeros(length, num_tags, dtype=torch.float64)
+    total = 0.0
+    for path in itertools.product(range(num_tags), repeat=length):
+        tags = torch.tensor([path])
+        mask = torch.ones_like(tags, dtype=torch.bool)
+        probability = crf(emissions[None, :length], tags, mask, reduction='sum').exp().item()
+        total += probability
+        for position, tag in enumerate(path):
+            marginals[position, tag] += probability
+    return marginals, total
+
+
+def test_marginals_match_brute_force_enumeration():
+    torch.manual_seed(0)
+    num_tags, seq_len = 3, 4
+    crf = torchcrf.CRF(num_tags, batch_first=True).double()
+    for param in crf.parameters():
+        torch.nn.init.normal_(param)
+    emissions = torch.randn(3, seq_len, num_tags, dtype=torch.float64)
+    lengths = [4, 2, 1]
+    mask = torch.tensor([[1] * length + [0] * (seq_len - length) for length in lengths], dtype=torch.uint8)
+
+    with torch.no_grad():
+        marginals = crf_marginals(crf, emissions, mask)
+        for row, length in enumerate(lengths):
+            expected, total = brute_force_marginals(crf, emissions[row], length)
+            assert total == pytest.approx(1.0)
+            assert torch.allclose(marginals[row, :length], expected, atol=1e-8)
+            assert torch.allclose(marginals[row, :length].sum(-1), torch.ones(length, dtype=torch.float64))
+            # padding positions carry no probability mass
+            assert not marginals[row, length:].any()
+
+
+def test_unmasked_marginals_cover_every_position():
+    torch.manual_seed(1)
+    crf = torchcrf.CRF(4, batch_first=True)
+    emissions = torch.randn(2, 5, 4)
+    with torch.no_grad():
+        marginals = crf_marginals(crf, emissions)
+    assert torch.allclose(marginals.sum(-1), torch.ones(2, 5), atol=1e-5)
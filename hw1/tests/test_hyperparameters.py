@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from stud.models.hyperparameters import HyperParameters  # noqa: E402
+from stud.models.models import BiLSTM_CRF_POS_Model  # noqa: E402
+
+
+def test_round_trip_keeps_the_pos_fields():
+    hparams = HyperParameters('pos_model', 50, 5, None, 32)
+    hparams.pos_vocab_size = 12
+    hparams.hidden_dim, hparams.embedding_dim, hparams.num_layers = 8, 6, 1
+    hparams.pos_embeddings = torch.randn(12, 6)
+    config = json.loads(json.dumps(hparams.to_dict()))
+    assert 'pos_embeddings' not in config and config['pos_vocab_size'] == 12
+
+    rebuilt = HyperParameters.from_dict(config)
+    assert vars(rebuilt).keys() == vars(hparams).keys()
+    assert rebuilt.pos_vocab_size == 12 and rebuilt.pos_embeddings is None
+    assert BiLSTM_CRF_POS_Model(rebuilt).pos_embedding.num_embeddings == 12
+
+    pos_embeddings = torch.randn(12, 6)
+    model = BiLSTM_CRF_POS_Model(HyperParameters.from_dict(config, pos_embeddings_=pos_embeddings))
+    assert torch.equal(model.pos_embedding.weight.data, pos_embeddings)
+
+
+def test_configs_without_pos_fields_still_load():
+    config = HyperParameters('crf', 50, 5, None, 32).to_dict()
+    del config['pos_vocab_size']
+    assert HyperParameters.from_dict(config).pos_vocab_size == 0
@@ -0,0 +1,19 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from stud.models.models import IDCNNEncoder  # noqa: E402
+
+
+def test_padding_does_not_leak():
+    torch.manual_seed(0)
+    encoder = IDCNNEncoder(8, filters=6, num_blocks=2).eval()
+    x = torch.randn(2, 5, 8)
+    mask = torch.tensor([[1, 1, 1, 0, 0], [1, 1, 1, 1, 1]], dtype=torch.uint8)
+    noisy = x.clone()
+    noisy[0, 3:] = 100 * torch.randn(2, 8)
+    with torch.no_grad():
+        encoded, noisy_encoded, unpadded = encoder(x, mask), encoder(noisy, mask), encoder(x[:1, :3], mask[:1, :3])
+    assert torch.allclose(encoded, noisy_encoded)
+    assert torch.allclose(encoded[0, :3], unpadded[0], atol=1e-6)
+    assert not encoded[0, 3:].any()
@@ -0,0 +1,52 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from stud.utilities.mmap_checkpoint import (  # noqa: E402
+    save_mmap_state_dict, load_mmap_state_dict, is_mmap_checkpoint, load_mmap_checkpoint)
+
+
+class Tagger(torch.nn.Module):
+    def __init__(self):
+        super(Tagger, self).__init__()
+        self.embedding = torch.nn.Embedding(10, 4)
+        self.lstm = torch.nn.LSTM(4, 3, bidirectional=True, batch_first=True)
+        self.classifier = torch.nn.Linear(6, 5)
+        self.register_buffer('steps', torch.tensor([7], dtype=torch.int64))
+
+    def forward(self, x):
+        return self.classifier(self.lstm(self.embedding(x))[0])
+
+
+def test_round_trip_keeps_every_tensor(tmp_path):
+    state_dict = {'weights': torch.randn(3, 5), 'mask': torch.tensor([True, False]), 'ids': torch.arange(7),
+                  'empty': torch.zeros(0, 4)}
+    path = str(tmp_path / 'model.mmap')
+    save_mmap_state_dict(state_dict, path)
+    assert is_mmap_checkpoint(path)
+    loaded = load_mmap_state_dict(path)
+    assert loaded.keys() == state_dict.keys()
+    for name, tensor in state_dict.items():
+        assert loaded[name].dtype == tensor.dtype and torch.equal(loaded[name], tensor)
+
+
+def test_bound_module_predicts_like_the_original(tmp_path):
+    torch.manual_seed(0)
+    original, restored = Tagger().eval(), Tagger().eval()
+    path = str(tmp_path / 'tagger.mmap')
+    save_mmap_state_dict(original.state_dict(), path)
+    load_mmap_checkpoint(restored, path)
+
+    inputs = torch.tensor([[1, 2, 3], [4, 5, 0]])
+    with torch.no_grad():
+        assert torch.allclose(restored(inputs), original(inputs))
+    assert restored.memory_mapped and not restored.classifier.weight.requires_grad
+    assert torch.equal(restored.steps, original.steps)
+
+
+def test_torch_checkpoints_are_not_mmap(tmp_path):
+    path = str(tmp_path / 'model.pth')
+    torch.save({'weights': torch.ones(2)}, path)
+    assert not is_mmap_checkpoint(path)
+    with pytest.raises(ValueError):
+        load_mmap_state_dict(path)
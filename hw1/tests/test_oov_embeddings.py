@@ -0,0 +1,47 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from stud.models.hyperparameters import HyperParameters  # noqa: E402
+from stud.models.models import CRF_Model, HashedCharNgramEmbedding  # noqa: E402
+
+
+def test_ngram_hashing_is_stable():
+    # FNV-1a test vectors, the buckets of a word must not depend on the process
+    assert HashedCharNgramEmbedding.fnv1a('') == 0x811c9dc5
+    assert HashedCharNgramEmbedding.fnv1a('a') == 0xe40c292c
+    embedding = HashedCharNgramEmbedding(1000, 4, min_n=3, max_n=4)
+    # "<ab>" itself, then its 3-grams and its 4-gram
+    assert len(embedding.ngram_ids('ab')) == 1 + 2 + 1
+    assert all(0 <= idx < 1000 for idx in embedding.ngram_ids('zürich'))
+
+
+def build_model(oov_buckets):
+    hparams = HyperParameters('oov', 10, 5, None, 2)
+    hparams.hidden_dim, hparams.embedding_dim, hparams.num_layers = 4, 6, 1
+    hparams.oov_buckets, hparams.oov_ngram_range = oov_buckets, (2, 3)
+    return CRF_Model(hparams).eval()
+
+
+def test_unknown_tokens_get_composed_vectors():
+    torch.manual_seed(0)
+    model = build_model(oov_buckets=64)
+    x = torch.tensor([[4, 1, 1], [1, 5, 0]])
+    tokens = [['rome', 'zurich', 'bern'], ['zurich', 'paris']]
+    with torch.no_grad():
+        embeddings = model.embed(x, tokens)
+        expected = model.oov_embedding(['zurich', 'bern'])
+    assert torch.allclose(embeddings[0, 1], expected[0]) and torch.allclose(embeddings[0, 2], expected[1])
+    # the same OOV word gets the same vector, composed once
+    assert torch.equal(embeddings[1, 0], embeddings[0, 1])
+    assert model.oov_cache.stats['entries'] == 2
+    # known words & padding keep their table vectors
+    assert torch.equal(embeddings[0, 0], model.word_embedding.weight[4])
+    assert torch.equal(embeddings[1, 2], model.word_embedding.weight[0])
+
+
+def test_disabled_by_default():
+    model = build_model(oov_buckets=0)
+    x = torch.tensor([[1, 2]])
+    with torch.no_grad():
+        assert torch.equal(model.embed(x, [['zurich', 'x']]), model.word_embedding(x))
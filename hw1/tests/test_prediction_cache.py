@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip('torch')
+
+from stud.implementation import StudentModel  # noqa: E402
+from stud.utilities.lru_cache import LRUCache  # noqa: E402
+
+
+def test_lru_evicts_the_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache and cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats['evictions'] == 1 and cache.stats['hits'] == 3
+
+
+def test_lru_weight_bound():
+    cache = LRUCache(max_entries=10, max_weight=5, weigher=lambda key, value: len(key))
+    cache.put(('a', 'b', 'c'), 1)
+    cache.put(('d', 'e'), 2)
+    cache.put(('f',), 3)
+    assert ('a', 'b', 'c') not in cache and cache.weight == 3
+    # an entry heavier than the whole cache is never stored
+    cache.put(tuple('abcdef'), 4)
+    assert tuple('abcdef') not in cache and len(cache) == 2
+
+
+def test_only_distinct_uncached_sentences_reach_the_model():
+    student_model = object.__new__(StudentModel)
+    student_model.cache = LRUCache(max_entries=100)
+    batches = []
+
+    def predict_batch(tokens):
+        batches.append(tokens)
+        return [[('O', 0.5)] * len(sentence) for sentence in tokens]
+
+    student_model._predict_batch = predict_batch
+    assert student_model.predict([['Rome', 'is'], ['rome', 'IS'], ['hi']]) == [['O', 'O'], ['O', 'O'], ['O']]
+    assert batches == [[['rome', 'is'], ['hi']]]
+    student_model.predict([['ROME', 'is'], ['new']])
+    assert batches[1:] == [[['new']]]
+    assert student_model.cache_stats['hits'] == 1
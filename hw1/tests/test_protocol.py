@@ -0,0 +1,54 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from stud import protocol  # noqa: E402
+
+
+def test_tokens_round_trip():
+    tokens_s = [['Zürich', 'è', 'bella', '東京'], [], ['naïve', '', 'café']]
+    is_encoded, decoded = protocol.decode_request(protocol.encode_tokens(tokens_s))
+    assert not is_encoded
+    assert decoded == tokens_s
+
+
+def test_token_ids_round_trip():
+    ids_s = [[4, 17, 2 ** 31 - 1], [], [1]]
+    buffer = protocol.encode_token_ids(ids_s, spans=True)
+    is_encoded, decoded = protocol.decode_request(buffer)
+    assert is_encoded
+    assert protocol.wants_spans(buffer)
+    assert [ids.tolist() for ids in decoded] == ids_s
+
+
+def test_spans_flag_is_off_by_default():
+    assert not protocol.wants_spans(protocol.encode_tokens([['a']]))
+    assert protocol.wants_spans(protocol.encode_tokens([['a']], spans=True))
+
+
+def test_empty_request():
+    assert protocol.decode_request(protocol.encode_tokens([])) == (False, [])
+    assert protocol.decode_tags(protocol.encode_tags([])) == []
+    assert protocol.decode_spans(protocol.encode_spans([])) == []
+
+
+def test_tags_round_trip():
+    tag_ids_s = [[4, 1, 1, 4], [], [2]]
+    assert [tags.tolist() for tags in protocol.decode_tags(protocol.encode_tags(tag_ids_s))] == tag_ids_s
+
+
+def test_spans_round_trip():
+    spans_s = [[(0, 2, 1, 0.5), (3, 4, 3, 0.25)], [], [(0, 1, 2, 1.0)]]
+    assert protocol.decode_spans(protocol.encode_spans(spans_s)) == spans_s
+
+
+def test_decode_rejects_other_payloads():
+    with pytest.raises(ValueError):
+        protocol.decode_request(b'XXXX' + bytes(5))
+
+
+def test_decode_checks_the_response_kind():
+    with pytest.raises(ValueError):
+        protocol.decode_tags(protocol.encode_spans([[(0, 1, 2, 1.0)]]))
+    with pytest.raises(ValueError):
+        protocol.decode_spans(protocol.encode_tags([[1, 2]]))
@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+
+pytest.importorskip('torch')
+
+from stud import router as router_module  # noqa: E402
+from stud.router import ModelRouter, UnknownModelError  # noqa: E402
+
+
+class ConstantTagger:
+    """
+    Tags every token with one label, optionally waiting on an event first to hold a request in flight
+    """
+
+    def __init__(self, device='cpu', manifest_path=None, label='O', gate=None, **inference):
+        self.name = manifest_path or label
+        self.manifest_path = manifest_path
+        self.label, self.gate = label, gate
+        self.inference = inference
+        self.idx2label = {0: '<PAD>', 1: 'O', 2: 'PER'}
+        self.label2idx = {label: idx for idx, label in self.idx2label.items()}
+        self.cache_stats = None
+        self.started = threading.Event()
+
+    def predict(self, tokens_s):
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        return [[self.label] * len(tokens) for tokens in tokens_s]
+
+
+def test_routes_by_name_split_and_default():
+    router = ModelRouter(seed=0)
+    router.add('a', ConstantTagger(label='O'), default=True)
+    router.add('b', ConstantTagger(label='PER'))
+    assert router.predict([['x']]) == ('a', [['O']])
+    assert router.predict([['x']], 'b') == ('b', [['PER']])
+    router.set_weights({'b': 100})
+    assert router.route()[0] == 'b'
+    with pytest.raises(UnknownModelError):
+        router.route('missing')
+    with pytest.raises(ValueError):
+        router.set_weights({'missing': 10})
+    router.shutdown()
+
+
+def test_hot_swap_keeps_requests_in_flight_on_the_old_model(monkeypatch):
+    monkeypatch.setattr(router_module, 'StudentModel', ConstantTagger)
+    router = ModelRouter()
+    gate = threading.Event()
+    old = ConstantTagger(label='O', gate=gate)
+    router.add('ner', old, default=True)
+    results = {}
+    in_flight = threading.Thread(target=lambda: results.update(old=router.predict([['x', 'y']])))
+    in_flight.start()
+    assert old.started.wait(5)
+
+    # the swap does not wait for the request in flight
+    assert router.load('v2.manifest.json', name='ner', batch_size=8) == 'ner'
+    assert router.table.models['ner'].inference == {'batch_size': 8}
+    assert router.predict([['x']])[1] == [['O']]
+    gate.set()
+    in_flight.join(5)
+    assert results['old'] == ('ner', [['O', 'O']])
+    assert router.table.models['ner'] is not old
+    router.shutdown()
+
+
+def test_shadow_traffic_measures_agreement():
+    router = ModelRouter(seed=0)
+    router.add('a', ConstantTagger(label='O'), default=True)
+    router.add('b', ConstantTagger(label='PER'))
+    router.set_shadow('b', rate=1.0)
+    assert router.predict([['x', 'y'], ['z']]) == ('a', [['O', 'O'], ['O']])
+    router.shutdown()
+
+    shadow = router.stats['shadow']
+    assert (shadow['model'], shadow['requests'], shadow['sentences']) == ('b', 1, 2)
+    assert shadow['token_agreement'] == 0.0 and shadow['sentence_agreement'] == 0.0
+    # the shadowed model itself is never shadowed
+    assert router.stats['models']['a']['latency']['count'] == 1
+
+
+def test_shadow_backlog_is_bounded():
+    router = ModelRouter(max_shadow_pending=1, seed=0)
+    gate = threading.Event()
+    shadow = ConstantTagger(label='PER', gate=gate)
+    router.add('a', ConstantTagger(label='O'), default=True)
+    router.add('b', shadow)
+    router.set_shadow('b', rate=1.0)
+    router.predict([['x']])
+    assert shadow.started.wait(5)
+    router.predict([['x']])
+    gate.set()
+    router.shutdown()
+    assert router.stats['shadow']['requests'] == 1 and router.stats['shadow']['dropped'] == 1
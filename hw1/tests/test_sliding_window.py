@@ -0,0 +1,58 @@
+import pytest
+
+pytest.importorskip('torch')
+
+from stud.utilities.sliding_window import window_spans, stitch_windows  # noqa: E402
+
+
+def test_window_spans_cover_the_sentence():
+    assert window_spans(5, window_size=None) == [(0, 5)]
+    assert window_spans(5, window_size=8, overlap=2) == [(0, 5)]
+    assert window_spans(10, window_size=4, overlap=1) == [(0, 4), (3, 7), (6, 10)]
+    # the last window ends on the sentence end even when the stride does not land there
+    assert window_spans(11, window_size=4, overlap=1) == [(0, 4), (3, 7), (6, 10), (7, 11)]
+    with pytest.raises(ValueError):
+        window_spans(10, window_size=4, overlap=4)
+
+
+def test_stitch_windows_keeps_the_centre_predictions():
+    length = 10
+    spans = window_spans(length, window_size=6, overlap=4)
+    assert spans == [(0, 6), (2, 8), (4, 10)]
+    # every window tags its tokens with its own index, so the stitched tags tell which window won
+    windows_tags = [[window] * (end - start) for window, (start, end) in enumerate(spans)]
+    # a token is taken from the window where it is farthest from an edge, ties going to the earliest window
+    assert stitch_windows(length, spans, windows_tags, policy='center') == [0, 0, 0, 0, 1, 1, 2, 2, 2, 2]
+    assert stitch_windows(length, spans, windows_tags, policy='first') == [0, 0, 0, 0, 0, 0, 1, 1, 2, 2]
+
+
+def test_stitch_windows_single_window_and_pairs():
+    predictions = [('PER', 0.9), ('O', 0.8), ('LOC', 0.7)]
+    assert stitch_windows(3, [(0, 3)], [predictions]) == predictions
+    with pytest.raises(ValueError):
+        stitch_windows(3, [(0, 3)], [predictions], policy='last')
+
+
+class EchoTagger:
+    """
+    Tags every token with its own id, recording the widest batch it was given
+    """
+
+    def __init__(self):
+        self.widest = 0
+
+    def predict_new(self, x, mask=None, tokens=None):
+        self.widest = max(self.widest, x.shape[1])
+        return [row[:int(length)] for row, length in zip(x.tolist(), mask.sum(-1).tolist())]
+
+
+def test_encoded_sentences_are_windowed():
+    from stud.implementation import StudentModel
+
+    student_model = object.__new__(StudentModel)
+    student_model.device, student_model.batch_size = 'cpu', 2
+    student_model.window_size, student_model.window_overlap, student_model.merge_policy = 4, 1, 'center'
+    student_model.model = EchoTagger()
+    token_ids = [list(range(1, 12)), [5, 6], []]
+    assert student_model.predict_encoded(token_ids) == token_ids
+    assert student_model.model.widest <= 4
@@ -0,0 +1,46 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from stud.utilities.spans import tags_to_spans  # noqa: E402
+
+PAD, O, PER, LOC = 0, 1, 2, 3
+
+
+def spans_of(rows, lengths, scores=None):
+    width = max(len(row) for row in rows)
+    tags = torch.tensor([row + [PAD] * (width - len(row)) for row in rows])
+    if scores is not None:
+        scores = torch.tensor([row + [0.0] * (width - len(row)) for row in scores])
+    return tags_to_spans(tags, torch.tensor(lengths), O, scores, pad_idx=PAD)
+
+
+def test_adjacent_same_type_tokens_form_one_span():
+    # IO tagging: a run of the same type is one entity, it cannot be split
+    assert spans_of([[PER, PER, O, PER]], [4]) == [[(0, 2, PER, None), (3, 4, PER, None)]]
+
+
+def test_type_changes_are_boundaries():
+    assert spans_of([[PER, LOC, LOC, PER]], [4]) == [[(0, 1, PER, None), (1, 3, LOC, None), (3, 4, PER, None)]]
+
+
+def test_entity_at_sentence_end():
+    assert spans_of([[O, O, LOC]], [3]) == [[(2, 3, LOC, None)]]
+    assert spans_of([[LOC]], [1]) == [[(0, 1, LOC, None)]]
+
+
+def test_padded_rows():
+    # tags beyond the lengths are never part of a span, even when they are not the padding tag
+    rows = [[PER, PER, PER, PER], [O, LOC], [PER, O, LOC, LOC], []]
+    assert spans_of(rows, [2, 2, 4, 0]) == [[(0, 2, PER, None)], [(1, 2, LOC, None)],
+                                           [(0, 1, PER, None), (2, 4, LOC, None)], []]
+
+
+def test_span_scores_are_the_token_means():
+    spans_s = spans_of([[PER, PER, O, LOC]], [4], scores=[[0.5, 1.0, 0.2, 0.75]])
+    assert [(start, end, tag) for start, end, tag, _ in spans_s[0]] == [(0, 2, PER), (3, 4, LOC)]
+    assert [score for *_, score in spans_s[0]] == pytest.approx([0.75, 0.75])
+
+
+def test_empty_batch():
+    assert tags_to_spans(torch.zeros(2, 0, dtype=torch.long), torch.zeros(2, dtype=torch.long), O) == [[], []]
@@ -0,0 +1,37 @@
+import json
+import multiprocessing
+import os
+
+import pytest
+
+pytest.importorskip('torch')
+
+from stud import tag_corpus  # noqa: E402
+
+
+class UpperTagger:
+    """
+    Tags capitalized tokens PER, remembers the manifest it was built from
+    """
+
+    def __init__(self, device, manifest_path=None):
+        self.manifest_path = manifest_path
+
+    def predict(self, tokens_s):
+        return [[f'PER:{self.manifest_path}' if token.istitle() else 'O' for token in tokens] for tokens in tokens_s]
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='the stub reaches workers by fork')
+def test_text_lines_map_to_output_sentences(tmp_path, monkeypatch):
+    monkeypatch.setattr(tag_corpus, 'StudentModel', UpperTagger)
+    corpus, output = tmp_path / 'corpus.txt', tmp_path / 'tagged.jsonl'
+    corpus.write_text('Anna went home\n\nto Rome\n', encoding='utf-8')
+
+    tagged = tag_corpus.tag_corpus(str(corpus), str(output), 'text', 'jsonl', workers=2, shard_size=1,
+                                   manifest_path='variant.manifest.json')
+    lines = [json.loads(line) for line in output.read_text(encoding='utf-8').splitlines()]
+    # relative manifest paths are resolved before they reach the workers
+    manifest = os.path.abspath('variant.manifest.json')
+    assert tagged == 3
+    assert [line['tokens'] for line in lines] == [['Anna', 'went', 'home'], [], ['to', 'Rome']]
+    assert lines[0]['labels'] == [f'PER:{manifest}', 'O', 'O'] and lines[1]['labels'] == []
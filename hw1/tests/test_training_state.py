@@ -0,0 +1,70 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from torch.optim.lr_scheduler import ReduceLROnPlateau  # noqa: E402
+
+from stud.data_loader.bucket_sampler import BucketBatchSampler  # noqa: E402
+from stud.utilities import CheckpointWriter, training_state, restore_training_state  # noqa: E402
+
+
+class TinyModel(torch.nn.Linear):
+    name = 'tiny'
+
+
+class EarlyStopping:
+    """
+    Same state_dict interface as training.EarlyStopping, whose package pulls in the TkAgg plots
+    """
+
+    def __init__(self):
+        self.best, self.num_bad_epochs = None, 0
+
+    def step(self, metrics):
+        if self.best is None or metrics < self.best:
+            self.best, self.num_bad_epochs = metrics, 0
+        else:
+            self.num_bad_epochs += 1
+
+    def state_dict(self):
+        return {'best': self.best, 'num_bad_epochs': self.num_bad_epochs}
+
+    def load_state_dict(self, state_dict):
+        self.best, self.num_bad_epochs = state_dict['best'], state_dict['num_bad_epochs']
+
+
+def fresh_state(seed):
+    torch.manual_seed(seed)
+    model = TinyModel(4, 3)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+    return (model, optimizer, ReduceLROnPlateau(optimizer, 'min', patience=2), EarlyStopping(),
+            BucketBatchSampler([3, 5, 7, 2], max_tokens=10))
+
+
+def test_resume_state_round_trip(tmp_path):
+    model, optimizer, scheduler, early_stopping, sampler = fresh_state(0)
+    model(torch.randn(2, 4)).sum().backward()
+    optimizer.step()
+    scheduler.step(1.0)
+    early_stopping.step(1.0)
+    early_stopping.step(2.0)
+    sampler.set_epoch(2)
+
+    writer = CheckpointWriter(str(tmp_path))
+    writer.save(training_state(model, optimizer, 2, 7, scheduler, early_stopping, sampler, train_loss=0.5),
+                'tiny_last.pth')
+    writer.close()
+    expected_draw = torch.rand(3)
+
+    restored = fresh_state(1)
+    epoch, step, extra = restore_training_state(str(tmp_path / 'tiny_last.pth'), *restored)
+    model_, optimizer_, scheduler_, early_stopping_, sampler_ = restored
+    assert (epoch, step, extra) == (2, 7, {'train_loss': 0.5})
+    for name, value in model.state_dict().items():
+        assert torch.equal(model_.state_dict()[name], value)
+    assert torch.equal(optimizer_.state_dict()['state'][0]['exp_avg'], optimizer.state_dict()['state'][0]['exp_avg'])
+    assert scheduler_.state_dict()['best'] == scheduler.state_dict()['best']
+    assert early_stopping_.state_dict() == early_stopping.state_dict()
+    assert sampler_.state_dict() == sampler.state_dict() and list(sampler_) == sampler.batches(epoch=2)
+    # the random generators continue from where the checkpoint was taken
+    assert torch.equal(torch.rand(3), expected_draw)
@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('nltk')
+
+from stud.data_loader.dataset_tokenizer import MyTokenizer  # noqa: E402
+from stud.data_loader.parse_dataset import TSVDatasetParser  # noqa: E402
+
+SENTENCES = [['the', 'cat', 'sat'], ['The', 'dog', 'sat'], ['a', 'cat'], ['Rome', '42']] * 5
+
+
+def test_parallel_count_matches_serial_count():
+    serial = MyTokenizer(keepStopwords=True).count_vocab(SENTENCES)
+    parallel = MyTokenizer(keepStopwords=True).count_vocab(iter(SENTENCES), num_workers=2, shard_size=3,
+                                                           max_pending=2)
+    assert parallel == serial
+    assert serial['the'] == 10 and serial['sat'] == 10
+
+
+def test_build_vocab_filters_and_orders_by_frequency():
+    word2idx = MyTokenizer(keepStopwords=True).build_vocab(SENTENCES * 2 + [['rare']], min_count=2,
+                                                            pattern='[a-z]+')
+    assert list(word2idx) == ['<PAD>', '<UNK>', 'cat', 'sat', 'the', 'a', 'dog', 'rome']
+
+
+def test_dataset_vocabulary_is_built_by_the_tokenizer(tmp_path):
+    path = tmp_path / 'train.tsv'
+    lines = []
+    for sentence, tags in [('rome is rome', 'LOC O LOC'), ('paris is big', 'LOC O O')]:
+        lines.append(f'# {sentence}')
+        lines += [f'{idx}\t{word}\t{tag}' for idx, (word, tag) in enumerate(zip(sentence.split(), tags.split()), 1)]
+        lines.append('')
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+    dataset = TSVDatasetParser(str(path), is_crf=True)
+    assert list(dataset.word2idx)[:6] == ['<PAD>', '<UNK>', '<BOS>', '<EOS>', 'is', 'rome']
+    assert len(dataset.word2idx) == 8
+    assert list(TSVDatasetParser(str(path), min_count=2).word2idx) == ['<PAD>', '<UNK>', 'is', 'rome']
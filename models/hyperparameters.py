@@ -10,6 +10,9 @@ class HyperParameters:
         self.dropout = 0.4
         self.embeddings = embeddings_
         self.batch_size = batch_size_
+        # PoS tags embeddings (BiLSTM_CRF_POS_Model), the vocabulary size is 0 for the models not using them
+        self.pos_vocab_size = 0
+        self.pos_embeddings = None
 
     def _print_info(self):
         print(